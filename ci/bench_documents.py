@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark the finalization of documents for Elasticsearch.
+
+Measures documents per second through :py:func:`snafu.utils.documents.finalize_document` against the
+former finalization, which hashed the repr of the source, measured it with ``sys.getsizeof``, built an
+indented JSON debug string whatever the log level, and left the serialization of the source to the
+Elasticsearch client. Both sides include that serialization, so the numbers compare what it costs to get a
+document onto the wire. Documents are shaped like the fio log documents, the most numerous ones.
+
+Usage, with snafu installed::
+
+    python3 ci/bench_documents.py [--docs 100000] [--repeat 3]
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from snafu.utils.documents import finalize_document
+
+
+def fio_log_documents(count: int) -> List[Dict[str, Any]]:
+    """Return ``count`` documents shaped like the fio log documents."""
+
+    start = datetime.datetime(2021, 1, 1)
+    return [
+        {
+            "uuid": "6d2f8a3e-1a2b-4c5d-9e8f-0a1b2c3d4e5f",
+            "user": "snafu",
+            "hostname": "worker-0",
+            "cluster_name": "mycluster",
+            "workload": "fio",
+            "sample": num % 3,
+            "fio_job": "read-4KiB",
+            "log_type": "clat",
+            "timestamp": start + datetime.timedelta(milliseconds=num),
+            "value": 1000 + num % 97,
+            "data_direction": "read",
+            "offset": num * 4096,
+            "block_size": 4096,
+        }
+        for num in range(count)
+    ]
+
+
+def legacy_finalize(source: Dict[str, Any], es_index: str, run_id: str) -> str:
+    """Finalize the document the former way, returning the source as serialized by the ES client."""
+
+    document = {"_index": es_index, "_op_type": "create", "_source": source, "_id": ""}
+    document["run_id"] = source["run_id"] = run_id
+    document["_id"] = hashlib.sha256(str(source).encode()).hexdigest()
+    sys.getsizeof(document)
+    json.dumps(document, indent=4, default=str)
+    return json.dumps(source, default=str)
+
+
+def current_finalize(source: Dict[str, Any], es_index: str, run_id: str) -> str:
+    """Finalize the document, the ES client passes the serialized source through untouched."""
+    return finalize_document(source, es_index, run_id)["_source"]
+
+
+def docs_per_second(finalize: Callable[[Dict[str, Any], str, str], str], docs: int, repeat: int) -> float:
+    """Return the best rate of ``repeat`` runs finalizing ``docs`` fresh documents."""
+
+    best = 0.0
+    for _ in range(repeat):
+        sources = fio_log_documents(docs)
+        beg = time.perf_counter()
+        for source in sources:
+            finalize(source, "snafu-fio-log", "NA")
+        best = max(best, docs / (time.perf_counter() - beg))
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--docs", type=int, default=100000, help="number of documents per run")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    before = docs_per_second(legacy_finalize, args.docs, args.repeat)
+    after = docs_per_second(current_finalize, args.docs, args.repeat)
+    print(f"before: {before:10,.0f} docs/sec")
+    print(f"after:  {after:10,.0f} docs/sec")
+    print(f"speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
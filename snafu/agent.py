@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run snafu jobs from a resident agent, so that each job doesn't pay for starting Python and connecting.
+
+The agent reads job requests as NDJSON, from stdin or from the connections to a Unix socket, and runs them
+on worker processes forked from itself. Workers live as long as the agent: the modules they imported and
+the Elasticsearch and Prometheus clients they connected stay warm for the next jobs they run. Workers aren't
+daemonic, so that jobs can start processes of their own, like the invocations of a suite.
+
+A request is a JSON object such as ``{"id": "fio-1", "tool": "fio", "args": ["--samples", "3"], "env":
+{"es": "https://es:443"}}``, only ``tool`` is required. Responses are written as NDJSON to the stream the
+request came from: a ``queued`` event once the job is accepted, then a ``finished`` event holding its return
+code ``rc``, ``error`` and result ``counters``. Malformed requests get an ``error`` event instead.
+"""
+import concurrent.futures
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import stat
+import threading
+from typing import IO, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("snafu")
+
+Respond = Callable[[Dict[str, Any]], None]
+
+# seconds between two checks of whether the socket server was stopped
+_ACCEPT_TIMEOUT = 0.2
+
+
+def _init_worker() -> None:
+    # output of the jobs would get mixed up with the responses written to stdout
+    os.dup2(2, 1)
+    # interrupting the agent lets the running jobs finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _work(job: Callable[[str, List[str], Dict[str, str]], Dict[str, Any]], jobs: Any, results: Any) -> None:
+    # runs in a worker process until it gets the None sent by Agent.close
+    _init_worker()
+    for job_num, tool, args, env in iter(jobs.get, None):
+        try:
+            results.put((job_num, job(tool, args, env), None))
+        except BaseException as e:  # pylint: disable=W0703
+            results.put((job_num, None, f"{type(e).__name__}: {e}"))
+
+
+def write_response(stream: IO[str]) -> Respond:
+    """Return a thread-safe function writing responses to the given stream, one JSON object per line."""
+
+    lock = threading.Lock()
+
+    def respond(response: Dict[str, Any]) -> None:
+        with lock:
+            stream.write(json.dumps(response) + "\n")
+            stream.flush()
+
+    return respond
+
+
+class Agent:
+    """
+    Run the jobs of the requests it is given on long-lived worker processes fed by a job queue.
+
+    Parameters
+    ----------
+    job : callable
+        Function called in a worker process as ``job(tool, args, env)`` to run a job, returning a dict
+        holding at least its return code ``rc``. Workers inherit it when they are forked.
+    max_jobs : int, optional
+        Number of worker processes, that is the number of jobs run concurrently. Later jobs are queued.
+    """
+
+    def __init__(self, job: Callable[[str, List[str], Dict[str, str]], Dict[str, Any]], max_jobs: int = 1):
+        if max_jobs < 1:
+            raise ValueError(f"The agent needs at least one worker, got {max_jobs}")
+        self.job = job
+        self.max_jobs = max_jobs
+        self._ids = itertools.count(1)
+        self._stopped = threading.Event()
+        self._job_nums = itertools.count()
+        self._pending: Dict[int, concurrent.futures.Future] = {}
+        context = multiprocessing.get_context("fork")
+        self._jobs = context.Queue()
+        self._results = context.SimpleQueue()
+        # forked workers inherit every module imported by the agent, they are forked before the agent
+        # starts any thread
+        self._workers = [
+            context.Process(target=_work, args=(job, self._jobs, self._results), name=f"snafu-agent-{num}")
+            for num in range(max_jobs)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._receiver = threading.Thread(target=self._receive, name="snafu-agent-results", daemon=True)
+        self._receiver.start()
+
+    def _receive(self) -> None:
+        # resolves the pending result of each job, until the None sent by close
+        for job_num, result, error in iter(self._results.get, None):
+            future = self._pending.pop(job_num)
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(error))
+
+    def _parse(self, request: Any) -> Tuple[str, str, List[str], Dict[str, str]]:
+        if not isinstance(request, dict):
+            raise ValueError("Job requests must be JSON objects")
+        tool = request.get("tool")
+        if not isinstance(tool, str) or not tool:
+            raise ValueError("Job requests need a tool name")
+        args = request.get("args", [])
+        if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+            raise ValueError("Job args must be a list of strings")
+        env = request.get("env", {})
+        if not isinstance(env, dict) or not all(isinstance(value, str) for value in env.values()):
+            raise ValueError("Job env must map variable names to strings")
+        job_id = request.get("id")
+        if job_id is None:
+            job_id = f"job-{next(self._ids)}"
+        return str(job_id), tool, args, env
+
+    def submit(self, request: Any, respond: Respond) -> Optional[concurrent.futures.Future]:
+        """
+        Queue the job of the given request, sending its events to ``respond``.
+
+        Returns the pending result of the job, which is only ready once its ``finished`` event was sent, or
+        ``None`` if the request was rejected.
+        """
+
+        try:
+            job_id, tool, args, env = self._parse(request)
+        except ValueError as e:
+            job_id = request.get("id") if isinstance(request, dict) else None
+            respond({"id": job_id, "event": "error", "error": str(e)})
+            return None
+
+        def finished(future: concurrent.futures.Future) -> None:
+            # called from the result thread of the agent, which must not die with a closed connection
+            error = future.exception()
+            if error is None:
+                result = future.result()
+            else:
+                result = {"rc": 1, "error": str(error), "counters": None}
+            try:
+                respond(dict(result, id=job_id, tool=tool, event="finished"))
+            except Exception as e:  # pylint: disable=W0703
+                logger.warning(f"Could not send the result of job {job_id}: {e}")
+
+        respond({"id": job_id, "tool": tool, "event": "queued"})
+        logger.info(f"Queued job {job_id} running {tool}")
+        job_num = next(self._job_nums)
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        future.add_done_callback(finished)
+        self._pending[job_num] = future
+        self._jobs.put((job_num, tool, args, env))
+        return future
+
+    def serve(self, lines: Iterable[str], respond: Respond) -> List[concurrent.futures.Future]:
+        """Submit the request of every NDJSON line, returning the pending results of the accepted jobs."""
+
+        pending = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                respond({"id": None, "event": "error", "error": f"Invalid JSON: {e}"})
+                continue
+            result = self.submit(request, respond)
+            if result is not None:
+                pending.append(result)
+        return pending
+
+    def _serve_connection(self, connection: socket.socket) -> None:
+        with connection, connection.makefile("r", encoding="utf-8") as reader:
+            with connection.makefile("w", encoding="utf-8") as writer:
+                try:
+                    pending = self.serve(reader, write_response(writer))
+                    # the client may stop sending before its jobs are done, keep the connection for them
+                    concurrent.futures.wait(pending)
+                except OSError as e:
+                    logger.warning(f"Agent connection closed: {e}")
+
+    def serve_socket(self, path: str) -> None:
+        """
+        Accept connections on a Unix socket at the given path until :py:meth:`stop` is called.
+
+        Each connection sends requests and receives the events of its own jobs. A socket left at the path by
+        a previous agent is replaced.
+        """
+
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(path)
+            server.listen()
+            server.settimeout(_ACCEPT_TIMEOUT)
+            logger.info(f"Agent accepting jobs on {path}")
+            while not self._stopped.is_set():
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    continue
+                connection.settimeout(None)
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+        finally:
+            server.close()
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def stop(self) -> None:
+        """Stop accepting connections, jobs already submitted keep running."""
+        self._stopped.set()
+
+    def close(self) -> None:
+        """Wait for every submitted job to finish, then stop the worker processes."""
+
+        self.stop()
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._results.put(None)
+        self._receiver.join()
+        self._jobs.close()
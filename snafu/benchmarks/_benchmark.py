@@ -4,10 +4,16 @@
 import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any, Dict, Iterable
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
 
 from snafu import registry
+from snafu.benchmarks._stopping import StoppingRule
+from snafu.benchmarks._summary import SummaryAggregator
 from snafu.config import Config, ConfigArgument, FuncAction
+from snafu.process import Placement, ProcessSample, live_sample_process
+from snafu.telemetry import TelemetrySampler
 
 
 @dataclass
@@ -51,6 +57,96 @@ class BenchmarkResult:
         return result
 
 
+@dataclass
+class BenchmarkResultBatch:
+    """
+    Dataclass representation of many Benchmark results sharing their config, metadata and labels.
+
+    The data of the results is stored by column, one sequence of values (list or numpy array) per field,
+    while the shared parts are stored once for the whole batch.
+
+    Parameters
+    ----------
+    name : str
+        Associated benchmark name
+    metadata : dict
+        Extra metadata to include with every benchmark result
+    config : dict
+        Configuration information of the benchmark
+    columns : dict
+        Benchmark result data, as one sequence of values per field, all of the same length
+    labels : dict
+        User-provided labels to add into every benchmark result
+    tag : str
+        Reference tag to set elasticsearch index
+
+    Examples
+    --------
+    >>> batch = BenchmarkResultBatch(
+    ...     name="bench", metadata={"uuid": "1"}, config={"size": 4}, columns={"ops": np.array([10, 20])},
+    ...     labels={}, tag="results",
+    ... )
+    >>> len(batch)
+    2
+    >>> list(batch.to_jsonables())[1]
+    {'size': 4, 'ops': 20, 'uuid': '1', 'workload': 'bench'}
+    >>> batch.to_jsonable()
+    {'size': 4, 'uuid': '1', 'workload': 'bench', 'count': 2, 'ops': [10, 20]}
+    """
+
+    name: str
+    metadata: Dict[str, Any]
+    config: Dict[str, Any]
+    columns: Dict[str, Sequence[Any]]
+    labels: Dict[str, Any]
+    tag: str
+
+    def __post_init__(self):
+        lengths = {field: len(values) for field, values in self.columns.items()}
+        if len(set(lengths.values())) > 1:
+            raise ValueError(f"Columns of a result batch must have the same length, got {lengths}")
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+    def _column_lists(self) -> Dict[str, List[Any]]:
+        # numpy converts whole arrays to python values at once, instead of one item at a time
+        return {
+            field: values.tolist() if isinstance(values, np.ndarray) else list(values)
+            for field, values in self.columns.items()
+        }
+
+    def to_jsonables(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the exportable JSON doc of every result, as :py:meth:`BenchmarkResult.to_jsonable` gives them.
+
+        The fields shared by every result are merged once, each doc then only copies them.
+        """
+
+        head: Dict[str, Any] = dict(self.config)
+        tail: Dict[str, Any] = {**self.metadata, **self.labels, "workload": self.name}
+        columns = self._column_lists()
+        fields = list(columns)
+        for values in zip(*columns.values()):
+            result = head.copy()
+            result.update(zip(fields, values))
+            result.update(tail)
+            yield result
+
+    def to_jsonable(self) -> Dict[str, Any]:
+        """Transform the batch into one compact JSON doc, holding its ``count`` and one list per field."""
+
+        result: Dict[str, Any] = {}
+        result.update(self.config)
+        result.update(self.metadata)
+        result.update(self.labels)
+        result["workload"] = self.name
+        result["count"] = len(self)
+        result.update(self._column_lists())
+
+        return result
+
+
 class LabelParserAction(FuncAction):
     """
     argparse action to parse labels in the format of key=value1,key2=value2,... into a dict.
@@ -84,11 +180,15 @@ class Benchmark(ABC, metaclass=registry.ToolRegistryMeta):
 
     To use, subclass, set the ``tool_name``, ``args`` and ``metadata`` attributes, and overwrite the
     ``run``, ``cleanup`` and ``setup`` methods.
+
+    Result fields listed in ``summary_metrics`` are summarized as results are created, see
+    :py:meth:`run`.
     """
 
     tool_name = "_base_benchmark"
     args: Iterable[ConfigArgument] = tuple()
     metadata: Iterable[str] = ["cluster_name", "user", "uuid"]
+    summary_metrics: Iterable[str] = tuple()
     _common_args: Iterable[ConfigArgument] = (
         ConfigArgument(
             "-l",
@@ -103,6 +203,80 @@ class Benchmark(ABC, metaclass=registry.ToolRegistryMeta):
         ConfigArgument(
             "-u", "--uuid", dest="uuid", env_var="uuid", help="Provide UUID for run", default=None
         ),
+        ConfigArgument(
+            "--telemetry-interval",
+            dest="telemetry_interval",
+            env_var="telemetry_interval",
+            type=float,
+            default=0,
+            help="Sample host utilisation from /proc every given seconds while running, 0 to disable",
+        ),
+        ConfigArgument(
+            "--cpus",
+            dest="cpus",
+            env_var="cpus",
+            default=None,
+            help="Pin benchmark processes to the given CPU list, like 0-3,8",
+        ),
+        ConfigArgument(
+            "--numa-node",
+            dest="numa_node",
+            env_var="numa_node",
+            type=int,
+            default=None,
+            help="Bind memory, and CPUs unless --cpus is set, of benchmark processes to the given NUMA node",
+        ),
+        ConfigArgument(
+            "--cgroup",
+            dest="cgroup",
+            env_var="cgroup",
+            default=None,
+            help="Run benchmark processes in the given cgroup v2, relative to /sys/fs/cgroup unless absolute",
+        ),
+        ConfigArgument(
+            "--adaptive-metric",
+            dest="adaptive_metric",
+            env_var="adaptive_metric",
+            default=None,
+            help="Take samples until the mean of this result field per sample is stable, see --adaptive-*",
+        ),
+        ConfigArgument(
+            "--adaptive-min-samples",
+            dest="adaptive_min_samples",
+            env_var="adaptive_min_samples",
+            type=int,
+            default=3,
+        ),
+        ConfigArgument(
+            "--adaptive-max-samples",
+            dest="adaptive_max_samples",
+            env_var="adaptive_max_samples",
+            type=int,
+            default=10,
+        ),
+        ConfigArgument(
+            "--adaptive-target-cv",
+            dest="adaptive_target_cv",
+            env_var="adaptive_target_cv",
+            type=float,
+            default=None,
+            help="Stop sampling once the coefficient of variation of the metric is at most this",
+        ),
+        ConfigArgument(
+            "--adaptive-target-ci",
+            dest="adaptive_target_ci",
+            env_var="adaptive_target_ci",
+            type=float,
+            default=None,
+            help="Stop sampling once the confidence interval of the mean, relative to it, is this narrow",
+        ),
+        ConfigArgument(
+            "--adaptive-confidence",
+            dest="adaptive_confidence",
+            env_var="adaptive_confidence",
+            type=float,
+            default=0.95,
+        ),
     )
 
     def __init__(self):
@@ -110,6 +284,14 @@ class Benchmark(ABC, metaclass=registry.ToolRegistryMeta):
         self.config = Config(self.tool_name)
         self.config.populate_parser(self._common_args)
         self.config.populate_parser(self.args)
+        self.process_metadata: Dict[str, Any] = {}
+        self.telemetry: Optional[TelemetrySampler] = None
+        self.stopping_rule: Optional[StoppingRule] = None
+        self.stopping_summary: Optional[Dict[str, Any]] = None
+        self._metric_values: List[float] = []
+        self.summaries = SummaryAggregator(self.summary_metrics)
+        self._summary_sample: Optional[int] = None
+        self._summary_results: List[BenchmarkResult] = []
 
     def get_metadata(self) -> Dict[str, str]:
         """
@@ -126,40 +308,230 @@ class Benchmark(ABC, metaclass=registry.ToolRegistryMeta):
         return metadata
 
     def create_new_result(self, data: Dict[str, Any], config: Dict[str, Any], tag: str) -> BenchmarkResult:
-        """Shortcut method for creating a new :py:class:`BenchmarkResult` instance."""
+        """
+        Shortcut method for creating a new :py:class:`BenchmarkResult` instance.
+
+        The placement and resource usage of the current sample taken with :py:meth:`sample_process`, if any,
+        are added to the metadata of the result.
+        """
+        metadata: Dict[str, Any] = self.get_metadata()
+        metadata.update(self.process_metadata)
+        if self.stopping_rule is not None:
+            self._add_metric_values(data.get(self.stopping_rule.metric))
+        self.summaries.add_data(data)
         result = BenchmarkResult(
             name=self.tool_name,
             labels=self.config.labels,
-            metadata=self.get_metadata(),
+            metadata=metadata,
             tag=tag,
             data=data,
             config=config,
         )
         return result
 
+    def create_new_batch(
+        self, columns: Dict[str, Sequence[Any]], config: Dict[str, Any], tag: str
+    ) -> BenchmarkResultBatch:
+        """
+        Batch counterpart of :py:meth:`create_new_result`, creating a :py:class:`BenchmarkResultBatch`.
+
+        The metadata and labels are looked up once for the whole batch rather than once per result.
+        """
+        metadata: Dict[str, Any] = self.get_metadata()
+        metadata.update(self.process_metadata)
+        if self.stopping_rule is not None:
+            self._add_metric_values(columns.get(self.stopping_rule.metric))
+        self.summaries.add_data(columns)
+        return BenchmarkResultBatch(
+            name=self.tool_name,
+            labels=self.config.labels,
+            metadata=metadata,
+            tag=tag,
+            columns=columns,
+            config=config,
+        )
+
+    def _add_metric_values(self, values: Any) -> None:
+        # values of the adaptive metric, single or in arrays like compact results and batches hold them
+        if values is None or isinstance(values, (bool, str)):
+            return
+        values = np.asarray(values)
+        if np.issubdtype(values.dtype, np.number):
+            self._metric_values.extend(values.ravel().tolist())
+
+    def sample_process(
+        self,
+        cmd: Union[str, List[str]],
+        on_output: Optional[Callable[[str, str], None]] = None,
+        keep_output: bool = True,
+        **kwargs,
+    ) -> Iterable[ProcessSample]:
+        """
+        Yield samples of the given command using :py:func:`snafu.process.live_sample_process`.
+
+        Output is read while the process runs: ``on_output``, if given, is called with the stream name
+        (``"stdout"`` or ``"stderr"``) and each line as soon as it is read, including the lines of failed
+        attempts. The whole output is only stored into the runs of the samples with ``keep_output``, which
+        parsers reading the output of a sample once it's done need.
+
+        Processes are placed according to the ``cpus``, ``numa_node`` and ``cgroup`` options, unless a
+        ``placement`` is given. While a sample is being processed, the placement and the resource usage of its
+        last run are kept in ``process_metadata``, so that the results created for the sample carry them.
+        When the telemetry sampler is running, the time spent running each sample is attributed to its
+        number.
+
+        With ``--adaptive-metric``, the number of samples is decided by a
+        :py:class:`~snafu.benchmarks._stopping.StoppingRule` instead of ``num_samples``: the mean of the
+        metric over the results created for each sample is added to the rule before deciding on taking
+        another one.
+        The final decision is kept in ``stopping_summary``.
+        """
+
+        rule = self.new_stopping_rule()
+        if rule is not None:
+            kwargs["num_samples"] = rule.max_samples
+        if "placement" not in kwargs:
+            kwargs["placement"] = Placement.new(self.config.cpus, self.config.numa_node, self.config.cgroup)
+        placement: Optional[Placement] = kwargs["placement"]
+        samples = iter(live_sample_process(cmd, self.logger, keep_output=keep_output, **kwargs))
+        num_samples = kwargs.get("num_samples", 1)
+        sample_num = 0
+        while True:
+            if rule is not None and sample_num > 0:
+                if self._metric_values:
+                    rule.add(float(np.mean(self._metric_values)))
+                else:
+                    self.logger.warning(f"Sample {sample_num - 1} has no {rule.metric} result to decide on")
+                self._metric_values = []
+                decision = rule.decide()
+                self.logger.info(f"Stopping rule decision after {sample_num} samples: {decision}")
+                if decision.stop:
+                    self.stopping_summary = rule.summary(decision)
+                    break
+            telemetry = self.telemetry if sample_num < num_samples else None
+            if telemetry is not None:
+                telemetry.mark_sample(sample_num)
+            live = next(samples, None)
+            if live is not None:
+                for proc in live:
+                    for stream, line in proc:
+                        if on_output is not None:
+                            on_output(stream, line)
+            if telemetry is not None:
+                telemetry.mark_sample(None)
+            if live is None:
+                break
+            sample = live.sample
+            self._summary_sample = sample_num
+            run = sample.successful or (sample.failed[-1] if sample.failed else None)
+            self.process_metadata = {} if placement is None else placement.metadata()
+            if run is not None:
+                self.process_metadata.update((f"process_{key}", value) for key, value in run.usage().items())
+            yield sample
+            self.end_summary_sample()
+            sample_num += 1
+        self.process_metadata = {}
+        self.stopping_rule = None
+
+    def new_stopping_rule(self) -> Optional[StoppingRule]:
+        """Create and start using the stopping rule configured with the ``--adaptive-*`` options, if any."""
+
+        self.stopping_rule = None
+        self.stopping_summary = None
+        self._metric_values = []
+        if self.config.adaptive_metric:
+            self.stopping_rule = StoppingRule(
+                self.config.adaptive_metric,
+                min_samples=self.config.adaptive_min_samples,
+                max_samples=self.config.adaptive_max_samples,
+                target_cv=self.config.adaptive_target_cv,
+                target_ci_width=self.config.adaptive_target_ci,
+                confidence=self.config.adaptive_confidence,
+            )
+        return self.stopping_rule
+
+    def end_summary_sample(self) -> None:
+        """
+        End the sample of the summarized metrics, creating its ``summary`` result if it got values.
+
+        :py:meth:`sample_process` ends each sample once the next one is requested. Values added outside of
+        samples only count towards the summary of the run.
+        """
+
+        data = self.summaries.end_sample()
+        if data is not None and self._summary_sample is not None:
+            data = {"scope": "sample", "sample": self._summary_sample, **data}
+            self._summary_results.append(self.create_new_result(data=data, config={}, tag="summary"))
+        self._summary_sample = None
+
+    def pop_summary_results(self) -> List[BenchmarkResult]:
+        """Return the ``summary`` results of the samples ended since the last call."""
+
+        results, self._summary_results = self._summary_results, []
+        return results
+
     @abstractmethod
     def setup(self) -> bool:
         """Setup the benchmark, returning ``False`` if something went wrong."""
 
     @abstractmethod
-    def collect(self) -> Iterable[BenchmarkResult]:
-        """Execute the benchmark and return Iterable of BenchmarkResults."""
+    def collect(self) -> Iterable[Union[BenchmarkResult, BenchmarkResultBatch]]:
+        """Execute the benchmark and return Iterable of BenchmarkResults or BenchmarkResultBatches."""
 
     @abstractmethod
     def cleanup(self) -> bool:
         """Cleanup the benchmark as needed."""
 
-    def run(self) -> Iterable[BenchmarkResult]:
-        """Run setup -> collect -> cleanup. Yield from collect."""
+    def run(self) -> Iterable[Union[BenchmarkResult, BenchmarkResultBatch]]:
+        """
+        Run setup -> collect -> cleanup. Yield from collect.
+
+        The values of the ``summary_metrics`` found in results are summarized with a
+        :py:class:`~snafu.benchmarks._summary.SummaryAggregator`: count, mean, standard deviation, min, max
+        and quantiles of each metric are yielded under the ``summary`` tag for every sample taken with
+        :py:meth:`sample_process`, with a ``scope`` of ``sample``, and over the whole run, with a ``scope``
+        of ``run``.
+        """
 
         self.logger.info(f"Starting {self.tool_name} wrapper.")
+        try:
+            # fail on inconsistent --adaptive-* options before setting anything up
+            self.new_stopping_rule()
+        except ValueError as e:
+            self.logger.critical(f"Invalid adaptive sampling options, refusing to run: {e}")
+            return
+        self.stopping_rule = None
         self.logger.info("Running setup tasks.")
         if not self.setup():
             self.logger.critical("Something went wrong during setup, refusing to run.")
             return
 
         self.logger.info("Collecting results from benchmark.")
-        yield from self.collect()
+        if self.config.telemetry_interval:
+            self.telemetry = TelemetrySampler(self.config.telemetry_interval).start()
+        self.summaries = SummaryAggregator(self.summary_metrics)
+        try:
+            for result in self.collect():
+                yield from self.pop_summary_results()
+                yield result
+            # collect may return before its last sample was ended
+            self.end_summary_sample()
+            yield from self.pop_summary_results()
+        finally:
+            if self.telemetry is not None:
+                self.telemetry.stop()
+        if self.telemetry is not None:
+            self.logger.info(f"Telemetry sampler overhead: {self.telemetry.overhead()}")
+            for tag, data in self.telemetry.documents():
+                yield self.create_new_result(data=data, config={}, tag=tag)
+            self.telemetry = None
+        if self.stopping_summary is not None:
+            yield self.create_new_result(data=self.stopping_summary, config={}, tag="sampling-summary")
+        run_summary = self.summaries.run_summary()
+        if run_summary is not None:
+            yield self.create_new_result(
+                data={"scope": "run", "sample": None, **run_summary}, config={}, tag="summary"
+            )
 
         self.logger.info("Cleaning up")
         if not self.cleanup():
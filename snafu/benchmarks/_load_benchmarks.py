@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Holds function for automagically importing all benchmark modules in ``snafu.benchmarks``
+Holds function for automagically importing benchmark modules in ``snafu.benchmarks``
 
 Assumes that each module under ``snafu.benchmarks`` contains a class that subclasses ``Benchmark``.
+Benchmark modules are listed by tool name in ``BENCHMARK_MODULES``, so that only the module of the selected
+tool has to be imported.
 """
 import importlib
 import logging
@@ -13,7 +15,14 @@ import sys
 import traceback
 from dataclasses import dataclass
 from types import TracebackType
-from typing import Dict, List, Tuple, Type, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Type, Union
+
+#: Module under ``snafu.benchmarks`` holding the benchmark of each tool name
+BENCHMARK_MODULES: Dict[str, str] = {
+    "coremark-pro": "coremarkpro",
+    "systemd_analyze": "systemd_analyze",
+    "uperf": "uperf",
+}
 
 _ExcInfoType = Union[Tuple[Type[BaseException], BaseException, TracebackType], Tuple[None, None, None]]
 
@@ -55,13 +64,27 @@ class DetectedBenchmarks:
                 logger.log(level, f"Benchmark module {benchmark} failed to import:\n{tb_str}")
 
 
-def load_benchmarks() -> DetectedBenchmarks:
+def load_benchmarks(modules: Optional[Iterable[str]] = None) -> DetectedBenchmarks:
     """
-    Autodetect modules in same directory as source file (``__file__``) and automatically import them.
+    Import the given benchmark modules, by default every module in the same directory as this file.
 
     When importing a benchmark module, ``ImportError`s are ignored. This allows for auto-detection of
     supported benchmarks, as those which cannot be imported due to missing dependencies will not
     be populated into the registry.
+
+    Parameters
+    ----------
+    modules : iterable of str, optional
+        Names of the modules under ``snafu.benchmarks`` to import, see ``BENCHMARK_MODULES``. Defaults to
+        every module not starting with an underscore.
+
+    Examples
+    --------
+    >>> from snafu.registry import TOOLS
+    >>> load_benchmarks([BENCHMARK_MODULES["uperf"]]).imported
+    ['uperf']
+    >>> TOOLS["uperf"].tool_name
+    'uperf'
     """
 
     imported, failed, errors = [], [], []
@@ -71,7 +94,9 @@ def load_benchmarks() -> DetectedBenchmarks:
     package = __name__.replace(module_name, "")
     module_dir = os.path.dirname(__file__)
 
-    for _, module, _ in pkgutil.iter_modules([module_dir]):
+    if modules is None:
+        modules = [module for _, module, _ in pkgutil.iter_modules([module_dir])]
+    for module in modules:
         if not module.startswith("_"):
             try:
                 # specify relative import using dot notation
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Statistical stopping rule deciding how many samples of a benchmark to take."""
+import dataclasses
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+@dataclasses.dataclass
+class StoppingDecision:
+    """
+    Represent whether to stop sampling, and the statistics of the samples the decision was made on.
+
+    ``reason`` is one of ``"cv"`` or ``"ci"`` when the corresponding target was reached, ``"max_samples"``
+    when sampling has to stop without reaching them, and ``None`` when sampling should go on. The confidence
+    interval is the bootstrap percentile interval of the mean, ``ci_width`` its width relative to the mean.
+    """
+
+    stop: bool
+    reason: Optional[str]
+    samples: int
+    mean: Optional[float] = None
+    stdev: Optional[float] = None
+    cv: Optional[float] = None
+    ci_low: Optional[float] = None
+    ci_high: Optional[float] = None
+    ci_width: Optional[float] = None
+
+
+class StoppingRule:
+    """
+    Decide when enough samples of a metric were taken for its mean to be trusted.
+
+    Sampling stops once there are at least ``min_samples`` values and either their coefficient of
+    variation is at most ``target_cv`` or the width of the bootstrap confidence interval of their mean,
+    relative to the mean, is at most ``target_ci_width``. It stops anyway after ``max_samples`` values.
+
+    Parameters
+    ----------
+    metric : str
+        Name of the metric the rule is applied to.
+    min_samples : int, optional
+        Minimum number of samples, at least two.
+    max_samples : int, optional
+        Maximum number of samples.
+    target_cv : float, optional
+        Coefficient of variation, standard deviation over mean, to reach.
+    target_ci_width : float, optional
+        Width of the confidence interval of the mean, relative to the mean, to reach.
+    confidence : float, optional
+        Confidence level of the interval.
+    resamples : int, optional
+        Number of bootstrap resamples.
+    seed : int, optional
+        Seed of the bootstrap, so that the same values always give the same decision.
+
+    Examples
+    --------
+    >>> rule = StoppingRule("ops", min_samples=3, max_samples=10, target_cv=0.05)
+    >>> for value in (100, 102, 98):
+    ...     rule.add(value)
+    >>> decision = rule.decide()
+    >>> decision.stop, decision.reason, decision.samples, decision.mean
+    (True, 'cv', 3, 100.0)
+    """
+
+    def __init__(
+        self,
+        metric: str,
+        min_samples: int = 3,
+        max_samples: int = 10,
+        target_cv: Optional[float] = None,
+        target_ci_width: Optional[float] = None,
+        confidence: float = 0.95,
+        resamples: int = 2000,
+        seed: int = 0,
+    ):
+        if target_cv is None and target_ci_width is None:
+            raise ValueError("A target coefficient of variation or confidence interval width is required")
+        if not 2 <= min_samples <= max_samples:
+            raise ValueError(f"Need 2 <= min samples <= max samples, got {min_samples} and {max_samples}")
+        self.metric = metric
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.target_cv = target_cv
+        self.target_ci_width = target_ci_width
+        self.confidence = confidence
+        self.resamples = resamples
+        self.seed = seed
+        self.values: List[float] = []
+
+    def add(self, value: float) -> None:
+        """Add the value of the metric for one more sample."""
+        self.values.append(float(value))
+
+    def confidence_interval(self) -> Optional[List[float]]:
+        """Return the bootstrap percentile confidence interval of the mean, ``None`` for too few values."""
+
+        if len(self.values) < 2:
+            return None
+        values = np.array(self.values)
+        rng = np.random.RandomState(self.seed)
+        means = values[rng.randint(0, len(values), size=(self.resamples, len(values)))].mean(axis=1)
+        tail = (1 - self.confidence) / 2 * 100
+        return [float(bound) for bound in np.percentile(means, [tail, 100 - tail])]
+
+    def decide(self) -> StoppingDecision:
+        """Decide whether to stop sampling given the values so far."""
+
+        samples = len(self.values)
+        decision = StoppingDecision(stop=False, reason=None, samples=samples)
+        if samples:
+            values = np.array(self.values)
+            decision.mean = float(values.mean())
+        if samples >= 2:
+            decision.stdev = float(values.std(ddof=1))
+            decision.ci_low, decision.ci_high = self.confidence_interval()
+            if decision.mean:
+                decision.cv = decision.stdev / abs(decision.mean)
+                decision.ci_width = (decision.ci_high - decision.ci_low) / abs(decision.mean)
+
+        if samples >= self.min_samples:
+            if self.target_cv is not None and decision.cv is not None and decision.cv <= self.target_cv:
+                decision.stop, decision.reason = True, "cv"
+            elif (
+                self.target_ci_width is not None
+                and decision.ci_width is not None
+                and decision.ci_width <= self.target_ci_width
+            ):
+                decision.stop, decision.reason = True, "ci"
+        if not decision.stop and samples >= self.max_samples:
+            decision.stop, decision.reason = True, "max_samples"
+        return decision
+
+    def summary(self, decision: StoppingDecision) -> Dict[str, Any]:
+        """Return the given decision along with the settings of the rule and the values it was made on."""
+
+        summary = {
+            "metric": self.metric,
+            "min_samples": self.min_samples,
+            "max_samples": self.max_samples,
+            "target_cv": self.target_cv,
+            "target_ci_width": self.target_ci_width,
+            "confidence": self.confidence,
+            "values": list(self.values),
+        }
+        summary.update(dataclasses.asdict(decision))
+        return summary
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Streaming summary statistics of the metrics of benchmark results."""
+import math
+from typing import Any, Dict, Iterable, Optional, Union
+
+import numpy as np
+
+#: Quantiles reported in summaries, as ``p<percent>`` fields
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+Values = Union[float, Iterable[float], np.ndarray]
+
+
+class RunningStats:
+    """
+    Count, mean, standard deviation, min and max of a stream of values, kept with Welford's algorithm.
+
+    Arrays of values are added at once and combined with the running values the same way two
+    :py:class:`RunningStats` are merged.
+
+    Examples
+    --------
+    >>> stats = RunningStats()
+    >>> stats.add(2)
+    >>> stats.add_many([4, 4, 4, 5, 5, 7, 9])
+    >>> stats.count, stats.mean, round(stats.stdev, 4), stats.min, stats.max
+    (8, 5.0, 2.1381, 2.0, 9.0)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        """Add one value."""
+
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def add_many(self, values: Iterable[float]) -> None:
+        """Add an array of values."""
+
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        other = RunningStats()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min, other.max = float(values.min()), float(values.max())
+        self.merge(other)
+
+    def merge(self, other: "RunningStats") -> None:
+        """Add the values of another instance, using the parallel variant of the algorithm."""
+
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def stdev(self) -> Optional[float]:
+        """Sample standard deviation, ``None`` with less than two values."""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+
+
+class QuantileSketch:
+    """
+    Mergeable sketch of the distribution of a stream of values, answering quantiles with a relative error.
+
+    Values are counted in logarithmic buckets, HDR histogram style, each bucket spanning values within
+    ``relative_accuracy`` of its representative value. Positive and negative values get their own buckets,
+    zeros are counted apart. Once there are more than ``max_buckets`` buckets of a sign, the ones closest
+    to zero are collapsed together, so that memory stays bounded whatever the number and range of values,
+    at the cost of accuracy for the smallest magnitudes.
+
+    Parameters
+    ----------
+    relative_accuracy : float, optional
+        Maximum relative error of the quantiles.
+    max_buckets : int, optional
+        Maximum number of buckets per sign.
+
+    Examples
+    --------
+    >>> sketch = QuantileSketch()
+    >>> sketch.add_many(range(1, 1001))
+    >>> abs(sketch.quantile(0.5) - 500.5) / 500.5 < 0.01, abs(sketch.quantile(0.99) - 990) / 990 < 0.01
+    (True, True)
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"Relative accuracy must be between 0 and 1, got {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _count(self, buckets: Dict[int, int], magnitudes: np.ndarray) -> None:
+        indexes = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+        for index, count in zip(*np.unique(indexes, return_counts=True)):
+            buckets[int(index)] = buckets.get(int(index), 0) + int(count)
+        self._collapse(buckets)
+
+    def _collapse(self, buckets: Dict[int, int]) -> None:
+        if len(buckets) <= self.max_buckets:
+            return
+        indexes = sorted(buckets)
+        excess = indexes[: len(indexes) - self.max_buckets + 1]
+        buckets[excess[-1]] += sum(buckets.pop(index) for index in excess[:-1])
+
+    def add_many(self, values: Iterable[float]) -> None:
+        """Add an array of values, leaving NaN and infinite values out."""
+
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        self.count += len(values)
+        self.zeros += int((values == 0).sum())
+        self._count(self.positive, values[values > 0])
+        self._count(self.negative, -values[values < 0])
+
+    def add(self, value: float) -> None:
+        """Add one value, leaving it out if NaN or infinite."""
+
+        if not math.isfinite(value):
+            return
+        self.count += 1
+        if value == 0:
+            self.zeros += 1
+            return
+        buckets = self.positive if value > 0 else self.negative
+        index = math.ceil(math.log(abs(value)) / self._log_gamma)
+        buckets[index] = buckets.get(index, 0) + 1
+        self._collapse(buckets)
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Add the values of another sketch, which must have the same relative accuracy."""
+
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + count
+            self._collapse(buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def _value(self, index: int) -> float:
+        # within the relative accuracy of every value of the bucket, (gamma^(index-1), gamma^index]
+        return 2 * self.gamma**index / (self.gamma + 1)
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        """Return the value at the given quantile, between 0 and 1, ``None`` if there are no values."""
+
+        if not self.count:
+            return None
+        rank = quantile * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+
+class MetricSummary:
+    """Summary statistics of the values of one metric: running stats along with a quantile sketch."""
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def add(self, values: Values) -> None:
+        """Add one value or an array of values, leaving NaN and infinite values out."""
+
+        if isinstance(values, (int, float, np.number)):
+            # single values are added without going through numpy
+            if math.isfinite(values):
+                self.stats.add(values)
+                self.sketch.add(values)
+            return
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        self.stats.add_many(values)
+        self.sketch.add_many(values)
+
+    def merge(self, other: "MetricSummary") -> None:
+        """Add the values of another summary."""
+
+        self.stats.merge(other.stats)
+        self.sketch.merge(other.sketch)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the count, mean, stdev, min, max and quantiles of the values."""
+
+        count = self.stats.count
+        summary: Dict[str, Any] = {
+            "count": count,
+            "mean": self.stats.mean if count else None,
+            "stdev": self.stats.stdev,
+            "min": self.stats.min if count else None,
+            "max": self.stats.max if count else None,
+        }
+        for quantile in QUANTILES:
+            value = self.sketch.quantile(quantile)
+            # the min and max are exact, quantiles never go past them
+            if value is not None:
+                value = min(max(value, self.stats.min), self.stats.max)
+            summary[f"p{quantile * 100:g}"] = value
+        return summary
+
+
+class SummaryAggregator:
+    """
+    Summarize the declared metrics of benchmark results, per sample and over the whole run.
+
+    Values are added to the summaries of the current sample, which are merged into the summaries of the run
+    when the sample ends. Memory used per metric doesn't depend on the number of values.
+
+    Parameters
+    ----------
+    metrics : iterable of str
+        Names of the metrics to summarize.
+    relative_accuracy : float, optional
+        Maximum relative error of the quantiles.
+
+    Examples
+    --------
+    >>> aggregator = SummaryAggregator(["ops"])
+    >>> aggregator.add_data({"ops": 10, "host": "a"})
+    >>> aggregator.add_data({"ops": [20, 30]})
+    >>> sample = aggregator.end_sample()
+    >>> sample["ops_count"], sample["ops_mean"], sample["ops_max"]
+    (3, 20.0, 30.0)
+    >>> aggregator.add("ops", 40)
+    >>> aggregator.end_sample()["ops_count"], aggregator.run_summary()["ops_count"]
+    (1, 4)
+    """
+
+    def __init__(self, metrics: Iterable[str], relative_accuracy: float = 0.01):
+        self.metrics = tuple(metrics)
+        self.relative_accuracy = relative_accuracy
+        self._sample = self._new_summaries()
+        self._run = self._new_summaries()
+
+    def _new_summaries(self) -> Dict[str, MetricSummary]:
+        return {metric: MetricSummary(self.relative_accuracy) for metric in self.metrics}
+
+    def add(self, metric: str, values: Values) -> None:
+        """Add one value or an array of values of the given metric to the current sample."""
+        self._sample[metric].add(values)
+
+    def add_data(self, data: Dict[str, Any]) -> None:
+        """Add the values of every declared metric found in the given result data, single or in arrays."""
+
+        for metric in self.metrics:
+            values = data.get(metric)
+            if isinstance(values, (int, float, list, tuple, np.ndarray, np.number)) and not isinstance(
+                values, bool
+            ):
+                self.add(metric, values)
+
+    def current(self, metric: str) -> MetricSummary:
+        """Return the summary of the given metric over the current sample."""
+        return self._sample[metric]
+
+    @staticmethod
+    def _flatten(summaries: Dict[str, MetricSummary]) -> Optional[Dict[str, Any]]:
+        if not any(summary.stats.count for summary in summaries.values()):
+            return None
+        return {
+            f"{metric}_{stat}": value
+            for metric, summary in summaries.items()
+            for stat, value in summary.to_dict().items()
+        }
+
+    def end_sample(self) -> Optional[Dict[str, Any]]:
+        """
+        End the current sample, merging it into the run.
+
+        Returns the ``<metric>_<stat>`` fields of the summaries of the sample, ``None`` if it got no values.
+        """
+
+        summary = self._flatten(self._sample)
+        for metric, sample in self._sample.items():
+            self._run[metric].merge(sample)
+        self._sample = self._new_summaries()
+        return summary
+
+    def run_summary(self) -> Optional[Dict[str, Any]]:
+        """Return the ``<metric>_<stat>`` fields of the summaries of the ended samples, ``None`` if empty."""
+        return self._flatten(self._run)
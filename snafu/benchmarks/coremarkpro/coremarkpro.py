@@ -233,9 +233,8 @@ class Coremarkpro(Benchmark):
         cmd = self.build_workload_cmd()
 
         if not self.config.ingest:
-            samples = sample_process(
+            samples = self.sample_process(
                 cmd,
-                self.logger,
                 num_samples=self.config.sample,
                 retries=2,
                 expected_rc=0,
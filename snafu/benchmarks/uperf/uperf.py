@@ -7,11 +7,9 @@ import re
 import shlex
 from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
-import numpy as np
-
-from snafu.benchmarks import Benchmark, BenchmarkResult
+from snafu.benchmarks import Benchmark, BenchmarkResult, BenchmarkResultBatch
 from snafu.config import Config, ConfigArgument, FuncAction, check_file, none_or_type
-from snafu.process import sample_process
+from snafu.utils.timeseries import compact_series, manifest_document
 
 
 class ParseRangeAction(FuncAction):
@@ -111,6 +109,7 @@ class Uperf(Benchmark):
     """Wrapper for the uperf benchmark."""
 
     tool_name = "uperf"
+    summary_metrics = ("norm_byte", "norm_ops", "norm_ltcy")
     args = (
         ConfigArgument(
             "-w",
@@ -194,6 +193,15 @@ class Uperf(Benchmark):
         # each node will run with density number of pods, this is the 0 based
         # number of that pod, useful for displaying throughput of each density
         ConfigArgument("--pod-id", dest="pod-id", env_var="my_pod_idx", default=""),
+        ConfigArgument(
+            "--compact-points",
+            dest="compact_points",
+            env_var="compact_points",
+            default=0,
+            type=int,
+            help="Index each sample as a manifest holding its config plus results of this many "
+            "statistics each, instead of one result per statistic",
+        ),
     )
 
     def parse_stdout(self, stdout: str) -> UperfStdout:
@@ -304,6 +312,33 @@ class Uperf(Benchmark):
 
         return processed
 
+    def compact_results(
+        self, result_data: List[UperfStat], config: UperfConfig, sample_num: int
+    ) -> Iterable[BenchmarkResult]:
+        """
+        Yield the results of a sample as a manifest holding its config, followed by compact results.
+
+        Each compact result holds up to ``self.config.compact_points`` statistics as one array per field.
+        """
+
+        manifest = manifest_document({**dataclasses.asdict(config), "iteration": sample_num})
+        yield self.create_new_result(data=manifest, config={}, tag="manifest")
+        points = []
+        for result_datapoint in result_data:
+            point = dataclasses.asdict(result_datapoint)
+            del point["iteration"]
+            points.append(point)
+        for batch in compact_series(
+            manifest["manifest_id"],
+            {"iteration": sample_num},
+            points,
+            self.config.compact_points,
+            time_field="uperf_ts",
+        ):
+            result: BenchmarkResult = self.create_new_result(data=batch, config={}, tag="results-compact")
+            self.logger.debug(f"Got compact sample result: {result}")
+            yield result
+
     def setup(self) -> bool:
         """Parse config and check that workload file exists."""
         self.config.parse_args()
@@ -319,7 +354,7 @@ class Uperf(Benchmark):
 
         return True
 
-    def collect(self) -> Iterable[BenchmarkResult]:
+    def collect(self) -> Iterable[Union[BenchmarkResult, BenchmarkResultBatch]]:
         """
         Run uperf benchmark ``self.config.sample`` number of times.
 
@@ -330,19 +365,21 @@ class Uperf(Benchmark):
         _plural = "s" if self.config.sample > 1 else ""
         self.logger.info(f"Collecting {self.config.sample} sample{_plural} of Uperf")
 
-        samples = sample_process(
+        samples = self.sample_process(
             cmd,
-            self.logger,
             num_samples=self.config.sample,
             retries=2,
             expected_rc=0,
             env=self.config.get_env(),
         )
 
+        # the stopping rule may decide on another number of samples
+        collected = 0
         for sample_num, sample in enumerate(samples):
             if not sample.success:
                 self.logger.critical(f"Uperf failed to run! Got results: {sample}")
                 return
+            collected = sample_num + 1
 
             self.logger.info(f"Finished collecting sample {sample_num}")
             self.logger.debug(f"Got sample: {sample}")
@@ -358,28 +395,30 @@ class Uperf(Benchmark):
             result_data: List[UperfStat] = self.get_results_from_stdout(stdout)
             config: UperfConfig = UperfConfig.new(stdout, self.config)
 
-            byte_summary = []
-            lat_summary = []
-            op_summary = []
-            for result_datapoint in result_data:
-                byte_summary.append(result_datapoint.norm_byte)
-                lat_summary.append(result_datapoint.norm_ltcy)
-                op_summary.append(result_datapoint.norm_ops)
-                result_datapoint.iteration = sample_num
-                result: BenchmarkResult = self.create_new_result(
-                    data=dataclasses.asdict(result_datapoint),
-                    config=dataclasses.asdict(config),
-                    tag="results",
+            if self.config.compact_points:
+                yield from self.compact_results(result_data, config, sample_num)
+            elif result_data:
+                # statistics of a sample share their config, which a batch only holds once
+                columns: Dict[str, List[Any]] = {field.name: [] for field in dataclasses.fields(UperfStat)}
+                for result_datapoint in result_data:
+                    result_datapoint.iteration = sample_num
+                    for field, values in columns.items():
+                        values.append(getattr(result_datapoint, field))
+                batch: BenchmarkResultBatch = self.create_new_batch(
+                    columns=columns, config=dataclasses.asdict(config), tag="results"
                 )
-                self.logger.debug(f"Got sample result: {result}")
-                yield result
+                self.logger.debug(f"Got {len(batch)} sample results: {batch}")
+                yield batch
             self.logger.info(f"{'-'*50}")
             self.logger.info(f"Summary result for sample : {sample_num}")
-            self.logger.info(f"Average byte : {np.average(byte_summary)}")
-            self.logger.info(f"Average ops : {np.average(op_summary)}")
-            self.logger.info(f"95%ile Latency(ms) : {np.percentile(lat_summary,95)}")
+            self.logger.info(f"Average byte : {self.summaries.current('norm_byte').stats.mean}")
+            self.logger.info(f"Average ops : {self.summaries.current('norm_ops').stats.mean}")
+            self.logger.info(
+                f"95%ile Latency(ms) : {self.summaries.current('norm_ltcy').sketch.quantile(0.95)}"
+            )
             self.logger.info(f"{'-'*50}")
-        self.logger.info(f"Successfully collected {self.config.sample} sample{_plural} of Uperf.")
+        _plural = "s" if collected > 1 else ""
+        self.logger.info(f"Successfully collected {collected} sample{_plural} of Uperf.")
 
     @staticmethod
     def cleanup() -> bool:
@@ -45,6 +45,13 @@ class fio_wrapper:
         parser.add_argument(
             "-hp", "--histogramprocess", help="Process and index histogram results", default=False
         )
+        parser.add_argument(
+            "--compact-points",
+            type=int,
+            default=0,
+            help="index logs as one manifest per job plus documents of this many points per log file, "
+            "instead of one document per log line",
+        )
         self.args = parser_object.parse_args()
 
         self.args.cluster_name = "mycluster"
@@ -91,6 +98,7 @@ class fio_wrapper:
                 i,
                 fio_analyzer_obj,
                 self.args.histogramprocess,
+                compact_points=self.args.compact_points,
             )
             yield trigger_fio_generator
 
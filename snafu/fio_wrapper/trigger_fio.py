@@ -6,6 +6,8 @@ import subprocess
 from copy import deepcopy
 from datetime import datetime
 
+from snafu.utils.timeseries import compact_series, manifest_document
+
 from .fio_hist_parser import compute_percentiles_from_logs
 
 logger = logging.getLogger("snafu")
@@ -38,6 +40,7 @@ class _trigger_fio:
         fio_analyzer_obj,
         numjob=1,
         process_histogram=False,
+        compact_points=0,
     ):
         self.fio_jobs = fio_jobs
         self.working_dir = working_dir
@@ -49,6 +52,7 @@ class _trigger_fio:
         self.fio_analyzer_obj = fio_analyzer_obj
         self.numjob = numjob
         self.histogram_process = process_histogram
+        self.compact_points = compact_points
         self.cluster_name = cluster_name
         self.fio_version = ""
         self.hosts = ""
@@ -97,8 +101,8 @@ class _trigger_fio:
 
         return processed, fio_starttime, earliest_starttime
 
-    def _log_payload(self, directory, fio_starttime, job, fio_output_file):  # pod_details
-        logs = []
+    def _log_files(self, directory, job):
+        """Yield (log, host, job number, path) of every log file written by the given job."""
         _current_log_files = deepcopy(_log_files)
         job_options = self.fio_jobs_dict[job]
         if "gtod_reduce" in job_options:
@@ -150,42 +154,89 @@ class _trigger_fio:
 
                         except:  # noqa
                             logger.info("Error setting log_file_name")
-                    log_file_name = os.path.join(directory, log_file_name)
-                    try:
-                        with open(log_file_name, "r") as log_file:
-                            for log_line in log_file:
-                                log_line_values = str(log_line).split(", ")
-                                if len(log_line_values) == 5:
-                                    timestamp_ms = int(fio_starttime[host]) + int(log_line_values[0])
-                                    newtime = datetime.utcfromtimestamp(timestamp_ms / 1000.0)
-                                    log_dict = {
-                                        "uuid": self.uuid,
-                                        "user": self.user,
-                                        "host": host,
-                                        "cluster_name": self.cluster_name,
-                                        "job_number": numjob,
-                                        "fio-version": self.fio_version,
-                                        "job_options": job_options,
-                                        "job_name": str(job),
-                                        "log_file": log_file_name,
-                                        "sample": int(self.sample),
-                                        "log_name": str(log),
-                                        "timestamp": timestamp_ms,  # this is in ms
-                                        "date": newtime.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-                                        str(_current_log_files[log]["metric"]): int(log_line_values[1]),
-                                        # "nodeName": pod_details["hostname"],
-                                        "data_direction": _data_direction[int(log_line_values[2])],
-                                        "block_size": int(log_line_values[3]),
-                                        "offset": int(log_line_values[4]),
-                                    }
-                                    if "global" in self.fio_jobs_dict.keys():
-                                        log_dict["global_options"] = self.fio_jobs_dict["global"]
-                                    logs.append(log_dict)
-                    except OSError:
-                        # In certain situations Fio return code is 0 even after a failed execution, so we have
-                        # to check the log file existence to verify this
-                        logger.error("Log file %s not found" % log_file_name)
-                        exit(1)
+                    yield log, host, numjob, os.path.join(directory, log_file_name)
+
+    def _log_points(self, log_file_name, log, host, fio_starttime):
+        """Yield the time series fields of every line of the given log file."""
+        try:
+            with open(log_file_name, "r") as log_file:
+                for log_line in log_file:
+                    log_line_values = str(log_line).split(", ")
+                    if len(log_line_values) == 5:
+                        yield {
+                            "timestamp": int(fio_starttime[host]) + int(log_line_values[0]),  # this is in ms
+                            str(_log_files[log]["metric"]): int(log_line_values[1]),
+                            "data_direction": _data_direction[int(log_line_values[2])],
+                            "block_size": int(log_line_values[3]),
+                            "offset": int(log_line_values[4]),
+                        }
+        except OSError:
+            # In certain situations Fio return code is 0 even after a failed execution, so we have
+            # to check the log file existence to verify this
+            logger.error("Log file %s not found" % log_file_name)
+            exit(1)
+
+    def _log_payload(self, directory, fio_starttime, job, fio_output_file):  # pod_details
+        logs = []
+        job_options = self.fio_jobs_dict[job]
+        for log, host, numjob, log_file_name in self._log_files(directory, job):
+            for point in self._log_points(log_file_name, log, host, fio_starttime):
+                newtime = datetime.utcfromtimestamp(point["timestamp"] / 1000.0)
+                log_dict = {
+                    "uuid": self.uuid,
+                    "user": self.user,
+                    "host": host,
+                    "cluster_name": self.cluster_name,
+                    "job_number": numjob,
+                    "fio-version": self.fio_version,
+                    "job_options": job_options,
+                    "job_name": str(job),
+                    "log_file": log_file_name,
+                    "sample": int(self.sample),
+                    "log_name": str(log),
+                    "date": newtime.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                    # "nodeName": pod_details["hostname"],
+                }
+                log_dict.update(point)
+                if "global" in self.fio_jobs_dict.keys():
+                    log_dict["global_options"] = self.fio_jobs_dict["global"]
+                logs.append(log_dict)
+        return logs
+
+    def _compact_log_payload(self, directory, fio_starttime, job):
+        """
+        Return the logs of the given job as a manifest holding the job's static context, followed by
+        batches of up to ``compact_points`` points of each log file, along with their index.
+        """
+        context = {
+            "uuid": self.uuid,
+            "user": self.user,
+            "cluster_name": self.cluster_name,
+            "fio-version": self.fio_version,
+            "job_options": self.fio_jobs_dict[job],
+            "job_name": str(job),
+            "sample": int(self.sample),
+        }
+        if "global" in self.fio_jobs_dict.keys():
+            context["global_options"] = self.fio_jobs_dict["global"]
+        manifest = manifest_document(context)
+        logs = [(manifest, "log-manifest")]
+        for log, host, numjob, log_file_name in self._log_files(directory, job):
+            series = {
+                "uuid": self.uuid,
+                "host": host,
+                "job_number": numjob,
+                "job_name": str(job),
+                "sample": int(self.sample),
+                "log_file": log_file_name,
+                "log_name": str(log),
+            }
+            points = self._log_points(log_file_name, log, host, fio_starttime)
+            for batch in compact_series(manifest["manifest_id"], series, points, self.compact_points):
+                batch["date"] = datetime.utcfromtimestamp(batch["start"] / 1000.0).strftime(
+                    "%Y-%m-%dT%H:%M:%S.%fZ"
+                )
+                logs.append((batch, "log-series"))
         return logs
 
     def _histogram_payload(
@@ -346,13 +397,18 @@ class _trigger_fio:
                 except:  # noqa
                     logger.error("Error getting filename_format")
 
-            # parse all fio log files, return list of normalized log documents
-            fio_log_documents = self._log_payload(job_dir, fio_starttime, job, fio_output_file)
+            if self.compact_points:
+                # static context once per job, log lines batched into arrays
+                for document, index in self._compact_log_payload(job_dir, fio_starttime, job):
+                    yield document, index
+            else:
+                # parse all fio log files, return list of normalized log documents
+                fio_log_documents = self._log_payload(job_dir, fio_starttime, job, fio_output_file)
 
-            # if indexing is turned on yield back normalized data
-            index = "log"
-            for document in fio_log_documents:
-                yield document, index
+                # if indexing is turned on yield back normalized data
+                index = "log"
+                for document in fio_log_documents:
+                    yield document, index
             if self.histogram_process:
                 try:
                     processed_histogram_prefix = self.fio_jobs_dict[job]["write_hist_log"] + "_clat_hist"
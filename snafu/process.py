@@ -1,22 +1,86 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """Tools for running subprocesses."""
+import ctypes
 import dataclasses
 import datetime
 import logging
+import os
+import platform
+import queue
+import resource
+import signal
 import subprocess
-from typing import Iterable, List, Optional, Union
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# resource usage fields of ProcessRun, with the struct_rusage fields they are computed from
+_USAGE_FIELDS = {
+    "user_cpu_seconds": "ru_utime",
+    "system_cpu_seconds": "ru_stime",
+    "voluntary_context_switches": "ru_nvcsw",
+    "involuntary_context_switches": "ru_nivcsw",
+    "major_faults": "ru_majflt",
+    "minor_faults": "ru_minflt",
+    "block_input_ops": "ru_inblock",
+    "block_output_ops": "ru_oublock",
+}
 
 
 @dataclasses.dataclass
 class ProcessRun:
-    """Represent a single run of a subprocess without retries."""
+    """
+    Represent a single run of a subprocess without retries.
+
+    Besides its outcome, the run records the resource usage of the process and of the children it waited
+    for, as reported by :py:func:`os.wait4` when the process is reaped. If the process was reaped elsewhere,
+    usage falls back to the difference of :py:data:`resource.RUSAGE_CHILDREN` before and after the run,
+    which also counts other children of snafu terminating meanwhile, and ``max_rss_kb`` is then only known
+    when the run peaked higher than every previous child, otherwise it is ``None``.
+    """
 
     rc: Optional[int] = None  # pylint: disable=C0103
     stdout: Optional[str] = None
     stderr: Optional[str] = None
     time_seconds: Optional[float] = None
     hit_timeout: Optional[bool] = None
+    user_cpu_seconds: Optional[float] = None
+    system_cpu_seconds: Optional[float] = None
+    max_rss_kb: Optional[int] = None
+    voluntary_context_switches: Optional[int] = None
+    involuntary_context_switches: Optional[int] = None
+    major_faults: Optional[int] = None
+    minor_faults: Optional[int] = None
+    block_input_ops: Optional[int] = None
+    block_output_ops: Optional[int] = None
+
+    def set_usage(
+        self,
+        before: resource.struct_rusage,
+        after: resource.struct_rusage,
+        own: Optional[resource.struct_rusage] = None,
+    ) -> None:
+        """
+        Set the resource usage of the run.
+
+        The usage reported for the process itself when it was reaped is used if given, otherwise the usage is
+        computed from the children usage taken before and after the run.
+        """
+
+        if own is not None:
+            for field, rusage_field in _USAGE_FIELDS.items():
+                setattr(self, field, getattr(own, rusage_field))
+            self.max_rss_kb = own.ru_maxrss
+            return
+        for field, rusage_field in _USAGE_FIELDS.items():
+            setattr(self, field, getattr(after, rusage_field) - getattr(before, rusage_field))
+        # maxrss is a maximum over all children rather than a total
+        self.max_rss_kb = after.ru_maxrss if after.ru_maxrss > before.ru_maxrss else None
+
+    def usage(self) -> Dict[str, Any]:
+        """Return the resource usage of the run."""
+        return {field: getattr(self, field) for field in ["max_rss_kb", *_USAGE_FIELDS]}
 
 
 @dataclasses.dataclass
@@ -31,6 +95,385 @@ class ProcessSample:
     successful: Optional[ProcessRun] = None
 
 
+# set_mempolicy isn't wrapped by glibc, it's called through syscall(2) with its number on each architecture
+_SET_MEMPOLICY_SYSCALLS = {"x86_64": 238, "aarch64": 237, "ppc64le": 261, "s390x": 270}
+_MPOL_BIND = 2
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """
+    Parse a CPU list in the format of ``taskset`` and ``/sys``, like ``0-3,8``, into the list of CPUs.
+
+    Examples
+    --------
+    >>> parse_cpu_list("0-3,8,10-11")
+    [0, 1, 2, 3, 8, 10, 11]
+    """
+
+    cpus: List[int] = []
+    for cpu_range in cpu_list.strip().split(","):
+        first, _, last = cpu_range.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+@dataclasses.dataclass
+class Placement:
+    """
+    Represent where a subprocess runs: on which CPUs, with memory from which NUMA node and in which cgroup.
+
+    The placement is applied by the child between fork and exec, through the ``preexec_fn`` of
+    :py:class:`subprocess.Popen`, so the process and every process it starts are placed from the start.
+    Use :py:meth:`new` to create one, as it checks that the placement can be applied on this host.
+
+    snafu runs threads of its own while benchmarks run, like the indexing pipeline, the telemetry sampler
+    and the Prometheus worker, and the forked child only has a copy of the locks they may be holding. The
+    function placing the child thus only makes system calls on values prepared in the parent, it never
+    allocates through Python objects which could need such a lock, like files or strings.
+
+    Parameters
+    ----------
+    cpus : list of int, optional
+        CPUs the process is pinned to.
+    numa_node : int, optional
+        NUMA node memory is allocated from, with a strict bind memory policy.
+    cgroup : str, optional
+        Path of the cgroup v2 directory the process is moved into.
+    """
+
+    cpus: Optional[List[int]] = None
+    numa_node: Optional[int] = None
+    cgroup: Optional[str] = None
+
+    @classmethod
+    def new(
+        cls,
+        cpus: Optional[str] = None,
+        numa_node: Optional[int] = None,
+        cgroup: Optional[str] = None,
+        node_root: str = "/sys/devices/system/node",
+        cgroup_root: str = "/sys/fs/cgroup",
+    ) -> Optional["Placement"]:
+        """
+        Create the placement from user given options, returning ``None`` if there is nothing to place.
+
+        Parameters
+        ----------
+        cpus : str, optional
+            CPU list, like ``0-3,8``. Defaults to the CPUs of ``numa_node`` when that is given.
+        numa_node : int, optional
+            NUMA node to bind memory allocations to.
+        cgroup : str, optional
+            cgroup v2 to run in, relative to ``cgroup_root`` unless absolute. It's created if missing.
+
+        Raises
+        ------
+        ValueError
+            If the NUMA node doesn't exist or memory policies aren't supported on this architecture.
+        """
+
+        if cpus is None and numa_node is None and cgroup is None:
+            return None
+        placement = cls(cgroup=cgroup)
+        if cpus is not None:
+            placement.cpus = parse_cpu_list(cpus)
+        if numa_node is not None:
+            placement.numa_node = int(numa_node)
+            node_cpu_list = os.path.join(node_root, f"node{placement.numa_node}", "cpulist")
+            if not os.path.isfile(node_cpu_list):
+                raise ValueError(f"NUMA node {placement.numa_node} doesn't exist")
+            if platform.machine() not in _SET_MEMPOLICY_SYSCALLS:
+                raise ValueError(f"Can't set a NUMA memory policy on {platform.machine()}")
+            if placement.cpus is None:
+                with open(node_cpu_list) as cpu_list:
+                    placement.cpus = parse_cpu_list(cpu_list.read())
+        if cgroup is not None:
+            placement.cgroup = os.path.join(cgroup_root, cgroup)
+            os.makedirs(placement.cgroup, exist_ok=True)
+        return placement
+
+    def preexec_fn(self) -> Callable[[], None]:
+        """Return the function placing the calling process, meant to be run in the child."""
+
+        # everything is prepared in the parent, the child only makes system calls, see the class docstring
+        cgroup_procs = None if self.cgroup is None else os.path.join(self.cgroup, "cgroup.procs")
+        cpus = None if self.cpus is None else frozenset(self.cpus)
+        bind_memory = None if self.numa_node is None else _memory_binder(self.numa_node)
+
+        def place():
+            # cgroup first, its cpuset may restrict the CPUs that can be used
+            if cgroup_procs is not None:
+                procs = os.open(cgroup_procs, os.O_WRONLY | os.O_CREAT, 0o644)
+                try:
+                    # 0 stands for the writing process
+                    os.write(procs, b"0")
+                finally:
+                    os.close(procs)
+            if cpus is not None:
+                os.sched_setaffinity(0, cpus)
+            if bind_memory is not None:
+                bind_memory()
+
+        return place
+
+    def metadata(self) -> Dict[str, Any]:
+        """Return the placement as metadata fields, leaving out what isn't placed."""
+
+        fields = dataclasses.asdict(self)
+        return {f"placement_{key}": value for key, value in fields.items() if value is not None}
+
+
+def _memory_binder(numa_node: int) -> Callable[[], None]:
+    # prepare the set_mempolicy call binding memory allocations to the node
+    libc = ctypes.CDLL(None, use_errno=True)
+    bits = ctypes.sizeof(ctypes.c_ulong) * 8
+    nodemask = (ctypes.c_ulong * (numa_node // bits + 1))()
+    nodemask[numa_node // bits] = 1 << (numa_node % bits)
+    number = _SET_MEMPOLICY_SYSCALLS[platform.machine()]
+    maxnode = len(nodemask) * bits + 1
+    syscall = libc.syscall
+
+    def bind_memory():
+        if syscall(number, _MPOL_BIND, nodemask, maxnode) != 0:
+            raise OSError(ctypes.get_errno(), "set_mempolicy failed")
+
+    return bind_memory
+
+
+def _placement_kwargs(kwargs: dict) -> dict:
+    # turn the placement option into a preexec_fn, keeping any preexec_fn given along
+    kwargs = dict(kwargs)
+    placement: Optional[Placement] = kwargs.pop("placement", None)
+    if placement is not None:
+        place = placement.preexec_fn()
+        preexec_fn = kwargs.get("preexec_fn")
+        if preexec_fn is not None:
+
+            def place_and_preexec():
+                place()
+                preexec_fn()
+
+            kwargs["preexec_fn"] = place_and_preexec
+        else:
+            kwargs["preexec_fn"] = place
+    return kwargs
+
+
+def _reap(process: subprocess.Popen, timeout: Optional[float] = None) -> Optional[resource.struct_rusage]:
+    # wait for the process with wait4, setting its returncode and returning its own resource usage, None if it
+    # was already reaped, by Popen.poll for instance. Raises subprocess.TimeoutExpired like Popen.wait
+    if process.returncode is not None:
+        return None
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.0005
+    while True:
+        try:
+            pid, status, rusage = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+        except ChildProcessError:
+            # reaped by someone else, Popen gives it the same return code as it would
+            process.wait()
+            return None
+        if pid == process.pid:
+            # same return code as Popen, negative for processes killed by a signal
+            process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            return rusage
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        delay = min(delay * 2, remaining, 0.05)
+        time.sleep(delay)
+
+
+def _kill(process: subprocess.Popen) -> None:
+    # unlike Popen.kill, never polls the process, which would reap it without its resource usage
+    if process.returncode is None:
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class LiveProcess:
+    """
+    Run a subprocess, giving access to the lines of its stdout and stderr as they are produced.
+
+    Iterating over the process yields ``(stream, line)`` tuples, where ``stream`` is either ``"stdout"`` or
+    ``"stderr"`` and ``line`` keeps its trailing newline. Once iteration is over the process has exited, or
+    was killed after the timeout, and :py:attr:`attempt` holds its :py:class:`~snafu.process.ProcessRun`.
+
+    Output isn't kept unless ``keep_output`` is set, in which case it's also stored into the
+    :py:class:`~snafu.process.ProcessRun` like :py:func:`~snafu.process.get_process_sample` does.
+
+    Parameters
+    ----------
+    cmd : str or list of str
+        Command to run. Can be string or list of strings if using :py:mod:`shlex`
+    timeout : int, optional
+        Time in seconds to wait for process to complete before killing it.
+    keep_output : bool, optional
+        Store the whole stdout and stderr of the process into :py:attr:`attempt`.
+    kwargs
+        Extra kwargs will be passed to :py:class:`subprocess.Popen`. Both stdout and stderr are piped unless
+        given. A ``placement`` kwarg taking a :py:class:`~snafu.process.Placement` places the process.
+
+    Examples
+    --------
+    >>> with LiveProcess("echo 'line 1'; echo 'line 2'", shell=True) as proc:
+    ...     lines = [line.rstrip() for stream, line in proc if stream == "stdout"]
+    >>> lines
+    ['line 1', 'line 2']
+    >>> proc.attempt.rc, proc.attempt.hit_timeout
+    (0, False)
+    """
+
+    #: Time in seconds given to the output of a killed process to be read
+    kill_grace: float = 1
+
+    def __init__(
+        self,
+        cmd: Union[str, List[str]],
+        timeout: Optional[float] = None,
+        keep_output: bool = False,
+        **kwargs,
+    ):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.keep_output = keep_output
+        self.kwargs = _placement_kwargs(_capture_kwargs(kwargs))
+        self.attempt = ProcessRun()
+        self.process: Optional[subprocess.Popen] = None
+        self._lines: queue.Queue = queue.Queue()
+        self._open_streams = 0
+        self._output = {"stdout": [], "stderr": []}
+        self._start_time: Optional[datetime.datetime] = None
+        self._start_usage: Optional[resource.struct_rusage] = None
+
+    def start(self) -> "LiveProcess":
+        """Start the process, with one thread reading each of its piped streams."""
+
+        self._start_time = datetime.datetime.utcnow()
+        self._start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.process = subprocess.Popen(self.cmd, **self.kwargs)  # pylint: disable=R1732
+        for name in ("stdout", "stderr"):
+            pipe = getattr(self.process, name)
+            if pipe is not None:
+                threading.Thread(target=self._read, args=(name, pipe), daemon=True).start()
+                self._open_streams += 1
+        return self
+
+    def _read(self, name: str, pipe) -> None:
+        with pipe:
+            for line in iter(pipe.readline, b""):
+                self._lines.put((name, line.decode("utf-8")))
+        self._lines.put((name, None))
+
+    def __enter__(self) -> "LiveProcess":
+        return self.start()
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is not None and self.process is not None:
+            _kill(self.process)
+        # finish reading, so that the process is always waited on and its attempt recorded
+        for _ in self:
+            pass
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        if self.process is None:
+            self.start()
+        deadline = None
+        if self.timeout is not None:
+            deadline = self._start_time + datetime.timedelta(seconds=self.timeout)
+        killed = False
+        while self._open_streams:
+            if killed:
+                wait = self.kill_grace
+            elif deadline is not None:
+                wait = max(0, (deadline - datetime.datetime.utcnow()).total_seconds())
+            else:
+                wait = None
+            try:
+                name, line = self._lines.get(timeout=wait)
+            except queue.Empty:
+                if killed:
+                    # children of the process still hold its pipes open
+                    self._open_streams = 0
+                    break
+                _kill(self.process)
+                self.attempt.hit_timeout = killed = True
+                continue
+            if line is None:
+                self._open_streams -= 1
+                continue
+            if self.keep_output:
+                self._output[name].append(line)
+            yield name, line
+        self._finish()
+
+    def _finish(self) -> None:
+        if self.attempt.time_seconds is not None:
+            return
+        # output is drained, the process is reaped with wait4 to get its own resource usage
+        own = None
+        if not self.attempt.hit_timeout:
+            try:
+                own = _reap(self.process, timeout=self._remaining())
+                self.attempt.rc = self.process.returncode
+            except subprocess.TimeoutExpired:
+                # the process closed its output but kept on running
+                _kill(self.process)
+                self.attempt.hit_timeout = True
+        if self.attempt.hit_timeout:
+            own = _reap(self.process)
+            self.attempt.time_seconds = self.timeout
+        else:
+            self.attempt.hit_timeout = False
+            self.attempt.time_seconds = (datetime.datetime.utcnow() - self._start_time).total_seconds()
+        self.attempt.set_usage(self._start_usage, resource.getrusage(resource.RUSAGE_CHILDREN), own)
+        if self.keep_output:
+            for name in ("stdout", "stderr"):
+                if getattr(self.process, name) is not None:
+                    setattr(self.attempt, name, "".join(self._output[name]))
+
+    def _remaining(self) -> Optional[float]:
+        if self.timeout is None:
+            return None
+        elapsed = (datetime.datetime.utcnow() - self._start_time).total_seconds()
+        return max(0, self.timeout - elapsed)
+
+
+def _capture_kwargs(kwargs: dict) -> dict:
+    # capture stdout and stderr unless told otherwise
+    kwargs = dict(kwargs)
+    if (
+        kwargs.get("capture_output", False)
+        or {"stdout", "stderr", "capture_output"}.intersection(set(kwargs)) == set()
+    ):
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+
+    # Keeps python 3.6 compatibility
+    if "capture_output" in kwargs:
+        del kwargs["capture_output"]
+    return kwargs
+
+
+def _record_attempt(
+    result: ProcessSample, attempt: ProcessRun, cmd: Union[str, List[str]], logger: logging.Logger, tries: int
+) -> bool:
+    # add the attempt to the sample, returning whether it was successful
+    tries_plural = "s" if tries > 1 else ""
+    logger.debug(f"Finished running. Got attempt: {attempt}")
+    logger.debug(f"Got return code {attempt.rc}, expected {result.expected_rc}")
+    if attempt.rc != result.expected_rc:
+        logger.warning(f"Got bad return code from command: {cmd}.")
+        result.failed.append(attempt)
+        return False
+    logger.debug(f"Command finished with {tries} attempt{tries_plural}: {cmd}")
+    result.successful = attempt
+    result.success = True
+    return True
+
+
 def get_process_sample(
     cmd: Union[str, List[str]],
     logger: logging.Logger,
@@ -42,8 +485,8 @@ def get_process_sample(
     """
     Run the given command as a subprocess, retrying if the command fails.
 
-    Essentially just a wrapper around :py:func:`subprocess.run` that will retry running a subprocess if
-    it fails, returning a :py:class:`~snafu.process.ProcessSample` detailing the results.
+    Essentially just a wrapper around :py:class:`~snafu.process.LiveProcessSample` that keeps the whole
+    output of the subprocess, returning a :py:class:`~snafu.process.ProcessSample` detailing the results.
 
     This function expects a logger because it is expected that it will be used by benchmarks, which should
     be logging their progress anyways.
@@ -62,74 +505,88 @@ def get_process_sample(
     timeout : int, optional
         Time in seconds to wait for process to complete before killing it.
     kwargs
-        Extra kwargs will be passed to :py:class:`~snafu.process.LiveProcess`
+        Extra kwargs will be passed to :py:class:`subprocess.Popen`, except for ``placement``, which takes a
+        :py:class:`~snafu.process.Placement` to place the process with.
 
     Returns
     -------
     ProcessSample
     """
 
-    logger.debug(f"Running command: {cmd}")
-    logger.debug(f"Using args: {kwargs}")
+    live = LiveProcessSample(
+        cmd, logger, retries=retries, expected_rc=expected_rc, timeout=timeout, keep_output=True, **kwargs
+    )
+    for proc in live:
+        for _ in proc:
+            pass
+    return live.sample
 
-    result = ProcessSample(expected_rc=expected_rc, timeout=timeout)
-    tries: int = 0
-    tries_plural: str = ""
 
-    if (
-        kwargs.get("capture_output", False)
-        or {"stdout", "stderr", "capture_output"}.intersection(set(kwargs)) == set()
-    ):
-        kwargs["stdout"] = subprocess.PIPE
-        kwargs["stderr"] = subprocess.PIPE
+class LiveProcessSample:
+    """
+    Run the given command like :py:func:`~snafu.process.get_process_sample`, with live access to its output.
 
-    # Keeps python 3.6 compatibility
-    if "capture_output" in kwargs:
-        del kwargs["capture_output"]
+    Iterating yields the :py:class:`~snafu.process.LiveProcess` of each attempt, which should itself be
+    iterated over to consume its output. Iteration stops after the first successful attempt or once the
+    retries are exhausted, :py:attr:`sample` then holds the resulting
+    :py:class:`~snafu.process.ProcessSample`. Output read from a failed attempt can be told apart by checking
+    the ``rc`` of its ``attempt``.
 
-    while tries <= retries:
-        tries += 1
-        logger.debug(f"On try {tries}")
+    Parameters
+    ----------
+    cmd : str or list of str
+        Command to run. Can be string or list of strings if using :py:mod:`shlex`
+    logger : logging.Logger
+        Logger to use in order to log progress.
+    retries : int, optional
+        Number of retries to perform.
+    expected_rc : int, optional
+        Expected return code of the process.
+    timeout : int, optional
+        Time in seconds to wait for each attempt to complete before killing it.
+    kwargs
+        Extra kwargs will be passed to :py:class:`~snafu.process.LiveProcess`
 
-        attempt = ProcessRun()
-        start_time = datetime.datetime.utcnow()
-        try:
-            proc = subprocess.run(cmd, check=False, timeout=timeout, **kwargs)
-        except subprocess.TimeoutExpired as timeout_error:
-            attempt.hit_timeout = True
-            attempt.time_seconds = timeout_error.timeout
-            stdout = timeout_error.stdout
-            stderr = timeout_error.stderr
-        else:
-            attempt.time_seconds = (datetime.datetime.utcnow() - start_time).total_seconds()
-            attempt.hit_timeout = False
-            attempt.rc = proc.returncode
-            stdout = proc.stdout
-            stderr = proc.stderr
-
-        if stdout is not None:
-            attempt.stdout = stdout.decode("utf-8")
-        if stderr is not None:
-            attempt.stderr = stderr.decode("utf-8")
-
-        logger.debug(f"Finished running. Got attempt: {attempt}")
-        logger.debug(f"Got return code {attempt.rc}, expected {expected_rc}")
-        if attempt.rc != expected_rc:
-            logger.warning(f"Got bad return code from command: {cmd}.")
-            result.failed.append(attempt)
-        else:
-            logger.debug(f"Command finished with {tries} attempt{tries_plural}: {cmd}")
-            result.successful = attempt
-            result.success = True
-            break
-        tries_plural = "s"
-    else:
-        # If we hit retry limit, we go here
-        logger.critical(f"After {tries} attempt{tries_plural}, unable to run command: {cmd}")
-        result.success = False
+    Examples
+    --------
+    >>> live = LiveProcessSample("echo 'hello'", logging.getLogger(), shell=True)
+    >>> [line.rstrip() for proc in live for stream, line in proc]
+    ['hello']
+    >>> live.sample.success, live.sample.attempts
+    (True, 1)
+    """
+
+    def __init__(
+        self,
+        cmd: Union[str, List[str]],
+        logger: logging.Logger,
+        retries: int = 0,
+        expected_rc: int = 0,
+        timeout: Optional[int] = None,
+        **kwargs,
+    ):
+        self.cmd = cmd
+        self.logger = logger
+        self.retries = retries
+        self.timeout = timeout
+        self.kwargs = kwargs
+        self.sample = ProcessSample(expected_rc=expected_rc, timeout=timeout)
 
-    result.attempts = tries
-    return result
+    def __iter__(self) -> Iterator[LiveProcess]:
+        self.logger.debug(f"Running command: {self.cmd}")
+        self.logger.debug(f"Using args: {self.kwargs}")
+        tries = 0
+        while tries <= self.retries:
+            tries += 1
+            self.sample.attempts = tries
+            self.logger.debug(f"On try {tries}")
+            with LiveProcess(self.cmd, timeout=self.timeout, **self.kwargs) as proc:
+                yield proc
+            if _record_attempt(self.sample, proc.attempt, self.cmd, self.logger, tries):
+                return
+        tries_plural = "s" if tries > 1 else ""
+        self.logger.critical(f"After {tries} attempt{tries_plural}, unable to run command: {self.cmd}")
+        self.sample.success = False
 
 
 def sample_process(
@@ -161,3 +618,39 @@ def sample_process(
         logger.debug(f"Collected sample {sample_num} for command {cmd}")
 
     logger.info(f"Finished collecting {num_samples} sample{_plural} for command {cmd}")
+
+
+def live_sample_process(
+    cmd: Union[str, List[str]],
+    logger: logging.Logger,
+    retries: int = 0,
+    expected_rc: int = 0,
+    timeout: Optional[int] = None,
+    num_samples: int = 1,
+    **kwargs,
+) -> Iterable[LiveProcessSample]:
+    """
+    Yield multiple samples of the given command, with live access to their output.
+
+    Same as :py:func:`~snafu.process.sample_process`, except that the
+    :py:class:`~snafu.process.LiveProcessSample` of each sample is yielded, and must be iterated over to run
+    it. Its ``sample`` is complete once it was.
+    """
+
+    _plural = "s" if num_samples > 1 else ""
+    logger.info(f"Collecting {num_samples} sample{_plural} of command {cmd}")
+    for sample_num in range(1, num_samples + 1):
+        logger.debug(f"Starting sample {sample_num}")
+        live = LiveProcessSample(
+            cmd, logger, retries=retries, expected_rc=expected_rc, timeout=timeout, **kwargs
+        )
+        yield live
+        logger.debug(f"Got sample for command {cmd}: {live.sample}")
+
+        if not live.sample.success:
+            logger.warning(f"Sample {sample_num} has failed state for command {cmd}")
+        else:
+            logger.debug(f"Sample {sample_num} has success state for command {cmd}")
+        logger.debug(f"Collected sample {sample_num} for command {cmd}")
+
+    logger.info(f"Finished collecting {num_samples} sample{_plural} for command {cmd}")
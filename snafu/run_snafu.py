@@ -12,7 +12,7 @@
 #   limitations under the License.
 
 import datetime
-import hashlib
+import functools
 import json
 import logging
 
@@ -20,23 +20,33 @@ import logging
 # per_job_logs=true
 #
 import os
-import ssl
+import signal
 import sys
+import threading
 import time
 from distutils.util import strtobool
 
 import configargparse
-import elasticsearch
-import urllib3
 
 from snafu import benchmarks
+from snafu.agent import Agent, write_response
+from snafu.suite import SuiteRunner, load_suite, schedule
+from snafu.utils.archive import ArchiveWriter, archive_parts, read_archive_lines
+from snafu.utils.archive_replay import replay_archive
 from snafu.utils.common_logging import setup_loggers
-from snafu.utils.get_prometheus_data import get_prometheus_data
+from snafu.utils.dedup_filter import AcknowledgedIds
+from snafu.utils.documents import archive_line, finalize_document
+from snafu.utils.es_client import close_es_clients, forget_es_clients, get_es_client
+from snafu.utils.exporters import ElasticsearchExporter, create_file_exporter, export_documents
+from snafu.utils.indexing_pipeline import IndexingPipeline
+from snafu.utils.prometheus_indexer import PrometheusIndexer
 from snafu.utils.py_es_bulk import streaming_bulk
 from snafu.utils.request_cache_drop import drop_cache
-from snafu.utils.wrapper_factory import wrapper_factory
+from snafu.utils.wrapper_factory import import_wrapper, wrapper_factory
 
 logger = logging.getLogger("snafu")
+# guards the run totals and the archive writer
+_document_lock = threading.Lock()
 
 # mute elasticsearch and urllib3 logging
 es_log = logging.getLogger("elasticsearch")
@@ -45,7 +55,7 @@ urllib3_log = logging.getLogger("urllib3")
 urllib3_log.setLevel(logging.CRITICAL)
 
 
-def main():
+def get_parser():
     # collect arguments
     parser = configargparse.get_argument_parser(
         description="Run benchmark-wrapper and export results.",
@@ -65,7 +75,9 @@ def main():
         help="enables verbose wrapper debugging info",
     )
     parser.add_argument("--config", help="Config file to load", is_config_file=True)
-    parser.add_argument("-t", "--tool", help="Provide tool name", required=True)
+    parser.add_argument(
+        "-t", "--tool", help="Provide tool name, required unless running with --agent or --suite"
+    )
     parser.add_argument("--run-id", help="Run ID to unify benchmark results in ES", nargs="?", default="NA")
     parser.add_argument("--archive-file", help="Archive file that will be indexed into ES")
     parser.add_argument(
@@ -76,17 +88,213 @@ def main():
         default=False,
         help="enables creation of archive file",
     )
+    parser.add_argument(
+        "--archive-compression",
+        dest="archive_compression",
+        choices=["gzip", "zstd"],
+        default=None,
+        help="compress the archive file, zstd requires the zstandard package",
+    )
+    parser.add_argument(
+        "--archive-rotate-bytes",
+        dest="archive_rotate_bytes",
+        type=int,
+        default=None,
+        help="start a new archive part once the current one holds this many uncompressed bytes",
+    )
+    parser.add_argument(
+        "--replay-workers",
+        dest="replay_workers",
+        type=int,
+        default=1,
+        help="number of processes used to index an archive with -t archive, each with its own ES client",
+    )
+    parser.add_argument(
+        "--replay-checkpoint",
+        dest="replay_checkpoint",
+        default=None,
+        help="checkpoint file of an archive replay, defaults to <archive>.checkpoint with --replay-workers",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_const",
+        dest="pipeline",
+        const=True,
+        default=False,
+        help="index results on background threads while the benchmark keeps running",
+    )
+    parser.add_argument(
+        "--pipeline-workers",
+        dest="pipeline_workers",
+        type=int,
+        default=1,
+        help="number of indexer threads used by --pipeline",
+    )
+    parser.add_argument(
+        "--pipeline-queue-docs",
+        dest="pipeline_queue_docs",
+        type=int,
+        default=10000,
+        help="maximum number of documents waiting to be indexed before the benchmark is blocked",
+    )
+    parser.add_argument(
+        "--pipeline-queue-bytes",
+        dest="pipeline_queue_bytes",
+        type=int,
+        default=100 * 1024 * 1024,
+        help="maximum size in bytes of the documents waiting to be indexed before the benchmark is blocked",
+    )
+    parser.add_argument(
+        "--index-max-attempts",
+        dest="index_max_attempts",
+        type=int,
+        default=None,
+        help="maximum number of times a document is sent to ES before giving up on it",
+    )
+    parser.add_argument(
+        "--index-retry-deadline",
+        dest="index_retry_deadline",
+        type=float,
+        default=None,
+        help="seconds after the first attempt to index a document after which it is no longer retried",
+    )
+    parser.add_argument(
+        "--index-max-inflight-bytes",
+        dest="index_max_inflight_bytes",
+        type=int,
+        default=200 * 1024 * 1024,
+        help="maximum size in bytes of documents being sent to ES or waiting to be retried",
+    )
+    parser.add_argument(
+        "--dead-letter-file",
+        dest="dead_letter_file",
+        default=None,
+        help="NDJSON file receiving documents which could not be indexed, can be indexed with -t archive",
+    )
+    parser.add_argument(
+        "--adaptive-bulk",
+        action="store_const",
+        dest="adaptive_bulk",
+        const=True,
+        default=False,
+        help="with parallel indexing, tune bulk request size and concurrency to the ES cluster at runtime",
+    )
+    parser.add_argument(
+        "--export",
+        dest="exports",
+        action="append",
+        default=[],
+        help="also export results as <format>:<directory>, format being ndjson or parquet "
+        "(requires pyarrow), may be repeated",
+    )
+    parser.add_argument(
+        "--export-batch-docs",
+        dest="export_batch_docs",
+        type=int,
+        default=10000,
+        help="number of documents written to each file by --export",
+    )
+    parser.add_argument(
+        "--dedup-dir",
+        dest="dedup_dir",
+        default=None,
+        help="directory remembering the documents already indexed per ES host and index prefix, "
+        "documents indexed by a previous run are skipped instead of being sent again",
+    )
+    parser.add_argument(
+        "--compact-batches",
+        action="store_const",
+        dest="compact_batches",
+        const=True,
+        default=False,
+        help="index each batch of results of a benchmark as one document holding an array per field, "
+        "under the <tag>-batch index, instead of one document per result",
+    )
+    parser.add_argument(
+        "--agent",
+        action="store_const",
+        dest="agent",
+        const=True,
+        default=False,
+        help="stay resident and run the jobs read as NDJSON from stdin, or from --agent-socket",
+    )
+    parser.add_argument(
+        "--agent-socket",
+        dest="agent_socket",
+        default=None,
+        help="path of the Unix socket the agent accepts jobs on instead of stdin",
+    )
+    parser.add_argument(
+        "--agent-jobs",
+        dest="agent_jobs",
+        type=int,
+        default=1,
+        help="maximum number of jobs the agent runs concurrently, each in its own worker process",
+    )
+    parser.add_argument(
+        "--agent-preload",
+        dest="agent_preload",
+        action="append",
+        default=[],
+        help="tool imported by the agent before starting its workers, may be repeated",
+    )
+    parser.add_argument(
+        "--suite",
+        dest="suite",
+        default=None,
+        help="YAML file listing tool invocations to run from this process, indexed as a single run",
+    )
+    return parser
+
+
+def main():
+    parser = get_parser()
     index_args, unknown = parser.parse_known_args()
+    if index_args.agent:
+        return serve_agent(index_args)
+    if index_args.suite:
+        index_args.tool = "suite"
+    elif not index_args.tool:
+        parser.error("the following arguments are required: -t/--tool")
+    run(index_args, parser)
+    if index_args.failed_invocations:
+        return 1
+
+
+def init_index_args(index_args):
     index_args.index_results = False
     index_args.prefix = "snafu-%s" % index_args.tool
+    index_args.archive_writer = None
+    index_args.prometheus_indexer = None
+    index_args.seen_ids = None
+    index_args.opened_seen_ids = {}
+    index_args.document_size_capacity_bytes = 0
+    index_args.document_count = 0
+    index_args.failed_invocations = []
+
+
+def run(index_args, parser, close_clients=True):
+    init_index_args(index_args)
+    try:
+        exporters = [create_file_exporter(spec, index_args.export_batch_docs) for spec in index_args.exports]
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
 
     setup_loggers("snafu", index_args.loglevel)
     log_level_str = "DEBUG" if index_args.loglevel == logging.DEBUG else "INFO"
     logger.info("logging level is %s" % log_level_str)
 
-    # Log loaded benchmarks
+    # Log loaded benchmarks, only the selected one is imported unless debugging
     show_db_tb = index_args.loglevel == logging.DEBUG
-    benchmarks.DETECTED_BENCHMARKS.log(logger=logger, level=logging.INFO, show_tb=show_db_tb)
+    if show_db_tb:
+        detected = benchmarks.load_benchmarks()
+    else:
+        detected = benchmarks.load_benchmarks(
+            [benchmarks.BENCHMARK_MODULES[index_args.tool]]
+            if index_args.tool in benchmarks.BENCHMARK_MODULES
+            else []
+        )
+    detected.log(logger=logger, level=logging.INFO, show_tb=show_db_tb)
 
     # set up a standard format for time
     FMT = "%Y-%m-%dT%H:%M:%SGMT"
@@ -103,72 +311,70 @@ def main():
         logger.info("Using index prefix for ES: %s" % index_args.prefix)
         index_args.index_results = True
         try:
-            if es_settings["verify_cert"] == "false":
-                logger.info("Turning off TLS certificate verification")
-                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-                ssl_ctx = ssl.create_default_context()
-                ssl_ctx.check_hostname = False
-                ssl_ctx.verify_mode = ssl.CERT_NONE
-                es = elasticsearch.Elasticsearch(
-                    [es_settings["server"]], send_get_body_as="POST", ssl_context=ssl_ctx, use_ssl=False
-                )
-            else:
-                es = elasticsearch.Elasticsearch([es_settings["server"]], send_get_body_as="POST")
-            logger.info("Connected to the elasticsearch cluster with info as follows:")
-            logger.info(json.dumps(es.info(), indent=4))
+            es = get_es_client(es_settings["server"], verify_cert=es_settings["verify_cert"] != "false")
         except Exception as e:
             logger.warn("Elasticsearch connection caused an exception: %s" % e)
             index_args.index_results = False
-
-    index_args.document_size_capacity_bytes = 0
-    # call py es bulk using a process generator to feed it ES documents
-    if index_args.index_results:
-        parallel_setting = strtobool(os.environ.get("parallel", "false"))
-
-        if "archive" in index_args.tool:
-            if index_args.archive_file:
-                #  if processing a archive file use the process archive file function
-                res_beg, res_end, res_suc, res_dup, res_fail, res_retry = streaming_bulk(
-                    es, process_archive_file(index_args), parallel_setting
-                )
+    try:
+        if index_args.index_results and index_args.dedup_dir:
+            index_args.seen_ids = open_seen_ids(index_args, es_settings["server"], index_args.prefix)
+
+        res_suc = res_dup = res_fail = res_retry = 0
+        # call py es bulk using a process generator to feed it ES documents
+        if index_args.index_results:
+            parallel_setting = strtobool(os.environ.get("parallel", "false"))
+
+            if "archive" in index_args.tool:
+                if index_args.archive_file and (
+                    index_args.replay_workers > 1 or index_args.replay_checkpoint
+                ):
+                    #  replay shards of the archive from multiple processes, resuming from the checkpoint
+                    res_beg, res_end, res_suc, res_dup, res_fail, res_retry = replay_archive_file(
+                        index_args, es_settings, parallel_setting
+                    )
+                elif index_args.archive_file:
+                    #  if processing a archive file use the process archive file function
+                    res_beg, res_end, res_suc, res_dup, res_fail, res_retry = index_documents(
+                        es, process_archive_file(index_args), index_args, parallel_setting, exporters
+                    )
+                else:
+                    logger.error(
+                        "Attempted to index archive without specifying a file, use --archive-file=<file>"
+                    )
+                    exit(1)
             else:
-                logger.error(
-                    "Attempted to index archive without specifying a file, use --archive-file=<file>"
+                # else run a test and process new result documents
+                res_beg, res_end, res_suc, res_dup, res_fail, res_retry = index_documents(
+                    es, process_documents(index_args, parser), index_args, parallel_setting, exporters
                 )
-                exit(1)
-        else:
-            # else run a test and process new result documents
-            res_beg, res_end, res_suc, res_dup, res_fail, res_retry = streaming_bulk(
-                es, process_generator(index_args, parser), parallel_setting
-            )
 
-        logger.info(
-            "Indexed results - %s success, %s duplicates, %s failures, with %s retries."
-            % (res_suc, res_dup, res_fail, res_retry)
-        )
+            logger.info(
+                "Indexed results - %s success, %s duplicates, %s failures, with %s retries."
+                % (res_suc, res_dup, res_fail, res_retry)
+            )
 
-        start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_beg))
-        end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_end))
+            start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_beg))
+            end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_end))
 
-    else:
-        logger.info("Not connected to Elasticsearch")
-        start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime())
-        # need to loop through generator and pass on all yields
-        # this will execute all jobs without elasticsearch
-        if "archive" in index_args.tool:
-            if index_args.archive_file:
-                logger.info("Processing archive file, but not indexing results...")
-                for es_friendly_doc in process_archive_file(index_args):
-                    pass
-            else:
-                logger.error(
-                    "Attempted to index archive without specifying a file, use --archive-file=<file>"
-                )
-                exit(1)
         else:
-            for i in process_generator(index_args, parser):
-                pass
-        end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime())
+            logger.info("Not connected to Elasticsearch")
+            start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime())
+            # need to loop through generator and pass on all yields
+            # this will execute all jobs without elasticsearch
+            if "archive" in index_args.tool:
+                if index_args.archive_file:
+                    logger.info("Processing archive file, but not indexing results...")
+                    export_documents(process_archive_file(index_args), exporters)
+                else:
+                    logger.error(
+                        "Attempted to index archive without specifying a file, use --archive-file=<file>"
+                    )
+                    exit(1)
+            else:
+                export_documents(process_documents(index_args, parser), exporters)
+            end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime())
+    finally:
+        close_run(index_args, close_clients)
 
     start_t = datetime.datetime.strptime(start_t, FMT)
     end_t = datetime.datetime.strptime(end_t, FMT)
@@ -179,6 +385,201 @@ def main():
     logger.info(
         "Duration of execution - {}, with total size of {} bytes".format(tdelta, total_capacity_bytes)
     )
+    return {
+        "indexed": index_args.index_results,
+        "documents": index_args.document_count,
+        "document_bytes": total_capacity_bytes,
+        "success": res_suc,
+        "duplicates": res_dup,
+        "failures": res_fail,
+        "retries": res_retry,
+        "duration_seconds": tdelta.total_seconds(),
+    }
+
+
+def close_run(index_args, close_clients=True):
+    # also runs when the run fails, so that buffered archive lines and queued prometheus data aren't lost
+    try:
+        close_prometheus_indexer(index_args)
+    finally:
+        if index_args.archive_writer is not None:
+            index_args.archive_writer.close()
+            index_args.archive_writer = None
+        for seen_ids in index_args.opened_seen_ids.values():
+            seen_ids.close()
+        index_args.opened_seen_ids = {}
+        if close_clients:
+            close_es_clients()
+
+
+def serve_agent(index_args):
+    setup_loggers("snafu", index_args.loglevel)
+    # workers are forked from this process, so whatever is imported here is already warm in every job
+    for tool in index_args.agent_preload:
+        if tool in benchmarks.BENCHMARK_MODULES:
+            benchmarks.load_benchmarks([benchmarks.BENCHMARK_MODULES[tool]]).log(logger=logger)
+        elif import_wrapper(tool) is None:
+            logger.warning("Not preloading unknown tool %s" % tool)
+    agent = Agent(run_agent_job, max_jobs=index_args.agent_jobs)
+    # pods are stopped with SIGTERM, which gets the same graceful shutdown as an interrupt
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        if index_args.agent_socket:
+            agent.serve_socket(index_args.agent_socket)
+        else:
+            agent.serve(sys.stdin, write_response(sys.stdout))
+    except KeyboardInterrupt:
+        logger.info("Agent interrupted, waiting for the running jobs")
+    finally:
+        agent.close()
+
+
+def run_agent_job(tool, args, env):
+    # runs in a worker process of the agent, which keeps its imports and ES clients from job to job
+    saved_argv, saved_env = sys.argv, dict(os.environ)
+    handlers = list(logger.handlers)
+    sys.argv = [saved_argv[0], "-t", tool] + list(args)
+    os.environ.update(env)
+    # jobs add their own arguments to the parser singleton, start from a new one
+    reset_argument_parser()
+    result = {"rc": 0, "error": None, "counters": None}
+    try:
+        parser = get_parser()
+        index_args, unknown = parser.parse_known_args()
+        result["counters"] = run(index_args, parser, close_clients=False)
+        if index_args.failed_invocations:
+            result["rc"], result["error"] = 1, "Suite invocations failed: %s" % ", ".join(
+                index_args.failed_invocations
+            )
+    except SystemExit as e:
+        result["rc"] = e.code if isinstance(e.code, int) else 1
+        if e.code and not isinstance(e.code, int):
+            result["error"] = str(e.code)
+    except Exception as e:
+        logger.exception("Agent job running %s failed" % tool)
+        result["rc"], result["error"] = 1, "%s: %s" % (type(e).__name__, e)
+    finally:
+        sys.argv = saved_argv
+        os.environ.clear()
+        os.environ.update(saved_env)
+        for handler in logger.handlers[:]:
+            if handler not in handlers:
+                logger.removeHandler(handler)
+    return result
+
+
+def reset_argument_parser():
+    configargparse._parsers.pop("default", None)  # pylint: disable=W0212
+
+
+def get_bulk_kwargs(index_args):
+    return {
+        "max_attempts": index_args.index_max_attempts,
+        "retry_deadline": index_args.index_retry_deadline,
+        "dead_letter_file": index_args.dead_letter_file,
+        "max_inflight_bytes": index_args.index_max_inflight_bytes,
+        "adaptive": index_args.adaptive_bulk,
+        "seen_ids": index_args.seen_ids,
+    }
+
+
+def open_seen_ids(index_args, server, prefix):
+    # keep one set per ES host and index prefix open until the end of the run
+    if (server, prefix) not in index_args.opened_seen_ids:
+        index_args.opened_seen_ids[(server, prefix)] = AcknowledgedIds.for_target(
+            index_args.dedup_dir, server, prefix
+        )
+    return index_args.opened_seen_ids[(server, prefix)]
+
+
+def create_pipeline(es, index_args, parallel_setting):
+    return IndexingPipeline(
+        es,
+        parallel=parallel_setting,
+        workers=index_args.pipeline_workers,
+        max_docs=index_args.pipeline_queue_docs,
+        max_bytes=index_args.pipeline_queue_bytes,
+        bulk_kwargs=get_bulk_kwargs(index_args),
+    )
+
+
+def index_documents(es, documents, index_args, parallel_setting, exporters=()):
+    if exporters:
+        # ES becomes one of several sinks fed document by document, so it indexes on background threads
+        es_exporter = ElasticsearchExporter(create_pipeline(es, index_args, parallel_setting))
+        return export_documents(documents, [es_exporter] + list(exporters))[0]
+    if index_args.pipeline:
+        # index on background threads so ES latency doesn't stall the benchmark
+        return create_pipeline(es, index_args, parallel_setting).run(documents)
+    return streaming_bulk(es, documents, parallel_setting, **get_bulk_kwargs(index_args))
+
+
+def process_documents(index_args, parser):
+    if index_args.suite:
+        return process_suite(index_args, parser)
+    return process_generator(index_args, parser)
+
+
+def process_suite(index_args, parser):
+    try:
+        stages = schedule(load_suite(index_args.suite))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    runner = SuiteRunner(stages, functools.partial(suite_documents, run_id=index_args.run_id))
+    # invocations are forked by the launcher of the suite, which must not inherit the indexing threads
+    runner.start()
+    return process_suite_documents(runner, index_args)
+
+
+def process_suite_documents(runner, index_args):
+    for document in runner.run():
+        # documents were finalized by the invocations, only the suite keeps the totals and the archive
+        source = None
+        if index_args.createarchive and index_args.archive_writer is None:
+            source = json.loads(document["_source"])
+        record_document(index_args, document, source)
+        yield document
+
+    summary = runner.summary()
+    for stage in summary["stages"]:
+        logger.info(
+            "Suite stage %s took %.1fs: %s"
+            % (stage["stage"], stage["wall_seconds"], ", ".join(stage["invocations"]))
+        )
+    logger.info(
+        "Suite took %.1fs, %.1fs saved by concurrent invocations, %.1fs waiting on benchmarks, "
+        "%.1fs indexing"
+        % (
+            summary["wall_seconds"],
+            summary["concurrency_saved_seconds"],
+            summary["waiting_seconds"],
+            summary["indexing_seconds"],
+        )
+    )
+    index_args.failed_invocations = summary["failed"]
+    if summary["failed"]:
+        logger.error("Suite invocations failed: %s" % ", ".join(summary["failed"]))
+    summary["suite"] = index_args.suite
+    yield get_valid_es_document(summary, "suite-summary", index_args)
+
+
+def suite_documents(invocation, run_id):
+    # runs in the process forked for the invocation, its documents are indexed by the suite
+    forget_es_clients()
+    sys.argv = [sys.argv[0], "-t", invocation.tool] + invocation.args
+    reset_argument_parser()
+    parser = get_parser()
+    index_args, unknown = parser.parse_known_args()
+    init_index_args(index_args)
+    index_args.createarchive = False
+    if index_args.run_id == "NA":
+        index_args.run_id = run_id
+    if os.getenv("es"):
+        index_args.prefix = os.getenv("es_index", index_args.prefix)
+    try:
+        yield from process_generator(index_args, parser)
+    finally:
+        close_prometheus_indexer(index_args)
 
 
 def process_generator(index_args, parser):
@@ -186,35 +587,63 @@ def process_generator(index_args, parser):
 
     for wrapper_object in benchmark_wrapper_object_generator:
         if isinstance(wrapper_object, benchmarks.Benchmark):
-            for result in wrapper_object.run():
-                if result.tag == "get_prometheus_trigger" and "prom_es" in os.environ:
-                    index_prom_data(index_args, result.to_json())
-                else:
-                    es_valid_document = get_valid_es_document(result.to_jsonable(), result.tag, index_args)
-                    yield es_valid_document
+            actions = benchmark_actions(index_args, wrapper_object.run())
+            yield from process_actions(index_args, actions)
         else:
             for data_object in wrapper_object.run():
                 # drop cache after every sample
                 drop_cache()
-                for action, index in data_object.emit_actions():
-                    if "get_prometheus_trigger" in index and "prom_es" in os.environ:
-                        # Action will contain the following
-                        """
-                        action: {
-                                  "uuid": <uuid>
-                                  "user": <user>
-                                  "clustername": <clustername>
-                                  "sample": <int>
-                                  "starttime": <datetime> datetime.utcnow().strftime('%s')
-                                  "endtime": <datetime>
-                                  test_config: {...}
-                                }
-                        """
-
-                        index_prom_data(index_args, action)
-                    else:
-                        es_valid_document = get_valid_es_document(action, index, index_args)
-                        yield es_valid_document
+                yield from process_actions(index_args, data_object.emit_actions())
+
+
+def benchmark_actions(index_args, results):
+    for result in results:
+        if not isinstance(result, benchmarks.BenchmarkResultBatch):
+            yield result.to_jsonable(), result.tag
+        elif index_args.compact_batches:
+            if len(result):
+                yield result.to_jsonable(), result.tag + "-batch"
+        else:
+            for action in result.to_jsonables():
+                yield action, result.tag
+
+
+def process_actions(index_args, actions):
+    # in prometheus summary mode, results are held back until the trigger of their sample, so that the
+    # summaries of the sample can be attached to them
+    summary_mode = "prom_es" in os.environ and strtobool(os.environ.get("prom_summary", "false"))
+    held = []
+    for action, index in actions:
+        if "get_prometheus_trigger" in index and "prom_es" in os.environ:
+            # Action will contain the following
+            """
+            action: {
+                      "uuid": <uuid>
+                      "user": <user>
+                      "clustername": <clustername>
+                      "sample": <int>
+                      "starttime": <datetime> datetime.utcnow().strftime('%s')
+                      "endtime": <datetime>
+                      test_config: {...}
+                    }
+            """
+            if summary_mode:
+                summaries = summarize_prom_data(index_args, action)
+                for held_action, held_index in held:
+                    if summaries:
+                        held_action["prometheus"] = summaries
+                    yield get_valid_es_document(held_action, held_index, index_args)
+                held = []
+            else:
+                index_prom_data(index_args, action)
+        elif summary_mode and index == "results":
+            held.append((action, index))
+        else:
+            es_valid_document = get_valid_es_document(action, index, index_args)
+            yield es_valid_document
+    # results without a trigger are indexed as they are
+    for held_action, held_index in held:
+        yield get_valid_es_document(held_action, held_index, index_args)
 
 
 def generate_wrapper_object(index_args, parser):
@@ -223,116 +652,149 @@ def generate_wrapper_object(index_args, parser):
     yield benchmark_wrapper_object
 
 
-def get_valid_es_document(action, index, index_args):
+def get_valid_es_document(action, index, index_args, prefix=None):
+    if prefix is None:
+        prefix = index_args.prefix
     if index != "":
-        es_index = index_args.prefix + "-" + index
+        es_index = prefix + "-" + index
     else:
-        es_index = index_args.prefix
-    es_valid_document = {"_index": es_index, "_op_type": "create", "_source": action, "_id": ""}
-    logger.debug("Run ID is %s" % {index_args.run_id})
-    es_valid_document["run_id"] = action["run_id"] = index_args.run_id
-    es_valid_document["_id"] = hashlib.sha256(str(action).encode()).hexdigest()
-    document_size_bytes = sys.getsizeof(es_valid_document)
-    index_args.document_size_capacity_bytes += document_size_bytes
-    logger.debug("document size is: %s" % document_size_bytes)
-    logger.debug(json.dumps(es_valid_document, indent=4, default=str))
-
-    if index_args.createarchive:
-        write_to_archive_file(index_args, es_valid_document)
+        es_index = prefix
+    # serialize the source once, the same string is hashed, indexed and archived
+    es_valid_document = finalize_document(action, es_index, index_args.run_id)
+    document_size_bytes = len(es_valid_document["_source"])
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Run ID is %s" % index_args.run_id)
+        logger.debug("document size is: %s" % document_size_bytes)
+        logger.debug(archive_line(es_valid_document))
+
+    record_document(index_args, es_valid_document, action)
     return es_valid_document
 
 
-def index_prom_data(index_args, action):
-    es_settings = {}
+def record_document(index_args, es_valid_document, source):
+    # prometheus documents are finalized on a background thread
+    with _document_lock:
+        index_args.document_size_capacity_bytes += len(es_valid_document["_source"])
+        index_args.document_count += 1
+        if index_args.createarchive:
+            write_to_archive_file(index_args, es_valid_document, source)
 
-    # definition of prometheus data getter, will yield back prom doc
-    def get_prometheus_generator(index_args, action):
-        prometheus_doc_generator = get_prometheus_data(action)
-        for prometheus_doc in prometheus_doc_generator.get_all_metrics():
-            es_valid_document = get_valid_es_document(prometheus_doc, "prometheus_data", index_args)
-            yield es_valid_document
 
-    es_settings["server"] = os.getenv("prom_es")
-    es_settings["verify_cert"] = os.getenv("es_verify_cert", "true")
-    if ":443" in es_settings["server"]:
-        es_settings["verify_cert"] = "false"
-    if es_settings["server"]:
-        index_args.prefix = os.getenv("es_index", "")
-        logger.info("Using Prometheus elasticsearch server with host: %s" % es_settings["server"])
-        logger.info("Using index prefix for prometheus ES: %s" % index_args.prefix)
-        index_args.index_results = True
+def index_prom_data(index_args, action):
+    indexer = get_prometheus_indexer(index_args)
+    if indexer is not None:
+        indexer.submit(action)
+
+
+def summarize_prom_data(index_args, action):
+    indexer = get_prometheus_indexer(index_args)
+    if indexer is None:
+        return {}
+    try:
+        return indexer.summarize(action)
+    except Exception as e:
+        logger.warn("Summarizing prometheus data caused an exception: %s" % e)
+        return {}
+
+
+def get_prometheus_indexer(index_args):
+    # a single client, pipeline and background worker serve every prometheus trigger of the run
+    if index_args.prometheus_indexer is None:
+        index_args.prometheus_indexer = False
+        server = os.getenv("prom_es")
+        verify_cert = os.getenv("es_verify_cert", "true").lower() != "false" and ":443" not in server
+        prefix = os.getenv("es_index", "")
+        logger.info("Using Prometheus elasticsearch server with host: %s" % server)
+        logger.info("Using index prefix for prometheus ES: %s" % prefix)
         try:
-            if es_settings["verify_cert"] == "false":
-                logger.info("Turning off TLS certificate verification for Prometheus ES indexer")
-                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-                ssl_ctx = ssl.create_default_context()
-                ssl_ctx.check_hostname = False
-                ssl_ctx.verify_mode = ssl.CERT_NONE
-                es = elasticsearch.Elasticsearch(
-                    [es_settings["server"]], send_get_body_as="POST", ssl_context=ssl_ctx, use_ssl=True
-                )
-            else:
-                es = elasticsearch.Elasticsearch([es_settings["server"]], send_get_body_as="POST")
-            logger.info("Connected to the elasticsearch cluster with info as follows:")
-            logger.info(json.dumps(es.info(), indent=4))
+            es = get_es_client(server, verify_cert=verify_cert, use_ssl=not verify_cert)
         except Exception as e:
             logger.warn("Elasticsearch connection caused an exception: %s" % e)
-            index_args.index_results = False
-
-    # check that we want to index and that the prom_es exist.
-    if index_args.index_results:
+            return None
         logger.info("initializing prometheus indexing")
-        parallel_setting = strtobool(os.environ.get("parallel", "false"))
-        res_beg, res_end, res_suc, res_dup, res_fail, res_retry = streaming_bulk(
-            es, get_prometheus_generator(index_args, action), parallel_setting
+        bulk_kwargs = get_bulk_kwargs(index_args)
+        if index_args.dedup_dir:
+            # prometheus data may go to another ES server and prefix, which are tracked separately
+            bulk_kwargs["seen_ids"] = open_seen_ids(index_args, server, prefix)
+        pipeline = IndexingPipeline(
+            es,
+            parallel=strtobool(os.environ.get("parallel", "false")),
+            max_docs=index_args.pipeline_queue_docs,
+            max_bytes=index_args.pipeline_queue_bytes,
+            bulk_kwargs=bulk_kwargs,
         )
-
-        logger.info(
-            "Prometheus indexed results - %s success, %s duplicates, %s failures, with %s retries."
-            % (res_suc, res_dup, res_fail, res_retry)
+        index_args.prometheus_indexer = PrometheusIndexer(
+            pipeline, lambda doc: get_valid_es_document(doc, "prometheus_data", index_args, prefix)
         )
-        start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_beg))
-        end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_end))
-        # set up a standard format for time
-        FMT = "%Y-%m-%dT%H:%M:%SGMT"
-        start_t = datetime.datetime.strptime(start_t, FMT)
-        end_t = datetime.datetime.strptime(end_t, FMT)
+    return index_args.prometheus_indexer or None
+
+
+def close_prometheus_indexer(index_args):
+    if not index_args.prometheus_indexer:
+        return
+    res_beg, res_end, res_suc, res_dup, res_fail, res_retry = index_args.prometheus_indexer.close()
+    logger.info(
+        "Prometheus indexed results - %s success, %s duplicates, %s failures, with %s retries."
+        % (res_suc, res_dup, res_fail, res_retry)
+    )
+    logger.info(
+        "Prometheus indexing duration of execution - %s" % datetime.timedelta(seconds=int(res_end - res_beg))
+    )
+
 
-        # get time delta for indexing run
-        tdelta = end_t - start_t
-        logger.info("Prometheus indexing duration of execution - %s" % tdelta)
+def replay_archive_file(index_args, es_settings, parallel_setting):
+    checkpoint = index_args.replay_checkpoint or index_args.archive_file + ".checkpoint"
+    bulk_kwargs = get_bulk_kwargs(index_args)
+    bulk_kwargs["parallel"] = parallel_setting
+    # workers read the set of acknowledged ids from disk, the replay adds the ids they got acknowledged
+    seen_ids = bulk_kwargs.pop("seen_ids")
+    stats, document_bytes = replay_archive(
+        index_args.archive_file,
+        checkpoint,
+        workers=max(1, index_args.replay_workers),
+        es_args=(es_settings["server"], es_settings["verify_cert"] != "false"),
+        bulk_kwargs=bulk_kwargs,
+        seen_ids=seen_ids,
+    )
+    index_args.document_size_capacity_bytes += document_bytes
+    return stats
 
 
 def process_archive_file(index_args):
 
-    if os.path.isfile(index_args.archive_file):
-        with open(index_args.archive_file) as f:
-            for line in f:
-                es_friendly_document = json.loads(line)
-                document_size_bytes = sys.getsizeof(es_friendly_document)
-                index_args.document_size_capacity_bytes += document_size_bytes
-                yield es_friendly_document
+    if archive_parts(index_args.archive_file):
+        # reads compressed and rotated archives transparently
+        for line in read_archive_lines(index_args.archive_file):
+            es_friendly_document = json.loads(line)
+            index_args.document_size_capacity_bytes += len(line)
+            index_args.document_count += 1
+            yield es_friendly_document
     else:
         logger.error("%s Not found" % index_args.archive_file)
         exit(1)
 
 
-def write_to_archive_file(index_args, es_friendly_documment):
+def write_to_archive_file(index_args, es_friendly_documment, source):
 
-    if index_args.archive_file:
-        archive_filename = index_args.archive_file
-    else:
-        #  assumes that all documents have the same structure
-        user = es_friendly_documment["_source"]["user"]
-        clustername = es_friendly_documment["_source"]["clustername"]
-        uuid = es_friendly_documment["_source"]["uuid"]
-        #  create archive file as user_clustername_uuid.archive in cwd
-        archive_filename = user + "_" + clustername + "_" + uuid + ".archive"
+    if index_args.archive_writer is None:
+        if index_args.archive_file:
+            archive_filename = index_args.archive_file
+        else:
+            #  assumes that all documents have the same structure
+            user = source["user"]
+            clustername = source["clustername"]
+            uuid = source["uuid"]
+            #  create archive file as user_clustername_uuid.archive in cwd
+            archive_filename = user + "_" + clustername + "_" + uuid + ".archive"
+        #  the writer stays open for the whole run and is closed by close_run(), even if the run fails
+        index_args.archive_writer = ArchiveWriter(
+            archive_filename,
+            compression=index_args.archive_compression,
+            rotate_bytes=index_args.archive_rotate_bytes,
+        )
 
     #  Will write each es friendly document on 1 line, this makes re-indexing easier later
-    with open(archive_filename, "a") as f:
-        json.dump(es_friendly_documment, f)
-        f.write(os.linesep)
+    index_args.archive_writer.write(es_friendly_documment)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run a suite of tool invocations from a single snafu process.
+
+A suite is a YAML list of invocations, each one being what a separate ``run_snafu -t <tool>`` process would
+otherwise run::
+
+    - name: fio-seq
+      tool: fio
+      args: -H hosts -j /tmp/fiojob
+    - tool: uperf
+      args: [-w, /tmp/uperf.xml, -s, "3", --resourcetype, pod]
+      env: {uuid: "1234"}
+      independent: true
+      cpus: 0-3
+    - tool: coremark-pro
+      args: [-p, /opt/coremark-pro]
+      independent: true
+      cpus: 4-7
+
+Invocations run one after the other, except for consecutive invocations marked ``independent``, which run
+concurrently as long as they are pinned to disjoint ``cpus``. Each invocation runs in a process of its own,
+as wrappers read their settings from the command line and environment, and sends its documents back to the
+suite. Every document thus goes through the single indexing pipeline and Elasticsearch connection of the
+suite. Invocations are forked by a launcher process, which the suite forks before it starts indexing:
+forking a process running indexing threads could leave the child with locks held by threads it doesn't
+have. The suite keeps track of where its wall-clock time went, see
+:py:meth:`SuiteRunner.summary`.
+"""
+import dataclasses
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import shlex
+import time
+import traceback
+import weakref
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import yaml
+
+from snafu.process import parse_cpu_list
+
+logger = logging.getLogger("snafu")
+
+# number of documents sent at once by invocations to the suite
+_BATCH_DOCS = 1000
+
+# number of batches invocations can send ahead of the indexing of the suite, before they wait for it
+_QUEUE_BATCHES = 8
+
+# seconds between two checks of whether invocations are still alive
+_POLL_SECONDS = 1.0
+
+
+@dataclasses.dataclass
+class Invocation:
+    """
+    Represent one tool invocation of a suite.
+
+    Parameters
+    ----------
+    name : str
+        Name of the invocation in logs and in the timing summary.
+    tool : str
+        Tool to run, as given to ``-t``.
+    args : list of str
+        Arguments of the tool.
+    env : dict
+        Environment variables set for the invocation only.
+    independent : bool
+        Whether the invocation can run concurrently with the neighbouring independent invocations.
+    cpus : str, optional
+        CPU list the invocation is pinned to, like ``0-3,8``.
+    """
+
+    name: str
+    tool: str
+    args: List[str] = dataclasses.field(default_factory=list)
+    env: Dict[str, str] = dataclasses.field(default_factory=dict)
+    independent: bool = False
+    cpus: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, spec: Any, position: int) -> "Invocation":
+        """Create an invocation from its YAML mapping, the position is used to name unnamed invocations."""
+
+        if not isinstance(spec, dict) or not isinstance(spec.get("tool"), str):
+            raise ValueError(f"Suite invocation {position} must be a mapping with a tool name, got {spec}")
+        unknown = set(spec) - {field.name for field in dataclasses.fields(cls)}
+        if unknown:
+            raise ValueError(f"Suite invocation {position} has unknown keys: {', '.join(sorted(unknown))}")
+        args = spec.get("args", [])
+        if isinstance(args, str):
+            args = shlex.split(args)
+        if not isinstance(args, list):
+            raise ValueError(f"Arguments of suite invocation {position} must be a string or a list")
+        invocation = cls(
+            name=str(spec.get("name", f"{spec['tool']}-{position}")),
+            tool=spec["tool"],
+            args=[str(arg) for arg in args],
+            env={str(key): str(value) for key, value in (spec.get("env") or {}).items()},
+            independent=bool(spec.get("independent", False)),
+            cpus=None if spec.get("cpus") is None else str(spec["cpus"]),
+        )
+        # fail on malformed CPU lists before running anything
+        invocation.cpu_set()
+        return invocation
+
+    def cpu_set(self) -> Optional[set]:
+        """Return the set of CPUs the invocation is pinned to, ``None`` if it isn't."""
+        return None if self.cpus is None else set(parse_cpu_list(self.cpus))
+
+
+def load_suite(path: str) -> List[Invocation]:
+    """
+    Load the invocations of the suite in the given YAML file.
+
+    Raises
+    ------
+    ValueError
+        If the file isn't YAML holding a non-empty list of valid invocations with unique names.
+    """
+
+    with open(path) as suite_file:
+        try:
+            specs = yaml.safe_load(suite_file)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Suite file {path} isn't valid YAML: {e}") from e
+    if not isinstance(specs, list) or not specs:
+        raise ValueError(f"Suite file {path} must hold a list of tool invocations")
+    invocations = [Invocation.from_dict(spec, position) for position, spec in enumerate(specs)]
+    names = [invocation.name for invocation in invocations]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Names of suite invocations must be unique, got {', '.join(names)}")
+    return invocations
+
+
+def schedule(invocations: Iterable[Invocation]) -> List[List[Invocation]]:
+    """
+    Group invocations into stages run one after the other, the invocations of a stage running concurrently.
+
+    Consecutive independent invocations share a stage, every other invocation gets a stage of its own.
+
+    Raises
+    ------
+    ValueError
+        If invocations sharing a stage aren't pinned to disjoint CPU sets.
+
+    Examples
+    --------
+    >>> stages = schedule([
+    ...     Invocation("a", "fio"),
+    ...     Invocation("b", "uperf", independent=True, cpus="0-1"),
+    ...     Invocation("c", "uperf", independent=True, cpus="2"),
+    ...     Invocation("d", "sysbench"),
+    ... ])
+    >>> [[invocation.name for invocation in stage] for stage in stages]
+    [['a'], ['b', 'c'], ['d']]
+    """
+
+    stages: List[List[Invocation]] = []
+    for invocation in invocations:
+        if invocation.independent and stages and stages[-1][-1].independent:
+            stages[-1].append(invocation)
+        else:
+            stages.append([invocation])
+    for stage in stages:
+        if len(stage) < 2:
+            continue
+        used: set = set()
+        for invocation in stage:
+            cpus = invocation.cpu_set()
+            if cpus is None:
+                raise ValueError(f"Invocation {invocation.name} needs cpus to run concurrently")
+            if cpus & used:
+                raise ValueError(
+                    f"Invocation {invocation.name} shares CPUs {sorted(cpus & used)} with invocations "
+                    "running concurrently"
+                )
+            used |= cpus
+    return stages
+
+
+def _run_invocation(
+    documents: Callable[[Invocation], Iterable[Dict[str, Any]]], invocation: Invocation, results: Any
+) -> None:
+    # runs in the process forked for the invocation
+    outcome: Dict[str, Any] = {"rc": 0, "error": None}
+    try:
+        os.environ.update(invocation.env)
+        cpus = invocation.cpu_set()
+        if cpus is not None:
+            # inherited by every process the tool starts
+            os.sched_setaffinity(0, cpus)
+        batch = []
+        for document in documents(invocation):
+            batch.append(document)
+            if len(batch) >= _BATCH_DOCS:
+                results.put(("documents", invocation.name, batch))
+                batch = []
+        if batch:
+            results.put(("documents", invocation.name, batch))
+    except SystemExit as e:
+        outcome["rc"] = e.code if isinstance(e.code, int) else 1
+    except Exception as e:  # pylint: disable=W0703
+        traceback.print_exc()
+        outcome["rc"], outcome["error"] = 1, f"{type(e).__name__}: {e}"
+    results.put(("done", invocation.name, outcome))
+
+
+def _launch(
+    documents: Callable[[Invocation], Iterable[Dict[str, Any]]],
+    stages: List[List[Invocation]],
+    commands: Any,
+    suite_end: Any,
+    results: Any,
+) -> None:
+    # runs in the launcher, which has no thread of its own: it forks the invocations of each stage it is
+    # told to run, reports their exit codes, and terminates them if the suite goes away first
+    suite_end.close()
+    context = multiprocessing.get_context("fork")
+    processes: Dict[int, Tuple[str, Any]] = {}
+    try:
+        while True:
+            try:
+                stage_num = commands.recv()
+            except EOFError:
+                return
+            for invocation in stages[stage_num]:
+                process = context.Process(
+                    target=_run_invocation,
+                    args=(documents, invocation, results),
+                    name=f"snafu-suite-{invocation.name}",
+                )
+                process.start()
+                processes[process.sentinel] = (invocation.name, process)
+            while processes:
+                ready = multiprocessing.connection.wait([commands] + list(processes))
+                if commands in ready:
+                    # the suite stopped before the stage was done
+                    return
+                for sentinel in ready:
+                    name, process = processes.pop(sentinel)
+                    process.join()
+                    commands.send((name, process.exitcode))
+    finally:
+        for _, process in processes.values():
+            process.terminate()
+            process.join()
+
+
+class SuiteRunner:
+    """
+    Run the stages of a suite, yielding the documents of every invocation.
+
+    Parameters
+    ----------
+    stages : list of list of Invocation
+        Stages of the suite, as given by :py:func:`schedule`.
+    documents : callable
+        Function called in the process of an invocation with the invocation, returning the finalized
+        documents of the invocation.
+    """
+
+    def __init__(
+        self,
+        stages: List[List[Invocation]],
+        documents: Callable[[Invocation], Iterable[Dict[str, Any]]],
+    ):
+        self.stages = stages
+        self.documents = documents
+        self.invocations: Dict[str, Dict[str, Any]] = {}
+        self.stage_timings: List[Dict[str, Any]] = []
+        self.waiting_seconds = 0.0
+        self.consumer_seconds = 0.0
+        self.started: Optional[float] = None
+        self.ended: Optional[float] = None
+        self._launcher: Any = None
+        self._commands: Any = None
+        self._results: Any = None
+
+    def start(self) -> "SuiteRunner":
+        """
+        Fork the launcher of the invocations, if it isn't running yet.
+
+        :py:meth:`run` starts it when needed, call it beforehand when the process is about to start threads.
+        """
+
+        if self._launcher is None:
+            context = multiprocessing.get_context("fork")
+            # invocations wait for the suite once it is this many batches behind
+            self._results = context.Queue(maxsize=_QUEUE_BATCHES)
+            self._commands, commands = context.Pipe()
+            self._launcher = context.Process(
+                target=_launch,
+                args=(self.documents, self.stages, commands, self._commands, self._results),
+                name="snafu-suite-launcher",
+            )
+            self._launcher.start()
+            commands.close()
+            # the launcher stops with its pipe, even if the documents of the suite are never read
+            weakref.finalize(self, self._commands.close)
+        return self
+
+    def close(self) -> None:
+        """Stop the launcher, terminating the invocations still running."""
+
+        if self._launcher is not None:
+            self._commands.close()
+            self._launcher.join()
+            self._results.close()
+            self._launcher = None
+
+    def run(self) -> Iterator[Dict[str, Any]]:
+        """Run every stage in order, yielding the documents of its invocations as they are received."""
+
+        self.started = time.monotonic()
+        self.start()
+        try:
+            for stage_num, stage in enumerate(self.stages):
+                beg = time.monotonic()
+                logger.info(f"Starting suite stage {stage_num}: {', '.join(inv.name for inv in stage)}")
+                for invocation in stage:
+                    self.invocations[invocation.name] = {
+                        "tool": invocation.tool,
+                        "stage": stage_num,
+                        "cpus": invocation.cpus,
+                        "documents": 0,
+                        "rc": None,
+                        "error": None,
+                        "start": time.monotonic(),
+                    }
+                self._commands.send(stage_num)
+                yield from self._receive({invocation.name for invocation in stage})
+                self.stage_timings.append(
+                    {
+                        "stage": stage_num,
+                        "invocations": [invocation.name for invocation in stage],
+                        "wall_seconds": time.monotonic() - beg,
+                    }
+                )
+            self.ended = time.monotonic()
+        finally:
+            self.close()
+
+    def _exited(self, running: Set[str], block: bool = False) -> Set[str]:
+        # exit codes sent by the launcher, invocations exiting without their outcome were killed
+        exited = set()
+        while block or self._commands.poll():
+            try:
+                name, exitcode = self._commands.recv()
+            except EOFError:
+                raise RuntimeError("The suite launcher died") from None
+            exited.add(name)
+            block = False
+            if name in running:
+                self._finish(name, {"rc": exitcode or 1, "error": "process died"})
+                running.discard(name)
+        return exited
+
+    def _receive(self, names: Set[str]) -> Iterator[Dict[str, Any]]:
+        running, exited = set(names), set()
+        while running:
+            beg = time.monotonic()
+            try:
+                kind, name, payload = self._results.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                self.waiting_seconds += time.monotonic() - beg
+                exited |= self._exited(running)
+                if not self._launcher.is_alive():
+                    raise RuntimeError("The suite launcher died")
+                continue
+            self.waiting_seconds += time.monotonic() - beg
+            if kind == "done":
+                self._finish(name, payload)
+                running.discard(name)
+                continue
+            timing = self.invocations[name]
+            timing.setdefault("first_document_seconds", time.monotonic() - timing["start"])
+            timing["documents"] += len(payload)
+            for document in payload:
+                beg = time.monotonic()
+                yield document
+                self.consumer_seconds += time.monotonic() - beg
+        # the next stage starts once the processes of this one are gone
+        while exited != names:
+            exited |= self._exited(running, block=True)
+
+    def _finish(self, name: str, outcome: Dict[str, Any]) -> None:
+        timing = self.invocations[name]
+        timing.update(outcome)
+        timing["wall_seconds"] = time.monotonic() - timing["start"]
+        log = logger.info if timing["rc"] == 0 else logger.error
+        log(f"Suite invocation {name} finished with rc {timing['rc']} after {timing['wall_seconds']:.1f}s")
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Return where the wall-clock time of the suite went.
+
+        Besides the timings of every stage and invocation, the summary holds the time the suite spent
+        waiting on invocations for documents (``waiting_seconds``) and waiting for the indexing pipeline to
+        take them (``indexing_seconds``), and the time saved by running invocations concurrently
+        (``concurrency_saved_seconds``, the sum of the invocation times minus the sum of the stage times).
+        """
+
+        invocations = []
+        for name, timing in self.invocations.items():
+            timing = {key: value for key, value in timing.items() if key != "start"}
+            invocations.append(dict(timing, name=name))
+        invocation_seconds = sum(timing.get("wall_seconds", 0.0) for timing in invocations)
+        stage_seconds = sum(stage["wall_seconds"] for stage in self.stage_timings)
+        end = self.ended or time.monotonic()
+        return {
+            "wall_seconds": end - self.started if self.started is not None else 0.0,
+            "invocation_seconds": invocation_seconds,
+            "concurrency_saved_seconds": invocation_seconds - stage_seconds,
+            "waiting_seconds": self.waiting_seconds,
+            "indexing_seconds": self.consumer_seconds,
+            "failed": sorted(timing["name"] for timing in invocations if timing.get("rc") != 0),
+            "stages": self.stage_timings,
+            "invocations": invocations,
+        }
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sample host utilisation from ``/proc`` while a benchmark runs.
+
+Hosts without Prometheus still get utilisation data next to their benchmark results: a background thread
+reads the CPU, memory, network, disk and pressure stall counters of the kernel at a fixed interval into
+array-backed buffers. Once the benchmark is done, the counters are turned into utilisation time series
+and summaries for each sample of the benchmark, along with the overhead of the sampler itself.
+"""
+import array
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("snafu")
+
+# diskstats counts sectors of 512 bytes, whatever the sector size of the device
+_SECTOR_BYTES = 512
+
+_PRESSURE_RESOURCES = ("cpu", "memory", "io")
+
+#: Utilisation metrics computed from the sampled counters, in the order they are reported
+METRICS = (
+    "cpu_util_percent",
+    "mem_used_percent",
+    "net_rx_bytes_per_sec",
+    "net_tx_bytes_per_sec",
+    "disk_read_bytes_per_sec",
+    "disk_write_bytes_per_sec",
+    *(f"pressure_{resource}_percent" for resource in _PRESSURE_RESOURCES),
+)
+
+
+class ProcReader:
+    """
+    Read the utilisation counters of the host.
+
+    Counters whose source file is missing, like pressure stall information on older kernels, are left out.
+
+    Parameters
+    ----------
+    proc : str, optional
+        Mount point of procfs.
+    sys_block : str, optional
+        Directory listing the block devices, used to leave partitions, loop and ram devices out of the disk
+        counters. Every device of ``diskstats`` is counted when it doesn't exist.
+    """
+
+    def __init__(self, proc: str = "/proc", sys_block: str = "/sys/block"):
+        self.proc = proc
+        self.devices: Optional[set] = None
+        if os.path.isdir(sys_block):
+            self.devices = {
+                device for device in os.listdir(sys_block) if not device.startswith(("loop", "ram"))
+            }
+
+    def _lines(self, *path: str) -> List[str]:
+        try:
+            with open(os.path.join(self.proc, *path)) as proc_file:
+                return proc_file.readlines()
+        except OSError:
+            return []
+
+    def read(self) -> Dict[str, float]:
+        """Return the current value of every available counter."""
+
+        counters: Dict[str, float] = {}
+        for line in self._lines("stat")[:1]:
+            # user nice system idle iowait irq softirq steal, guest time is already counted in user time
+            jiffies = [float(value) for value in line.split()[1:9]]
+            counters["cpu_total"] = sum(jiffies)
+            counters["cpu_idle"] = jiffies[3] + jiffies[4]
+
+        meminfo = dict(line.split(":", 1) for line in self._lines("meminfo") if ":" in line)
+        if "MemTotal" in meminfo and "MemAvailable" in meminfo:
+            counters["mem_total_kb"] = float(meminfo["MemTotal"].split()[0])
+            counters["mem_available_kb"] = float(meminfo["MemAvailable"].split()[0])
+
+        net_lines = self._lines("net", "dev")[2:]
+        if net_lines:
+            counters["net_rx_bytes"] = counters["net_tx_bytes"] = 0.0
+            for line in net_lines:
+                interface, stats = line.split(":", 1)
+                if interface.strip() == "lo":
+                    continue
+                fields = stats.split()
+                counters["net_rx_bytes"] += float(fields[0])
+                counters["net_tx_bytes"] += float(fields[8])
+
+        disk_lines = self._lines("diskstats")
+        if disk_lines:
+            counters["disk_read_sectors"] = counters["disk_write_sectors"] = 0.0
+            for line in disk_lines:
+                fields = line.split()
+                if self.devices is not None and fields[2] not in self.devices:
+                    continue
+                counters["disk_read_sectors"] += float(fields[5])
+                counters["disk_write_sectors"] += float(fields[9])
+
+        for resource in _PRESSURE_RESOURCES:
+            for line in self._lines("pressure", resource)[:1]:
+                # some avg10=0.00 avg60=0.00 avg300=0.00 total=<stalled microseconds>
+                counters[f"pressure_{resource}_us"] = float(line.split("total=")[1])
+        return counters
+
+
+_COUNTERS = (
+    "cpu_total",
+    "cpu_idle",
+    "mem_total_kb",
+    "mem_available_kb",
+    "net_rx_bytes",
+    "net_tx_bytes",
+    "disk_read_sectors",
+    "disk_write_sectors",
+    *(f"pressure_{resource}_us" for resource in _PRESSURE_RESOURCES),
+)
+
+
+class TelemetrySampler:
+    """
+    Sample the utilisation counters of the host on a background thread.
+
+    Each tick appends the counters to one :py:class:`array.array` per counter, missing counters being
+    stored as NaN. Ticks are attributed to the sample last set with :py:meth:`mark_sample`.
+
+    Parameters
+    ----------
+    interval : float
+        Time in seconds between two ticks.
+    reader : ProcReader, optional
+        Reader of the counters, defaults to one reading the ``/proc`` of the host.
+
+    Examples
+    --------
+    >>> sampler = TelemetrySampler(0.01).start()
+    >>> sampler.mark_sample(0)
+    >>> time.sleep(0.1)
+    >>> sampler.stop()
+    >>> [(tag, document["sample"]) for tag, document in sampler.documents()][-2:]
+    [('telemetry', 0), ('telemetry-summary', 0)]
+    """
+
+    def __init__(self, interval: float, reader: Optional[ProcReader] = None):
+        self.interval = interval
+        self.reader = reader or ProcReader()
+        self.overhead_seconds = 0.0
+        self._buffers: Dict[str, array.array] = {name: array.array("d") for name in ("time", "sample")}
+        self._buffers.update((name, array.array("d")) for name in _COUNTERS)
+        self._sample = float("nan")
+        self._started: Optional[float] = None
+        self._stopped: Optional[float] = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="snafu-telemetry", daemon=True)
+
+    def start(self) -> "TelemetrySampler":
+        """Take a first tick, then start ticking in the background."""
+
+        self._started = time.monotonic()
+        self.tick()
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def tick(self) -> None:
+        """Read and store the counters."""
+
+        # ticks are taken by the background thread and when marking samples
+        with self._lock:
+            beg = time.perf_counter()
+            counters = self.reader.read()
+            self._buffers["time"].append(time.time())
+            self._buffers["sample"].append(self._sample)
+            for name in _COUNTERS:
+                self._buffers[name].append(counters.get(name, float("nan")))
+            self.overhead_seconds += time.perf_counter() - beg
+
+    def mark_sample(self, sample: Optional[int]) -> None:
+        """Attribute the following ticks to the given sample, ``None`` for ticks outside of samples."""
+
+        # take a tick so the sample starts with its own counters
+        with self._lock:
+            self.tick()
+            self._sample = float("nan") if sample is None else float(sample)
+
+    def stop(self) -> None:
+        """Stop the background thread, then take a last tick."""
+
+        self._stop.set()
+        self._thread.join()
+        self.tick()
+        self._stopped = time.monotonic()
+
+    def metrics(self) -> Dict[str, np.ndarray]:
+        """
+        Return the utilisation metrics between every two ticks.
+
+        Besides the :py:data:`METRICS`, the result holds the ``time`` and ``sample`` of the later tick of each
+        pair.
+        """
+
+        data = {name: np.frombuffer(buffer, dtype=float) for name, buffer in self._buffers.items()}
+        delta = {name: np.diff(values) for name, values in data.items()}
+        seconds = delta["time"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            metrics = {
+                "time": data["time"][1:],
+                "sample": data["sample"][1:],
+                "cpu_util_percent": 100 * (1 - delta["cpu_idle"] / delta["cpu_total"]),
+                "mem_used_percent": 100 * (1 - data["mem_available_kb"][1:] / data["mem_total_kb"][1:]),
+                "net_rx_bytes_per_sec": delta["net_rx_bytes"] / seconds,
+                "net_tx_bytes_per_sec": delta["net_tx_bytes"] / seconds,
+                "disk_read_bytes_per_sec": delta["disk_read_sectors"] * _SECTOR_BYTES / seconds,
+                "disk_write_bytes_per_sec": delta["disk_write_sectors"] * _SECTOR_BYTES / seconds,
+            }
+            for resource in _PRESSURE_RESOURCES:
+                stalled = delta[f"pressure_{resource}_us"] / 1e6
+                metrics[f"pressure_{resource}_percent"] = 100 * stalled / seconds
+        return metrics
+
+    def overhead(self) -> Dict[str, float]:
+        """Return the time spent reading counters, in total and relative to the sampled time."""
+
+        ticks = len(self._buffers["time"])
+        elapsed = (self._stopped or time.monotonic()) - (self._started or time.monotonic())
+        return {
+            "sampler_ticks": ticks,
+            "sampler_overhead_seconds": self.overhead_seconds,
+            "sampler_overhead_percent": 100 * self.overhead_seconds / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def documents(self) -> Iterator[Tuple[str, Dict]]:
+        """
+        Yield the ``telemetry`` time series and ``telemetry-summary`` documents of every sample.
+
+        Time series documents hold one array per metric, summaries the mean and max of each metric along
+        with the overhead of the sampler over the whole run. Ticks outside of samples are reported with a
+        ``sample`` of ``None``.
+        """
+
+        metrics = self.metrics()
+        overhead = self.overhead()
+        samples = metrics["sample"]
+        outside = np.isnan(samples)
+        groups = [(None, outside)] if outside.any() else []
+        groups += [(int(sample), samples == sample) for sample in np.unique(samples[~outside])]
+        for sample, selected in groups:
+            times = metrics["time"][selected]
+            if not len(times):
+                continue
+            context = {
+                "sample": sample,
+                "interval": self.interval,
+                "count": len(times),
+                "start": _format_time(times[0]),
+                "end": _format_time(times[-1]),
+            }
+            series = dict(context, timestamp=[_format_time(value) for value in times])
+            summary = dict(context, **overhead)
+            for name in METRICS:
+                values = metrics[name][selected]
+                series[name] = [float(value) if np.isfinite(value) else None for value in values]
+                finite = values[np.isfinite(values)]
+                summary[f"{name}_mean"] = float(finite.mean()) if len(finite) else None
+                summary[f"{name}_max"] = float(finite.max()) if len(finite) else None
+            yield "telemetry", series
+            yield "telemetry-summary", summary
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
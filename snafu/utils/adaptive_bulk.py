@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel bulk indexer which adapts its chunk size and concurrency to the Elasticsearch cluster.
+
+Bulk round-trip latency and rejections (``429``/``503``) are fed into an additive-increase /
+multiplicative-decrease (AIMD) controller: while the cluster keeps up, chunks grow by a fixed number of
+bytes and, once chunks are large enough, another concurrent request is allowed. As soon as the cluster
+rejects requests or latency exceeds the target, both settings are cut by a constant factor.
+"""
+import collections
+import logging
+import statistics
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from elasticsearch import TransportError, helpers
+
+logger = logging.getLogger("snafu")
+
+_REJECTED_STATUSES = (429, 503)
+_MiB = 1024 * 1024
+
+
+class AdaptiveBulkController:
+    """
+    AIMD controller for bulk chunk size and request concurrency.
+
+    Parameters
+    ----------
+    chunk_bytes : int, optional
+        Initial size in bytes of a bulk request.
+    workers : int, optional
+        Initial number of concurrent bulk requests.
+    min_chunk_bytes : int, optional
+        Lower bound of ``chunk_bytes``.
+    max_chunk_bytes : int, optional
+        Upper bound of ``chunk_bytes``.
+    max_workers : int, optional
+        Upper bound of ``workers``. The lower bound is always one.
+    target_latency : float, optional
+        Bulk round-trip time in seconds above which the cluster is considered saturated.
+    increase_bytes : int, optional
+        Number of bytes added to ``chunk_bytes`` after each healthy request.
+    decrease_factor : float, optional
+        Factor applied to both settings when the cluster is saturated.
+
+    Examples
+    --------
+    >>> controller = AdaptiveBulkController(chunk_bytes=4, workers=2, min_chunk_bytes=1, max_chunk_bytes=8,
+    ...                                     increase_bytes=2, target_latency=1.0)
+    >>> controller.record(latency=0.1, rejected=0)
+    >>> controller.chunk_bytes, controller.workers
+    (6, 2)
+    >>> controller.record(latency=0.1, rejected=0); controller.record(latency=0.1, rejected=0)
+    >>> controller.chunk_bytes, controller.workers
+    (8, 3)
+    >>> controller.record(latency=0.1, rejected=5)
+    >>> controller.chunk_bytes, controller.workers
+    (4, 1)
+    """
+
+    def __init__(
+        self,
+        chunk_bytes: int = 5 * _MiB,
+        workers: int = 2,
+        min_chunk_bytes: int = _MiB,
+        max_chunk_bytes: int = 100 * _MiB,
+        max_workers: int = 16,
+        target_latency: float = 5.0,
+        increase_bytes: int = _MiB,
+        decrease_factor: float = 0.5,
+    ):
+        self.min_chunk_bytes = min(min_chunk_bytes, max_chunk_bytes)
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_workers = max(1, max_workers)
+        self.chunk_bytes = self._clamp_bytes(chunk_bytes)
+        self.workers = self._clamp_workers(workers)
+        self.target_latency = target_latency
+        self.increase_bytes = increase_bytes
+        self.decrease_factor = decrease_factor
+        self.requests = 0
+        self.rejections = 0
+        self.decreases = 0
+        self.history: Deque[Tuple[int, int]] = collections.deque(maxlen=20)
+
+    def _clamp_bytes(self, value: float) -> int:
+        return int(min(self.max_chunk_bytes, max(self.min_chunk_bytes, value)))
+
+    def _clamp_workers(self, value: float) -> int:
+        return int(min(self.max_workers, max(1, value)))
+
+    def record(self, latency: float, rejected: int) -> None:
+        """Adjust the settings given the latency and number of rejected documents of one bulk request."""
+
+        self.requests += 1
+        self.rejections += rejected
+        if rejected or latency > self.target_latency:
+            # multiplicative decrease
+            self.decreases += 1
+            self.chunk_bytes = self._clamp_bytes(self.chunk_bytes * self.decrease_factor)
+            self.workers = self._clamp_workers(self.workers * self.decrease_factor)
+        elif self.chunk_bytes < self.max_chunk_bytes and latency < self.target_latency / 2:
+            # additive increase, grow requests first while they are cheap ...
+            self.chunk_bytes = self._clamp_bytes(self.chunk_bytes + self.increase_bytes)
+        else:
+            # ... then add concurrency
+            self.workers = self._clamp_workers(self.workers + 1)
+        self.history.append((self.chunk_bytes, self.workers))
+        logger.debug(
+            f"Bulk request took {latency:.3f}s with {rejected} rejections, now using "
+            f"chunk_bytes={self.chunk_bytes} workers={self.workers}"
+        )
+
+    def converged(self) -> Dict[str, int]:
+        """Return the median settings over the most recent requests, which are good values to pin."""
+
+        if not self.history:
+            return {"chunk_bytes": self.chunk_bytes, "workers": self.workers}
+        return {
+            "chunk_bytes": int(statistics.median(c for c, _ in self.history)),
+            "workers": int(statistics.median(w for _, w in self.history)),
+        }
+
+    def log_summary(self) -> None:
+        """Log the settings the controller converged on."""
+
+        settings = self.converged()
+        logger.info(
+            f"Adaptive bulk indexer converged on chunk_bytes={settings['chunk_bytes']} "
+            f"workers={settings['workers']} after {self.requests} requests "
+            f"({self.rejections} rejected documents, {self.decreases} backoffs)"
+        )
+
+
+def _send_chunk(es, body: str, bulk_data: List[Tuple[str, Dict[str, Any]]], request_timeout: float):
+    """Send one bulk request, returning the per-action results and the round-trip latency."""
+
+    start = time.monotonic()
+    results = []
+    try:
+        resp = es.bulk(body, request_timeout=request_timeout)
+    except TransportError as err:
+        # mark all actions in the chunk as failed, same as elasticsearch.helpers does
+        for op_type, action in bulk_data:
+            info = {"error": str(err), "status": err.status_code, "exception": err}
+            info.update(action)
+            results.append((False, {op_type: info}))
+    else:
+        for item in resp["items"]:
+            op_type, info = item.popitem()
+            status = info.get("status", 500)
+            results.append((200 <= status < 300, {op_type: info}))
+    return results, time.monotonic() - start
+
+
+def _chunks(actions: Iterable[Dict[str, Any]], serializer, controller: AdaptiveBulkController) -> Iterator:
+    body: List[str] = []
+    bulk_data: List[Tuple[str, Dict[str, Any]]] = []
+    size = 0
+    for action in actions:
+        action_line, data = helpers.expand_action(action)
+        lines = [serializer.dumps(action_line)]
+        if data is not None:
+            lines.append(serializer.dumps(data))
+        cur_size = sum(len(line.encode("utf-8")) + 1 for line in lines)
+        if bulk_data and size + cur_size > controller.chunk_bytes:
+            yield "\n".join(body) + "\n", bulk_data
+            body, bulk_data, size = [], [], 0
+        body.extend(lines)
+        bulk_data.append(next(iter(action_line.items())))
+        size += cur_size
+    if bulk_data:
+        yield "\n".join(body) + "\n", bulk_data
+
+
+def adaptive_parallel_bulk(
+    es,
+    actions: Iterable[Dict[str, Any]],
+    controller: AdaptiveBulkController,
+    request_timeout: Optional[float] = None,
+) -> Iterator[Tuple[bool, Dict[str, Any]]]:
+    """
+    Index the given actions with concurrent bulk requests sized by the given controller.
+
+    Yields ``(ok, {op_type: item})`` tuples in the same order as the given actions, exactly like
+    :py:func:`elasticsearch.helpers.parallel_bulk` with ``raise_on_error=False`` and
+    ``raise_on_exception=False``.
+    """
+
+    serializer = es.transport.serializer
+    pending: Deque[Future] = collections.deque()
+
+    def harvest():
+        results, latency = pending.popleft().result()
+        rejected = sum(1 for _, info in results if next(iter(info.values()))["status"] in _REJECTED_STATUSES)
+        controller.record(latency, rejected)
+        return results
+
+    with ThreadPoolExecutor(max_workers=controller.max_workers) as pool:
+        for body, bulk_data in _chunks(actions, serializer, controller):
+            while len(pending) >= controller.workers:
+                yield from harvest()
+            pending.append(pool.submit(_send_chunk, es, body, bulk_data, request_timeout))
+        while pending:
+            yield from harvest()
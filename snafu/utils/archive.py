@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Write and read archive files of Elasticsearch friendly documents.
+
+Archives contain one document per line. They can optionally be compressed with gzip or zstd (the latter
+requires the ``zstandard`` package) and rotated once a part grows past a given size. Every part ends with
+a footer line recording how many documents of each index it holds; footers are skipped when reading.
+
+Parts are named after the archive file: ``run.archive``, ``run.archive.1``, ``run.archive.2``, ... with
+``.gz`` or ``.zst`` appended when compressed.
+"""
+import collections
+import gzip
+import io
+import json
+import logging
+import os
+import time
+from typing import Counter, Dict, Iterator, List, Optional
+
+from snafu.utils.documents import archive_line
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger("snafu")
+
+FOOTER_KEY = "_snafu_archive_footer"
+COMPRESSION_SUFFIXES: Dict[Optional[str], str] = {None: "", "gzip": ".gz", "zstd": ".zst"}
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _split_suffix(path: str) -> str:
+    """Return the given archive path without its compression suffix."""
+
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if suffix and path.endswith(suffix):
+            return path[: -len(suffix)]
+    return path
+
+
+def part_path(path: str, part: int, compression: Optional[str] = None) -> str:
+    """
+    Return the path of the given part of an archive.
+
+    Examples
+    --------
+    >>> part_path("run.archive", 0)
+    'run.archive'
+    >>> part_path("run.archive.gz", 2, "gzip")
+    'run.archive.2.gz'
+    """
+
+    stem = _split_suffix(path)
+    if part > 0:
+        stem = f"{stem}.{part}"
+    return stem + COMPRESSION_SUFFIXES[compression]
+
+
+def archive_parts(path: str) -> List[str]:
+    """Return the existing parts of the given archive in order, with or without compression suffixes."""
+
+    stem = _split_suffix(path)
+    parts = []
+    part = 0
+    while True:
+        candidates = [part_path(stem, part, compression) for compression in COMPRESSION_SUFFIXES]
+        if part == 0:
+            candidates.insert(0, path)
+        existing = [candidate for candidate in candidates if os.path.isfile(candidate)]
+        if not existing:
+            return parts
+        parts.append(existing[0])
+        part += 1
+
+
+def is_compressed(path: str) -> bool:
+    """Return ``True`` if the given archive part is gzip or zstd compressed."""
+
+    with open(path, "rb") as part:
+        magic = part.read(4)
+    return magic.startswith(_GZIP_MAGIC) or magic.startswith(_ZSTD_MAGIC)
+
+
+def is_footer(line: str) -> bool:
+    """Return ``True`` if the given archive line is a part footer rather than a document."""
+
+    return line.startswith('{"' + FOOTER_KEY)
+
+
+def open_archive_part(path: str) -> io.BufferedIOBase:
+    """Open the given archive part for reading in binary mode, decompressing it as needed."""
+
+    raw = open(path, "rb")  # pylint: disable=R1732
+    magic = raw.peek(4)[:4]
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=raw)
+    if magic.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError(f"Archive {path} is zstd compressed, please install the zstandard package")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True))
+    return raw
+
+
+def read_archive_lines(path: str) -> Iterator[str]:
+    """
+    Yield every document line of the given archive and its rotated parts, skipping footers.
+
+    Compression is detected from the content of each part, so plain and compressed parts can be mixed.
+    """
+
+    parts = archive_parts(path)
+    if not parts:
+        raise FileNotFoundError(path)
+    for part in parts:
+        with open_archive_part(part) as archive:
+            for raw_line in archive:
+                line = raw_line.decode("utf-8")
+                if not line.strip() or is_footer(line):
+                    continue
+                yield line
+
+
+class ArchiveWriter:
+    """
+    Persistent, buffered writer of archive files.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive. A compression suffix is added if missing.
+    compression : str, optional
+        ``"gzip"`` or ``"zstd"``, defaults to no compression.
+    rotate_bytes : int, optional
+        Start a new part once the current one holds this many uncompressed bytes. Defaults to never
+        rotating.
+    buffer_bytes : int, optional
+        Number of bytes buffered in memory before writing them out.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression: Optional[str] = None,
+        rotate_bytes: Optional[int] = None,
+        buffer_bytes: int = 1024 * 1024,
+    ):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown archive compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd archive compression requires the zstandard package")
+        self.path = path
+        self.compression = compression
+        self.rotate_bytes = rotate_bytes
+        self.buffer_bytes = buffer_bytes
+        self.documents = 0
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._raw = None
+        self._stream = None
+        self._part_bytes = 0
+        self._part_counts: Counter[str] = collections.Counter()
+
+        # keep appending to the last existing part, as plain archives always did
+        self.part = 0
+        while os.path.exists(part_path(path, self.part + 1, compression)):
+            self.part += 1
+        self._open_part()
+
+    @property
+    def current_path(self) -> str:
+        """Path of the part currently being written."""
+        return part_path(self.path, self.part, self.compression)
+
+    def _open_part(self) -> None:
+        path = self.current_path
+        logger.info(f"Writing archive part {path}")
+        self._raw = open(path, "ab")  # pylint: disable=R1732
+        self._part_bytes = self._raw.tell()
+        if self.compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        elif self.compression == "zstd":
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._stream = self._raw
+        self._part_counts = collections.Counter()
+
+    def _flush_buffer(self) -> None:
+        if self._buffer:
+            self._stream.write(b"".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def _close_part(self) -> None:
+        footer = {
+            FOOTER_KEY: {
+                "part": self.part,
+                "documents": sum(self._part_counts.values()),
+                "indices": dict(self._part_counts),
+                "closed": time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime()),
+            }
+        }
+        self._buffer.append(json.dumps(footer).encode() + b"\n")
+        self._flush_buffer()
+        if self.compression == "gzip":
+            self._stream.close()
+        elif self.compression == "zstd":
+            self._stream.flush(zstandard.FLUSH_FRAME)
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._raw = self._stream = None
+
+    def write(self, document: Dict) -> None:
+        """Append the given Elasticsearch friendly document to the archive."""
+
+        line = archive_line(document).encode("utf-8") + b"\n"
+        if self.rotate_bytes and self._part_bytes > 0 and self._part_bytes + len(line) > self.rotate_bytes:
+            self._close_part()
+            self.part += 1
+            self._open_part()
+        self._buffer.append(line)
+        self._buffered += len(line)
+        self._part_bytes += len(line)
+        self._part_counts[document["_index"]] += 1
+        self.documents += 1
+        if self._buffered >= self.buffer_bytes:
+            self._flush_buffer()
+
+    def close(self) -> None:
+        """Write the footer of the current part and sync it to disk."""
+
+        if self._raw is not None:
+            self._close_part()
+            logger.info(f"Archived {self.documents} documents into {self.part + 1} part(s) of {self.path}")
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Index archive files from multiple worker processes, resuming interrupted replays from a checkpoint.
+
+Plain archive parts are split into byte ranges on line boundaries (shards) which are indexed concurrently,
+each worker process using its own Elasticsearch client. Compressed parts can't be seeked into, so each of
+them is a single shard. Workers index their shard in batches and report the offset up to which documents
+were acknowledged after each batch; those offsets are saved to a checkpoint file so that a later replay of
+the same archive skips everything that was already indexed. Given the set of ids acknowledged by
+Elasticsearch, workers read it from disk to skip known documents, and the ids they get acknowledged are
+added to it once they are done, the set being written by a single process.
+"""
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import queue
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from snafu.utils.archive import archive_parts, is_compressed, is_footer, open_archive_part
+from snafu.utils.dedup_filter import AcknowledgedIds
+from snafu.utils.es_client import create_es_client
+from snafu.utils.indexing_pipeline import BulkStats, combine_bulk_stats
+from snafu.utils.py_es_bulk import streaming_bulk
+
+logger = logging.getLogger("snafu")
+
+
+@dataclasses.dataclass
+class Shard:
+    """
+    Range of an archive part indexed by a single worker.
+
+    Offsets are positions in the uncompressed content of the part, ``end`` is ``None`` when the shard goes
+    up to the end of the part.
+    """
+
+    part: str
+    start: int
+    end: Optional[int] = None
+
+    @property
+    def key(self) -> str:
+        """Identifier of the shard within the checkpoint file."""
+        return f"{self.part}:{self.start}"
+
+
+def plan_shards(path: str, shards_per_part: int) -> List[Shard]:
+    """Split every part of the given archive into shards starting at the beginning of a line."""
+
+    shards: List[Shard] = []
+    for part in archive_parts(path):
+        if is_compressed(part) or shards_per_part <= 1:
+            shards.append(Shard(part, 0))
+            continue
+        size = os.path.getsize(part)
+        starts = {0}
+        with open(part, "rb") as part_file:
+            for num in range(1, shards_per_part):
+                part_file.seek(size * num // shards_per_part)
+                part_file.readline()  # move to the beginning of the next line
+                if part_file.tell() < size:
+                    starts.add(part_file.tell())
+        bounds = sorted(starts) + [size]
+        shards.extend(Shard(part, start, end) for start, end in zip(bounds, bounds[1:]))
+    return shards
+
+
+def _read_shard(shard: Shard, offset: int) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """Yield ``(offset after line, document)`` for every line of the shard past the given offset."""
+
+    with open_archive_part(shard.part) as archive:
+        if is_compressed(shard.part):
+            position = 0
+            while position < offset:
+                line = archive.readline()
+                if not line:
+                    return
+                position += len(line)
+        else:
+            archive.seek(offset)
+            position = offset
+        while shard.end is None or position < shard.end:
+            line = archive.readline()
+            if not line:
+                return
+            position += len(line)
+            text = line.decode("utf-8")
+            if not text.strip() or is_footer(text):
+                yield position, None
+            else:
+                yield position, json.loads(text)
+
+
+class _ShardIds:
+    """Acknowledged ids as seen by a worker: looked up in the set read from disk, new ones kept aside."""
+
+    def __init__(self, seen_ids: AcknowledgedIds):
+        self.seen_ids = seen_ids
+        self.acknowledged: List[str] = []
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.seen_ids
+
+    def add(self, doc_id: str) -> None:
+        """Keep the id, to be sent to the replay along with the progress of the batch."""
+        self.acknowledged.append(doc_id)
+
+
+def _replay_shard(
+    shard: Shard,
+    offset: int,
+    es_factory: Callable,
+    es_args: Tuple,
+    bulk: Callable[..., BulkStats],
+    bulk_kwargs: Dict[str, Any],
+    batch_docs: int,
+    progress: "queue.Queue",
+    seen_ids_args: Optional[Tuple[str, int, float]] = None,
+) -> None:
+    """Index one shard in batches, reporting acknowledged offsets after each batch. Runs in a worker."""
+
+    es = es_factory(*es_args)
+    shard_ids = None
+    if seen_ids_args is not None:
+        directory, capacity, error_rate = seen_ids_args
+        shard_ids = _ShardIds(AcknowledgedIds(directory, capacity, error_rate, read_only=True))
+        bulk_kwargs = dict(bulk_kwargs, seen_ids=shard_ids)
+    batch: List[Dict[str, Any]] = []
+    batch_bytes = 0
+    position = offset
+
+    def flush():
+        stats = bulk(es, batch, **bulk_kwargs)
+        acknowledged = []
+        if shard_ids is not None:
+            acknowledged, shard_ids.acknowledged = shard_ids.acknowledged, []
+        progress.put((shard.key, position, False, stats, batch_bytes, acknowledged))
+
+    try:
+        for line_end, document in _read_shard(shard, offset):
+            if document is not None:
+                batch.append(document)
+                batch_bytes += line_end - position
+            position = line_end
+            if len(batch) >= batch_docs:
+                flush()
+                batch, batch_bytes = [], 0
+        flush()
+    finally:
+        if shard_ids is not None:
+            shard_ids.seen_ids.close()
+    progress.put((shard.key, position, True, None, 0, []))
+
+
+def _load_checkpoint(checkpoint: str, path: str) -> Dict[str, Dict[str, Any]]:
+    if not os.path.isfile(checkpoint):
+        return {}
+    with open(checkpoint) as checkpoint_file:
+        content = json.load(checkpoint_file)
+    if content.get("archive") != os.path.abspath(path):
+        raise ValueError(f"Checkpoint {checkpoint} belongs to archive {content.get('archive')}, not {path}")
+    return content["shards"]
+
+
+def _save_checkpoint(checkpoint: str, path: str, shards: Dict[str, Dict[str, Any]]) -> None:
+    tmp_checkpoint = checkpoint + ".tmp"
+    with open(tmp_checkpoint, "w") as checkpoint_file:
+        json.dump({"archive": os.path.abspath(path), "shards": shards}, checkpoint_file, indent=2)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(tmp_checkpoint, checkpoint)
+
+
+def replay_archive(
+    path: str,
+    checkpoint: str,
+    workers: int,
+    es_args: Tuple,
+    bulk_kwargs: Optional[Dict[str, Any]] = None,
+    batch_docs: int = 5000,
+    es_factory: Callable = create_es_client,
+    bulk: Callable[..., BulkStats] = streaming_bulk,
+    seen_ids: Optional[AcknowledgedIds] = None,
+) -> Tuple[BulkStats, int]:
+    """
+    Index the given archive from ``workers`` processes, resuming from and updating the checkpoint.
+
+    Parameters
+    ----------
+    path : str
+        Archive to index, rotated parts are included.
+    checkpoint : str
+        Path of the checkpoint file. Created if missing.
+    workers : int
+        Number of worker processes.
+    es_args : tuple
+        Arguments passed to ``es_factory`` by each worker to create its Elasticsearch client.
+    bulk_kwargs : dict, optional
+        Extra keyword arguments passed to ``bulk``.
+    batch_docs : int, optional
+        Number of documents indexed between two checkpoints.
+    es_factory : callable, optional
+        Creates the Elasticsearch client of each worker.
+    bulk : callable, optional
+        Bulk indexing function, defaults to :py:func:`~snafu.utils.py_es_bulk.streaming_bulk`.
+    seen_ids : AcknowledgedIds, optional
+        Ids already acknowledged by Elasticsearch, whose documents aren't sent. It's closed while workers
+        read it from disk, then reopened to add the ids they got acknowledged, even if the replay fails.
+
+    Returns
+    -------
+    tuple
+        The combined bulk statistics of all workers and the number of bytes of the indexed documents.
+    """
+
+    state = _load_checkpoint(checkpoint, path)
+    if state:
+        # keep the shards of the interrupted replay, whatever the number of workers is now
+        shards = [Shard(val["part"], val["start"], val["end"]) for val in state.values()]
+    else:
+        shards = plan_shards(path, workers)
+        for shard in shards:
+            state[shard.key] = {**dataclasses.asdict(shard), "offset": shard.start, "done": False}
+    todo = [shard for shard in shards if not state[shard.key]["done"]]
+    logger.info(
+        f"Replaying archive {path} with {workers} workers: {len(todo)} of {len(shards)} shards left, "
+        f"checkpointing to {checkpoint}"
+    )
+
+    results: List[BulkStats] = []
+    document_bytes = 0
+    seen_ids_args = None
+    acknowledged: List[str] = []
+    if seen_ids is not None:
+        # the set is only written by this process, once workers no longer read it
+        seen_ids.close()
+        seen_ids_args = (seen_ids.directory, seen_ids.capacity, seen_ids.error_rate)
+    try:
+        with multiprocessing.Manager() as manager:
+            progress = manager.Queue()
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(
+                        _replay_shard,
+                        shard,
+                        state[shard.key]["offset"],
+                        es_factory,
+                        es_args,
+                        bulk,
+                        bulk_kwargs or {},
+                        batch_docs,
+                        progress,
+                        seen_ids_args,
+                    )
+                    for shard in todo
+                ]
+                pending = set(futures)
+                while pending or not progress.empty():
+                    try:
+                        key, offset, done, stats, num_bytes, batch_ids = progress.get(timeout=0.5)
+                    except queue.Empty:
+                        pending = {future for future in pending if not future.done()}
+                        continue
+                    state[key].update(offset=offset, done=done)
+                    if stats is not None:
+                        results.append(stats)
+                        document_bytes += num_bytes
+                    acknowledged.extend(batch_ids)
+                    _save_checkpoint(checkpoint, path, state)
+                # surface worker failures, the checkpoint still records their progress
+                for future in futures:
+                    future.result()
+    finally:
+        if seen_ids is not None:
+            seen_ids.open()
+            for doc_id in acknowledged:
+                seen_ids.add(doc_id)
+
+    _save_checkpoint(checkpoint, path, state)
+    return combine_bulk_stats(results), document_bytes
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent set of document ``_id``s already acknowledged by Elasticsearch.
+
+Lookups first go through an in-memory Bloom filter, so the vast majority of new documents are recognized
+as such without touching the disk. Only Bloom filter hits are confirmed against an exact on-disk set kept
+in a :py:mod:`dbm` database, which means a false positive never causes a document to be skipped.
+
+One set is kept per Elasticsearch host and index prefix, under a common base directory.
+"""
+import dbm
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from typing import Iterable, Tuple
+
+logger = logging.getLogger("snafu")
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter of strings.
+
+    Parameters
+    ----------
+    capacity : int
+        Expected number of items.
+    error_rate : float
+        False positive rate once ``capacity`` items were added.
+
+    Examples
+    --------
+    >>> bloom = BloomFilter(1000, 0.01)
+    >>> bloom.add("a")
+    >>> "a" in bloom, "b" in bloom
+    (True, False)
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # double hashing, see Kirsch and Mitzenmacher, "Less Hashing, Same Performance"
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item: str) -> None:
+        """Add the given item."""
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class AcknowledgedIds:
+    """
+    Thread-safe, persistent set of acknowledged document ids stored in the given directory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the on-disk set and the saved Bloom filter. Created if missing.
+    capacity : int, optional
+        Expected number of ids, used to size the Bloom filter.
+    error_rate : float, optional
+        Bloom filter false positive rate at ``capacity`` ids.
+    read_only : bool, optional
+        Open an existing set for lookups only, several processes can then read it at once as long as no
+        process has it open for writing.
+    """
+
+    def __init__(
+        self, directory: str, capacity: int = 1000000, error_rate: float = 0.001, read_only: bool = False
+    ):
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.read_only = read_only
+        self._bloom_path = os.path.join(directory, "bloom.bin")
+        self._meta_path = os.path.join(directory, "bloom.json")
+        self._lock = threading.Lock()
+        self.open()
+
+    def open(self) -> None:
+        """Open the on-disk set and load the Bloom filter, done on creation and again after a close."""
+
+        self._db = dbm.open(os.path.join(self.directory, "ids"), "r" if self.read_only else "c")
+        self.bloom = BloomFilter(self.capacity, self.error_rate)
+        if not self._load_bloom():
+            # the Bloom filter wasn't saved (first use or a crash), rebuild it from the exact set
+            for key in self._db.keys():
+                self.bloom.add(key.decode())
+        logger.info(f"Loaded {len(self._db)} acknowledged document ids from {self.directory}")
+
+    @classmethod
+    def for_target(cls, base_directory: str, es_host: str, index_prefix: str, **kwargs) -> "AcknowledgedIds":
+        """Return the set of acknowledged ids of the given Elasticsearch host and index prefix."""
+
+        target = hashlib.sha256(f"{es_host}|{index_prefix}".encode()).hexdigest()[:16]
+        return cls(os.path.join(base_directory, target), **kwargs)
+
+    def _load_bloom(self) -> bool:
+        if not (os.path.isfile(self._bloom_path) and os.path.isfile(self._meta_path)):
+            return False
+        with open(self._meta_path) as meta_file:
+            meta = json.load(meta_file)
+        if (meta["num_bits"], meta["num_hashes"]) != (self.bloom.num_bits, self.bloom.num_hashes):
+            return False
+        with open(self._bloom_path, "rb") as bloom_file:
+            self.bloom.bits = bytearray(bloom_file.read())
+        if not self.read_only:
+            # invalidate the saved filter until the next clean close, ids added meanwhile aren't in it
+            os.remove(self._meta_path)
+        return True
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self._lock:
+            return doc_id in self.bloom and doc_id.encode() in self._db
+
+    def __len__(self) -> int:
+        return len(self._db)
+
+    def add(self, doc_id: str) -> None:
+        """Record the given id as acknowledged."""
+        if self.read_only:
+            raise ValueError(f"The acknowledged ids in {self.directory} were opened read-only")
+        with self._lock:
+            if doc_id not in self.bloom or doc_id.encode() not in self._db:
+                self.bloom.add(doc_id)
+                self._db[doc_id.encode()] = b""
+
+    def close(self) -> None:
+        """Save the Bloom filter and close the on-disk set."""
+
+        with self._lock:
+            if self.read_only:
+                self._db.close()
+                return
+            with open(self._bloom_path, "wb") as bloom_file:
+                bloom_file.write(self.bloom.bits)
+            with open(self._meta_path, "w") as meta_file:
+                json.dump({"num_bits": self.bloom.num_bits, "num_hashes": self.bloom.num_hashes}, meta_file)
+            self._db.close()
+
+    def stats(self) -> Tuple[int, int]:
+        """Return the number of ids and the size in bytes of the Bloom filter."""
+        return len(self._db), len(self.bloom.bits)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Finalize Elasticsearch documents by serializing their source exactly once.
+
+The canonical JSON of a document's source is computed once and then reused everywhere: its hash becomes
+the document's ``_id``, its length is the document's size, and the string itself is sent as the body of
+the bulk request and written into archive files.
+"""
+import datetime
+import hashlib
+import json
+import uuid
+from typing import Any, Dict
+
+import numpy as np
+
+
+def _default(value: Any) -> Any:
+    """Serialize the non-JSON types which the Elasticsearch client would otherwise handle for us."""
+
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return str(value)
+
+
+_ENCODER = json.JSONEncoder(sort_keys=True, separators=(",", ":"), default=_default)
+
+
+def serialize_source(source: Dict[str, Any]) -> str:
+    """
+    Return the canonical JSON serialization of the given document source.
+
+    Keys are sorted and no whitespace is emitted, so equal documents always give equal strings. The result
+    is pure ASCII, therefore its length is also its size in bytes.
+
+    Examples
+    --------
+    >>> serialize_source({"b": 1, "a": [1.5, None]})
+    '{"a":[1.5,null],"b":1}'
+    """
+
+    return _ENCODER.encode(source)
+
+
+def document_id(serialized_source: str) -> str:
+    """
+    Return the ``_id`` of a document given its canonical serialization.
+
+    SHA-256 is hardware accelerated on current CPUs, which makes it faster than the other hashes
+    available in :py:mod:`hashlib`.
+    """
+
+    return hashlib.sha256(serialized_source.encode()).hexdigest()
+
+
+def finalize_document(source: Dict[str, Any], es_index: str, run_id: str) -> Dict[str, Any]:
+    """
+    Build an Elasticsearch friendly ``create`` action whose ``_source`` is already serialized.
+
+    The Elasticsearch client passes string sources through to the bulk body untouched.
+
+    Examples
+    --------
+    >>> doc = finalize_document({"value": 1}, "snafu-test", "NA")
+    >>> doc["_source"]
+    '{"run_id":"NA","value":1}'
+    >>> doc["_id"] == document_id(doc["_source"])
+    True
+    """
+
+    source["run_id"] = run_id
+    serialized = serialize_source(source)
+    return {
+        "_index": es_index,
+        "_op_type": "create",
+        "_source": serialized,
+        "_id": document_id(serialized),
+        "run_id": run_id,
+    }
+
+
+def archive_line(document: Dict[str, Any]) -> str:
+    """
+    Return the archive file line of the given finalized document, without a trailing newline.
+
+    The already serialized source is spliced in rather than serialized again, the line parses back into
+    the same action with a ``_source`` dict.
+
+    Examples
+    --------
+    >>> line = archive_line(finalize_document({"value": 1}, "snafu-test", "NA"))
+    >>> json.loads(line)["_source"]
+    {'run_id': 'NA', 'value': 1}
+    """
+
+    source = document["_source"]
+    if not isinstance(source, str):
+        return json.dumps(document, default=_default)
+    metadata = {key: value for key, value in document.items() if key != "_source"}
+    return json.dumps(metadata, default=_default)[:-1] + ', "_source": ' + source + "}"
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Create Elasticsearch clients from the settings given to snafu.
+
+:py:func:`get_es_client` keeps one long-lived client per server and TLS settings, so that every part of
+a run talking to the same cluster shares a single connection pool.
+"""
+import json
+import logging
+import ssl
+import threading
+from typing import Dict, Tuple
+
+import elasticsearch
+import urllib3
+
+logger = logging.getLogger("snafu")
+
+
+_clients: Dict[Tuple[str, bool, bool], elasticsearch.Elasticsearch] = {}
+_clients_lock = threading.Lock()
+
+
+def create_es_client(
+    server: str, verify_cert: bool = True, use_ssl: bool = False, maxsize: int = 10
+) -> elasticsearch.Elasticsearch:
+    """
+    Return a new Elasticsearch client for the given server.
+
+    Parameters
+    ----------
+    server : str
+        URL of the Elasticsearch server.
+    verify_cert : bool, optional
+        If ``False``, TLS certificates and hostnames are not verified.
+    use_ssl : bool, optional
+        Passed to the client along with the unverified SSL context when ``verify_cert`` is ``False``.
+    maxsize : int, optional
+        Maximum number of connections kept open to the server.
+    """
+
+    if not verify_cert:
+        logger.info("Turning off TLS certificate verification")
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        ssl_ctx = ssl.create_default_context()
+        ssl_ctx.check_hostname = False
+        ssl_ctx.verify_mode = ssl.CERT_NONE
+        return elasticsearch.Elasticsearch(
+            [server], send_get_body_as="POST", ssl_context=ssl_ctx, use_ssl=use_ssl, maxsize=maxsize
+        )
+    return elasticsearch.Elasticsearch([server], send_get_body_as="POST", maxsize=maxsize)
+
+
+def get_es_client(
+    server: str, verify_cert: bool = True, use_ssl: bool = False
+) -> elasticsearch.Elasticsearch:
+    """
+    Return the shared Elasticsearch client for the given server and TLS settings, creating it if needed.
+
+    Clients are created by :py:func:`create_es_client` and stay open until :py:func:`close_es_clients`.
+    The first call for a given server checks the connection and logs the cluster information, errors are
+    raised to the caller and the client isn't kept.
+    """
+
+    key = (server, verify_cert, use_ssl)
+    with _clients_lock:
+        if key not in _clients:
+            es = create_es_client(server, verify_cert=verify_cert, use_ssl=use_ssl)
+            info = es.info()
+            logger.info(f"Connected to the elasticsearch cluster at {server} with info as follows:")
+            logger.info(json.dumps(info, indent=4))
+            _clients[key] = es
+        return _clients[key]
+
+
+def close_es_clients() -> None:
+    """Close the connections of every shared Elasticsearch client."""
+
+    with _clients_lock:
+        for es in _clients.values():
+            es.transport.close()
+        _clients.clear()
+
+
+def forget_es_clients() -> None:
+    """
+    Drop the shared Elasticsearch clients without closing their connections.
+
+    Meant for processes forked from a process holding clients, whose connections belong to their parent.
+    """
+
+    with _clients_lock:
+        _clients.clear()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export the Elasticsearch friendly documents produced by a run to one or more sinks.
+
+Besides Elasticsearch itself, documents can be written to batched NDJSON files, which use the archive
+format and can therefore be indexed later with ``--tool archive``, or to columnar Parquet files
+partitioned by index (this requires the ``pyarrow`` package). Any number of sinks may receive the same
+documents, see :py:func:`export_documents`.
+"""
+import abc
+import collections
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from snafu.utils.documents import archive_line
+from snafu.utils.indexing_pipeline import IndexingPipeline
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger("snafu")
+
+
+def _file_stem() -> str:
+    """Return a file name prefix which is unique to this run, so that exports never overwrite each other."""
+    return f"snafu-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{os.getpid()}"
+
+
+class Exporter(abc.ABC):
+    """Sink receiving every document of a run."""
+
+    @abc.abstractmethod
+    def export(self, document: Dict[str, Any]) -> None:
+        """Export the given Elasticsearch friendly document."""
+
+    @abc.abstractmethod
+    def close(self) -> Any:
+        """Flush every pending document and return the sink specific result of the export."""
+
+
+class ElasticsearchExporter(Exporter):
+    """
+    Index documents into Elasticsearch on the background threads of the given pipeline.
+
+    The pipeline is started right away, :py:meth:`close` returns its bulk statistics.
+    """
+
+    def __init__(self, pipeline: IndexingPipeline):
+        self.pipeline = pipeline.start()
+
+    def export(self, document: Dict[str, Any]) -> None:
+        self.pipeline.put(document)
+
+    def close(self) -> Any:
+        return self.pipeline.close()
+
+
+class NDJSONExporter(Exporter):
+    """
+    Write documents to NDJSON files in the archive format, starting a new file every ``batch_docs``.
+
+    :py:meth:`close` returns the list of written files.
+    """
+
+    def __init__(self, directory: str, batch_docs: int = 10000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.batch_docs = batch_docs
+        self.files: List[str] = []
+        self._stem = _file_stem()
+        self._batch: List[str] = []
+
+    def _flush(self) -> None:
+        if not self._batch:
+            return
+        path = os.path.join(self.directory, f"{self._stem}-{len(self.files):05d}.ndjson")
+        with open(path, "w") as ndjson_file:
+            ndjson_file.write("".join(self._batch))
+        self.files.append(path)
+        self._batch = []
+
+    def export(self, document: Dict[str, Any]) -> None:
+        self._batch.append(archive_line(document) + "\n")
+        if len(self._batch) >= self.batch_docs:
+            self._flush()
+
+    def close(self) -> Any:
+        self._flush()
+        logger.info(f"Exported documents to {len(self.files)} NDJSON file(s) in {self.directory}")
+        return self.files
+
+
+def _has_empty_struct(arrow_type) -> bool:
+    """Return ``True`` if the given Arrow type contains a struct without fields, which Parquet can't store."""
+
+    if pyarrow.types.is_struct(arrow_type):
+        return arrow_type.num_fields == 0 or any(
+            _has_empty_struct(arrow_type.field(num).type) for num in range(arrow_type.num_fields)
+        )
+    if pyarrow.types.is_list(arrow_type) or pyarrow.types.is_large_list(arrow_type):
+        return _has_empty_struct(arrow_type.value_type)
+    return False
+
+
+def _arrow_column(values: List[Any]):
+    """Convert the given values to an Arrow array, falling back to JSON strings for mixed or odd types."""
+
+    try:
+        column = pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        column = None
+    if column is None or _has_empty_struct(column.type):
+        column = pyarrow.array(
+            [None if value is None else json.dumps(value, sort_keys=True) for value in values],
+            type=pyarrow.string(),
+        )
+    return column
+
+
+def _conform_table(rows: List[Dict[str, Any]], schema):
+    """Return the given rows as a table of the given schema, or ``None`` if they don't fit in it."""
+
+    if any(key not in schema.names for row in rows for key in row):
+        return None
+    columns = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        if pyarrow.types.is_string(field.type):
+            values = [
+                val if val is None or isinstance(val, str) else json.dumps(val, sort_keys=True)
+                for val in values
+            ]
+        try:
+            # convert then cast, which unlike converting straight to the type refuses to lose data
+            column = pyarrow.array(values)
+            columns.append(column if column.type == field.type else column.cast(field.type))
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, pyarrow.ArrowNotImplementedError):
+            return None
+    return pyarrow.Table.from_arrays(columns, schema=schema)
+
+
+class ParquetExporter(Exporter):
+    """
+    Write document sources to Parquet files, one directory per index (``<directory>/index=<index>``).
+
+    Columns are the fields of the documents plus their ``_id``, fields mixing incompatible types are stored
+    as JSON strings. Every ``batch_docs`` documents of an index are written as a row group of the current
+    file of that index; a new file is started when a batch doesn't fit the schema of the current one.
+    :py:meth:`close` returns the list of written files.
+    """
+
+    def __init__(self, directory: str, batch_docs: int = 10000):
+        if pyarrow is None:
+            raise RuntimeError("Parquet export requires the pyarrow package")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.batch_docs = batch_docs
+        self.files: List[str] = []
+        self._stem = _file_stem()
+        self._parts: Dict[str, int] = collections.Counter()
+        self._writers: Dict[str, Any] = {}
+        self._batches: Dict[str, List[Dict[str, Any]]] = collections.defaultdict(list)
+
+    def _flush(self, index: str) -> None:
+        rows = self._batches.pop(index, [])
+        if not rows:
+            return
+        writer = self._writers.get(index)
+        table = _conform_table(rows, writer.schema) if writer is not None else None
+        if table is None:
+            if writer is not None:
+                logger.info(f"Schema of index {index} changed, starting a new Parquet file")
+                writer.close()
+            fields = list(dict.fromkeys(key for row in rows for key in row))
+            table = pyarrow.table(
+                {field: _arrow_column([row.get(field) for row in rows]) for field in fields}
+            )
+            partition = os.path.join(self.directory, f"index={index}")
+            os.makedirs(partition, exist_ok=True)
+            path = os.path.join(partition, f"{self._stem}-{self._parts[index]:05d}.parquet")
+            writer = self._writers[index] = pyarrow.parquet.ParquetWriter(path, table.schema)
+            self._parts[index] += 1
+            self.files.append(path)
+        writer.write_table(table)
+
+    def export(self, document: Dict[str, Any]) -> None:
+        source = document["_source"]
+        row = json.loads(source) if isinstance(source, str) else dict(source)
+        row["_id"] = document["_id"]
+        batch = self._batches[document["_index"]]
+        batch.append(row)
+        if len(batch) >= self.batch_docs:
+            self._flush(document["_index"])
+
+    def close(self) -> Any:
+        for index in list(self._batches):
+            self._flush(index)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        logger.info(f"Exported documents to {len(self.files)} Parquet file(s) in {self.directory}")
+        return self.files
+
+
+FILE_EXPORTERS = {"ndjson": NDJSONExporter, "parquet": ParquetExporter}
+
+
+def create_file_exporter(spec: str, batch_docs: int = 10000) -> Exporter:
+    """
+    Create a file exporter from a ``<format>:<directory>`` specification.
+
+    Examples
+    --------
+    >>> create_file_exporter("csv:/tmp/out")
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown export format csv, expected one of ndjson, parquet
+    """
+
+    export_format, sep, directory = spec.partition(":")
+    if export_format not in FILE_EXPORTERS:
+        raise ValueError(
+            f"Unknown export format {export_format}, expected one of {', '.join(FILE_EXPORTERS)}"
+        )
+    if not sep or not directory:
+        raise ValueError(f"Missing the output directory of the {export_format} export: {spec}")
+    return FILE_EXPORTERS[export_format](directory, batch_docs=batch_docs)
+
+
+def export_documents(documents: Iterable[Dict[str, Any]], exporters: List[Exporter]) -> List[Any]:
+    """
+    Send every document to each of the given exporters, then close them.
+
+    Every exporter is closed even if another one failed, the first error is raised afterwards.
+
+    Returns
+    -------
+    list
+        The result of closing each exporter, in order.
+    """
+
+    results: List[Any] = []
+    error: Optional[BaseException] = None
+    try:
+        for document in documents:
+            for exporter in exporters:
+                exporter.export(document)
+    finally:
+        for exporter in exporters:
+            try:
+                results.append(exporter.close())
+            except Exception as err:  # pylint: disable=W0703
+                logger.error(f"Closing exporter {type(exporter).__name__} failed: {err}")
+                results.append(None)
+                error = error or err
+    if error is not None:
+        raise error
+    return results
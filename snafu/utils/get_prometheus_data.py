@@ -1,16 +1,43 @@
+import codecs
+import collections
+import concurrent.futures
+import inspect
+import itertools
 import json
 import logging
 import os
+import re
+import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 
+import numpy as np
+import requests
 import urllib3
 from prometheus_api_client import PrometheusConnect
 
+from snafu.utils.query_cache import QueryCache
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger("snafu")
 
+# Prometheus refuses range queries returning more points than this per series
+_MAX_POINTS_PER_SERIES = 11000
+
+# size of the chunks read from streamed range query responses
+_STREAM_CHUNK_BYTES = 64 * 1024
+
+_RESULT_START = re.compile(r'"result"\s*:\s*\[')
+_SERIES_SEPARATOR = re.compile(r"[\s,]*")
+
+_STATS = ("min", "max", "mean", "p50", "p95", "p99", "integral", "rate")
+
+# clients are kept for the whole process, so that their connections are reused from one trigger to the next,
+# and from one job to the next in the workers of the agent
+_clients = {}
+_clients_lock = threading.Lock()
+
 
 class get_prometheus_data:
     def __init__(self, action):
@@ -37,6 +64,20 @@ class get_prometheus_data:
         else:
             self.T_Delta = 30
 
+        # range queries run concurrently on a bounded pool, each request timing out after
+        # prom_query_timeout seconds, which is also passed to Prometheus as the evaluation timeout
+        self.query_workers = int(os.environ.get("prom_query_workers", 8))
+        self.query_timeout = float(os.environ.get("prom_query_timeout", 120))
+
+        # results of past range queries are kept on disk when prom_cache_dir is set, so the same sample
+        # windows can be indexed again without Prometheus
+        self.cache = None
+        if "prom_cache_dir" in os.environ:
+            self.cache = QueryCache(
+                os.environ["prom_cache_dir"],
+                max_bytes=int(os.environ.get("prom_cache_max_bytes", 1024 * 1024 * 1024)),
+            )
+
         self.get_data = False
         if "prom_token" in os.environ and "prom_url" in os.environ:
             self.get_data = True
@@ -44,79 +85,426 @@ class get_prometheus_data:
             self.url = os.environ["prom_url"]
             bearer = "Bearer " + token
             self.headers = {"Authorization": bearer}
-            self.pc = PrometheusConnect(url=self.url, headers=self.headers, disable_ssl=True)
+            self.pc = get_prometheus_connection(self.url, token)
+            # older releases of prometheus-api-client take no request timeout and would wait forever on a
+            # hung query, range queries are then sent without going through the client
+            self.client_timeout = "timeout" in inspect.signature(self.pc.custom_query_range).parameters
+            # with prom_stream, range query responses are decoded series by series as they are received
+            # instead of being loaded whole by PrometheusConnect
+            self.stream = os.environ.get("prom_stream", "false").lower() == "true"
+            if self.stream:
+                self.session = get_stream_session(self.url)
         else:
             logger.warn(
                 """snafu service account token and prometheus url not set \n
                         No Prometheus data will be indexed"""
             )
 
+    def _windows(self):
+        # split the sample window into chunks of at most _MAX_POINTS_PER_SERIES evaluation points, chunks
+        # start on the step grid of the whole window so that stitching them gives the same points
+        step = float(self.T_Delta)
+        points = max(0, int((self.end - self.start).total_seconds() // step)) + 1
+        windows = []
+        for first in range(0, points, _MAX_POINTS_PER_SERIES):
+            last = min(first + _MAX_POINTS_PER_SERIES, points) - 1
+            windows.append(
+                (self.start + timedelta(seconds=first * step), self.start + timedelta(seconds=last * step))
+            )
+        return windows
+
+    def _query_range(self, query, start, end):
+        # Execute custom query to pull the desired labels between X and Y time.
+        # Series are returned with their points as numpy arrays of times and values. Streamed responses
+        # which aren't cached are returned as soon as their headers are received, their series being decoded
+        # one at a time as they are iterated over.
+        step = str(self.T_Delta) + "s"
+        if self.cache is not None:
+            key = QueryCache.key(self.url, query, start.timestamp(), end.timestamp(), step)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return [_series_arrays(result) for result in cached]
+        params = {"timeout": "%ds" % self.query_timeout}
+        if self.stream:
+            series = _decode_stream(
+                self._get_range(self.session, query, start, end, step, params, stream=True)
+            )
+            if self.cache is None:
+                return series
+            response = list(series)
+        elif self.client_timeout:
+            response = [
+                _series_arrays(result)
+                for result in self.pc.custom_query_range(
+                    query, start, end, step, params, timeout=self.query_timeout
+                )
+            ]
+        else:
+            with self._get_range(get_stream_session(self.url), query, start, end, step, params) as reply:
+                response = [_series_arrays(result) for result in reply.json()["data"]["result"]]
+        if self.cache is not None:
+            self.cache.put(key, [_series_lists(result) for result in response])
+        return response
+
+    def _get_range(self, session, query, start, end, step, params, stream=False):
+        # send the range query with a client side timeout, the response is returned unread
+        params = dict(
+            params, query=query, start=round(start.timestamp()), end=round(end.timestamp()), step=step
+        )
+        response = session.get(
+            self.url + "/api/v1/query_range",
+            params=params,
+            headers=self.headers,
+            timeout=self.query_timeout,
+            stream=stream,
+        )
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _stitch(responses):
+        # merge the series of consecutive windows, keeping the order in which series first appear
+        series = {}
+        for response in responses:
+            for result in response:
+                key = json.dumps(result["metric"], sort_keys=True)
+                if key in series:
+                    previous = series[key]
+                    series[key] = {
+                        "metric": previous["metric"],
+                        "times": np.concatenate([previous["times"], result["times"]]),
+                        "values": np.concatenate([previous["values"], result["values"]]),
+                    }
+                else:
+                    series[key] = result
+        return list(series.values())
+
+    @staticmethod
+    def _rename(result, label):
+        # clean up name key from __name__ to name
+        result["metric"]["name"] = ""
+        if "__name__" in result["metric"]:
+            result["metric"]["name"] = result["metric"]["__name__"]
+            del result["metric"]["__name__"]
+        else:
+            result["metric"]["name"] = label
+
+    def _flatten(self, metric_name, label, response):
+        for result in response:
+            self._rename(result, label)
+            # each result has arrays of points, we must flatten them out in order to send to ES
+            timestamps = _format_dates(result["times"])
+            # need to handle values that are NaN, Inf, or -Inf
+            values = result["values"]
+            metric_values = np.where(np.isfinite(values), values, 0).tolist()
+            for timestamp, metric_value in zip(timestamps, metric_values):
+                flat_doc = {
+                    "metric": result["metric"],
+                    "Date": timestamp,
+                    "value": metric_value,
+                    "metric_name": metric_name,
+                }
+
+                flat_doc.update(self.sample_info_dict)
+                yield flat_doc
+
+    def _summarize(self, metric_name, label, response, totals):
+        # one document per series, the finite values of the series are also added to the metric totals
+        for result in response:
+            self._rename(result, label)
+            times, values = result["times"], result["values"]
+            finite = np.isfinite(values)
+            summary = summarize_series(times[finite], values[finite])
+            totals.setdefault(metric_name, []).append((values[finite], summary))
+
+            first = times[:1] if len(times) else np.array([self.start.timestamp()])
+            summary_doc = {
+                "metric": result["metric"],
+                "Date": _format_dates(first)[0],
+                "metric_name": metric_name,
+            }
+            summary_doc.update(summary)
+            summary_doc.update(self.sample_info_dict)
+            yield summary_doc
+
+    def _query_all(self):
+        # yield the metric name, include file item, window and series of every window of every query of the
+        # include file, in include file order so documents, and therefore their ids, stay stable
+
+        # resolve directory  the tool include file
+        dirname = os.path.dirname(os.path.realpath(__file__))
+        include_file_dir = os.path.join(dirname, "prometheus_labels/")
+        tool_include_file = include_file_dir + self.sample_info_dict["tool"] + "_included_labels.json"
+
+        # check if tools include file is there
+        # if not use the default include file
+        if os.path.isfile(tool_include_file):
+            filename = tool_include_file
+        else:
+            filename = os.path.join(include_file_dir, "included_labels.json")
+        logger.info("using prometheus metric include file %s" % filename)
+
+        # open tools include file and loop through all
+        with open(filename, "r") as f:
+            datastore = json.load(f)
+
+        windows = self._windows()
+        if len(windows) > 1:
+            logger.info(
+                "splitting prometheus queries into %d windows of at most %d points"
+                % (len(windows), _MAX_POINTS_PER_SERIES)
+            )
+        tasks = (
+            (metric_name, query_item, window)
+            for metric_name, query_item in datastore["data"].items()
+            for window in windows
+        )
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.query_workers, thread_name_prefix="snafu-prometheus-query"
+        )
+        # only a bounded number of queries run ahead of the one being consumed, so that finished results
+        # don't pile up while the documents of earlier queries are indexed
+        pending = collections.deque()
+
+        def submit(task):
+            pending.append((task, pool.submit(self._query_range, task[1]["query"], *task[2])))
+
+        try:
+            for task in itertools.islice(tasks, self.query_workers):
+                submit(task)
+            while pending:
+                (metric_name, query_item, window), future = pending.popleft()
+                task = next(tasks, None)
+                if task is not None:
+                    submit(task)
+                yield metric_name, query_item, window, self._series(future, query_item["query"], window)
+        finally:
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown()
+
+        if self.cache is not None:
+            logger.info(
+                "prometheus query cache %s: %d hits, %d misses"
+                % (self.cache.directory, self.cache.hits, self.cache.misses)
+            )
+
+    @staticmethod
+    def _series(future, query, window):
+        # series of the query window, queries time out on their own however long they waited for a worker
+        try:
+            yield from future.result()
+        except Exception as e:
+            # skip the rest of the failed window, the other windows of the query are still indexed
+            logger.info(query)
+            logger.warning("failure to get metric results %s between %s and %s" % (repr(e), *window))
+
     def get_all_metrics(self):
 
         # check get_data bool, if false by-pass all processing
         if self.get_data:
             start_time = time.time()
+            # the documents of each series are yielded as soon as it is decoded, window after window
+            for metric_name, query_item, _, series in self._query_all():
+                yield from self._flatten(metric_name, query_item["label"], series)
+            logger.debug("Total Time --- %s seconds ---" % (time.time() - start_time))
+
+    def get_summaries(self):
+        """
+        Summarize the metrics of the sample window instead of returning every point.
 
-            # resolve directory  the tool include file
-            dirname = os.path.dirname(os.path.realpath(__file__))
-            include_file_dir = os.path.join(dirname, "prometheus_labels/")
-            tool_include_file = include_file_dir + self.sample_info_dict["tool"] + "_included_labels.json"
-
-            # check if tools include file is there
-            # if not use the default include file
-            if os.path.isfile(tool_include_file):
-                filename = tool_include_file
-            else:
-                filename = os.path.join(include_file_dir, "included_labels.json")
-            logger.info("using prometheus metric include file %s" % filename)
-
-            # open tools include file and loop through all
-            with open(filename, "r") as f:
-                datastore = json.load(f)
-
-            for metric_name in datastore["data"]:
-
-                query_item = datastore["data"][metric_name]
-                query = query_item["query"]
-                label = query_item["label"]
-
-                step = str(self.T_Delta) + "s"
-                try:
-                    # Execute custom query to pull the desired labels between X and Y time.
-                    response = self.pc.custom_query_range(query, self.start, self.end, step, None)
-
-                except Exception as e:
-                    # response undefined at this point, we want to skip next for loop
-                    response = []
-                    logger.info(query)
-                    logger.warn("failure to get metric results %s" % e)
-
-                for result in response:
-                    # clean up name key from __name__ to name
-                    result["metric"]["name"] = ""
-                    if "__name__" in result["metric"]:
-                        result["metric"]["name"] = result["metric"]["__name__"]
-                        del result["metric"]["__name__"]
-                    else:
-                        result["metric"]["name"] = label
-                    # each result has a list, we must flatten it out in order to send to ES
-                    for value in result["values"]:
-                        # fist index is time stamp
-                        timestamp = datetime.utcfromtimestamp(value[0]).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-                        # second index is value of metric
-                        if "NaN" in value[1]:  # need to handle values that are NaN, Inf, or -Inf
-                            metric_value = 0
-                        else:
-                            metric_value = float(value[1])
-
-                        flat_doc = {
-                            "metric": result["metric"],
-                            "Date": timestamp,
-                            "value": metric_value,
-                            "metric_name": metric_name,
-                        }
-
-                        flat_doc.update(self.sample_info_dict)
-                        yield flat_doc
+        Returns the list of per-series summary documents, one per series of every query, and a dict
+        summarizing each metric over all of its series, meant to be attached to the benchmark result of
+        the sample. Both are empty when Prometheus isn't configured.
+        """
 
+        series_docs = []
+        metrics = {}
+        if self.get_data:
+            start_time = time.time()
+            totals = {}
+            queries = itertools.groupby(self._query_all(), key=lambda query: query[:2])
+            for (metric_name, query_item), windows in queries:
+                # series are summarized over the whole sample, their windows are stitched back first
+                response = self._stitch(list(series) for _, _, _, series in windows)
+                series_docs.extend(self._summarize(metric_name, query_item["label"], response, totals))
+            for metric_name, series in totals.items():
+                metrics[metric_name] = summarize_metric(series)
             logger.debug("Total Time --- %s seconds ---" % (time.time() - start_time))
+        return series_docs, metrics
+
+
+def get_prometheus_connection(url, token):
+    """Return the Prometheus client shared by every trigger for the given URL and token."""
+
+    with _clients_lock:
+        key = ("connection", url, token)
+        if key not in _clients:
+            headers = {"Authorization": "Bearer " + token}
+            _clients[key] = PrometheusConnect(url=url, headers=headers, disable_ssl=True)
+        return _clients[key]
+
+
+def get_stream_session(url):
+    """Return the HTTP session shared by every trigger sending range queries itself to the given URL."""
+
+    with _clients_lock:
+        key = ("stream", url, None)
+        if key not in _clients:
+            session = requests.Session()
+            session.verify = False
+            _clients[key] = session
+        return _clients[key]
+
+
+def decode_range_series(chunks):
+    """
+    Decode the series of a Prometheus range query response one at a time, as the chunks of its text come in.
+
+    Only the series being decoded is buffered, the series before it are dropped once yielded.
+
+    >>> response = (
+    ...     '{"status":"success","data":{"resultType":"matrix","result":['
+    ...     '{"metric":{"job":"a"},"values":[[0,"1"]]}, {"metric":{"job":"b"},"values":[[0,"NaN"]]}]}}'
+    ... )
+    >>> chunks = [response[:30], response[30:80], response[80:]]
+    >>> [(series["metric"]["job"], series["values"]) for series in decode_range_series(chunks)]
+    [('a', [[0, '1']]), ('b', [[0, 'NaN']])]
+    """
+
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    start = None
+    for chunk in chunks:
+        buffer += chunk
+        start = _RESULT_START.search(buffer)
+        if start is not None:
+            break
+    if start is None:
+        # no result to decode, most likely an error response
+        body = json.loads(buffer) if buffer.strip() else {}
+        raise ValueError("prometheus range query failed: %s" % body.get("error", body))
+
+    buffer = buffer[start.end() :]
+    position = 0
+    while True:
+        position = _SERIES_SEPARATOR.match(buffer, position).end()
+        if buffer.startswith("]", position):
+            return
+        try:
+            series, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            # the series isn't complete yet, read on until the end of a series may have come in
+            buffer = buffer[position:]
+            position = 0
+            while True:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise
+                buffer += chunk
+                if "]}" in buffer[-len(chunk) - 1 :]:
+                    break
+            continue
+        yield series
+        position = end
+
+
+def _decode_stream(response):
+    # read the raw response as it comes in and decode its series one at a time, only the series being
+    # decoded is held in memory
+    with response:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        chunks = (decoder.decode(chunk) for chunk in response.iter_content(_STREAM_CHUNK_BYTES))
+        for result in decode_range_series(chunks):
+            yield _series_arrays(result)
+
+
+def _series_arrays(result):
+    # points of a series as arrays of times and values, NaN and +/-Inf are parsed as such
+    if "times" in result:
+        times, values = result["times"], result["values"]
+    else:
+        points = np.array(result["values"], dtype=float).reshape(-1, 2)
+        times, values = points[:, 0], points[:, 1]
+    return {
+        "metric": result["metric"],
+        "times": np.asarray(times, dtype=float),
+        "values": np.asarray(values, dtype=float),
+    }
+
+
+def _series_lists(result):
+    # JSON serializable form of a series of arrays, which _series_arrays turns back into arrays
+    return {
+        "metric": result["metric"],
+        "times": result["times"].tolist(),
+        "values": result["values"].tolist(),
+    }
+
+
+def _format_dates(times):
+    # same as formatting each time with datetime.utcfromtimestamp(...).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    dates = np.round(np.asarray(times) * 1e6).astype("datetime64[us]")
+    return [date + "Z" for date in np.datetime_as_string(dates, unit="us").tolist()]
+
+
+def summarize_series(times, values):
+    """
+    Return the statistics of a series given the times and values of its finite points.
+
+    ``integral`` is the area under the series over time, by the trapezoidal rule, and ``rate`` the change
+    of its value per second between the first and last points.
+
+    >>> summary = summarize_series(np.array([0.0, 30.0, 60.0]), np.array([1.0, 2.0, 4.0]))
+    >>> summary["points"], summary["min"], summary["max"], summary["integral"], summary["rate"]
+    (3, 1.0, 4.0, 135.0, 0.05)
+    >>> summarize_series(np.array([]), np.array([]))["mean"] is None
+    True
+    """
+
+    summary = {"points": len(values)}
+    if len(values) == 0:
+        summary.update({stat: None for stat in _STATS})
+        return summary
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    duration = times[-1] - times[0]
+    summary.update(
+        {
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "mean": float(values.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "integral": float(np.sum((values[1:] + values[:-1]) * np.diff(times)) / 2),
+            "rate": float((values[-1] - values[0]) / duration) if duration > 0 else 0.0,
+        }
+    )
+    return summary
+
+
+def summarize_metric(series):
+    """
+    Return the statistics of a metric over all of its series.
+
+    ``series`` is a list of ``(values, summary)`` pairs, one per series. Percentiles and the mean are
+    computed over the values of every series, ``integral`` and ``rate`` are the sums of the series ones.
+
+    >>> first = np.array([1.0, 3.0])
+    >>> second = np.array([5.0, 7.0])
+    >>> summary = summarize_metric(
+    ...     [(first, summarize_series(np.array([0.0, 2.0]), first)),
+    ...      (second, summarize_series(np.array([0.0, 2.0]), second))]
+    ... )
+    >>> summary["series"], summary["mean"], summary["integral"], summary["rate"]
+    (2, 4.0, 16.0, 2.0)
+    """
+
+    values = np.concatenate([series_values for series_values, _ in series])
+    summary = summarize_series(np.arange(len(values), dtype=float), values)
+    summary["series"] = len(series)
+    for stat in ("integral", "rate"):
+        totals = [series_summary[stat] for _, series_summary in series if series_summary[stat] is not None]
+        summary[stat] = float(sum(totals)) if totals else None
+    return summary
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Staged indexing pipeline which decouples producing documents from indexing them.
+
+The benchmark (producer) puts Elasticsearch-friendly documents onto a bounded queue, while one or more
+indexer threads pull documents off of the queue and feed them to
+:py:func:`~snafu.utils.py_es_bulk.streaming_bulk`. This way a slow or retrying Elasticsearch cluster
+only stalls the benchmark once the queue is full, rather than on every bulk request.
+"""
+import collections
+import logging
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from snafu.utils.py_es_bulk import action_size, streaming_bulk
+
+logger = logging.getLogger("snafu")
+
+BulkStats = Tuple[float, float, int, int, int, int]
+
+_SENTINEL = object()
+
+
+class PipelineError(Exception):
+    """Raised by the producer side of the pipeline when an indexer thread has failed."""
+
+
+class BoundedDocumentQueue:
+    """
+    Thread-safe FIFO queue bounded by both the number of documents and their size in bytes.
+
+    A single document larger than ``max_bytes`` is still accepted when the queue is empty, so that an
+    oversized document cannot deadlock the pipeline.
+
+    Parameters
+    ----------
+    max_docs : int
+        Maximum number of documents held in the queue.
+    max_bytes : int
+        Maximum total size, in bytes, of the documents held in the queue.
+    """
+
+    def __init__(self, max_docs: int, max_bytes: int):
+        if max_docs < 1 or max_bytes < 1:
+            raise ValueError("Queue bounds must be positive")
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.blocked_seconds = 0.0
+        self._items: Deque[Tuple[Any, int]] = collections.deque()
+        self._aborted = False
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _has_room(self, size: int) -> bool:
+        if not self._items:
+            return True
+        return len(self._items) < self.max_docs and self.num_bytes + size <= self.max_bytes
+
+    def put(self, item: Any, size: int = 0) -> None:
+        """Add an item of the given size onto the queue, blocking while the queue is full."""
+
+        with self._cond:
+            if not self._has_room(size) and not self._aborted:
+                start = time.monotonic()
+                while not self._has_room(size) and not self._aborted:
+                    self._cond.wait()
+                self.blocked_seconds += time.monotonic() - start
+            if self._aborted:
+                raise PipelineError("Indexing pipeline was aborted, refusing to queue more documents")
+            self._items.append((item, size))
+            self.num_bytes += size
+            self._cond.notify_all()
+
+    def put_sentinel(self) -> None:
+        """Add an end-of-stream marker, ignoring the queue bounds."""
+
+        with self._cond:
+            self._items.append((_SENTINEL, 0))
+            self._cond.notify_all()
+
+    def get(self) -> Any:
+        """Remove and return the next item on the queue, blocking while the queue is empty."""
+
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            item, size = self._items.popleft()
+            self.num_bytes -= size
+            self._cond.notify_all()
+            return item
+
+    def abort(self) -> None:
+        """Wake up and fail any blocked producers."""
+
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+
+class IndexingPipeline:
+    """
+    Index documents on background threads while the producer keeps generating them.
+
+    Parameters
+    ----------
+    es : elasticsearch.Elasticsearch
+        Client used by the indexer threads.
+    parallel : bool, optional
+        Passed along to :py:func:`~snafu.utils.py_es_bulk.streaming_bulk`.
+    workers : int, optional
+        Number of indexer threads to run. Defaults to one.
+    max_docs : int, optional
+        Maximum number of documents which may be waiting to be indexed.
+    max_bytes : int, optional
+        Maximum size, in bytes, of the documents which may be waiting to be indexed.
+    bulk : callable, optional
+        Bulk indexing function with the same signature as
+        :py:func:`~snafu.utils.py_es_bulk.streaming_bulk`. Mostly useful for testing.
+    bulk_kwargs : dict, optional
+        Extra keyword arguments passed to ``bulk`` by each indexer thread.
+
+    Examples
+    --------
+    >>> def fake_bulk(es, actions, parallel=False):
+    ...     docs = list(actions)
+    ...     return 0.0, 1.0, len(docs), 0, 0, 0
+    >>> pipeline = IndexingPipeline(None, workers=2, max_docs=4, bulk=fake_bulk)
+    >>> pipeline.run({"_id": str(i), "_source": "{}"} for i in range(10))
+    (0.0, 1.0, 10, 0, 0, 0)
+    """
+
+    def __init__(
+        self,
+        es,
+        parallel: bool = False,
+        workers: int = 1,
+        max_docs: int = 10000,
+        max_bytes: int = 100 * 1024 * 1024,
+        bulk: Callable[..., BulkStats] = streaming_bulk,
+        bulk_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        if workers < 1:
+            raise ValueError("Indexing pipeline needs at least one worker")
+        self.es = es
+        self.parallel = parallel
+        self.workers = workers
+        self.queue = BoundedDocumentQueue(max_docs, max_bytes)
+        self._bulk = bulk
+        self._bulk_kwargs = bulk_kwargs or {}
+        self._threads: List[threading.Thread] = []
+        self._results: List[BulkStats] = []
+        self._errors: List[BaseException] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _documents(self) -> Iterable[Dict[str, Any]]:
+        while True:
+            item = self.queue.get()
+            if item is _SENTINEL:
+                return
+            yield item
+
+    def _worker(self) -> None:
+        try:
+            stats = self._bulk(self.es, self._documents(), self.parallel, **self._bulk_kwargs)
+        except BaseException as err:  # pylint: disable=W0703
+            logger.error(f"Indexer thread {threading.current_thread().name} failed: {err}")
+            with self._lock:
+                self._errors.append(err)
+            self.queue.abort()
+        else:
+            with self._lock:
+                self._results.append(stats)
+
+    def start(self) -> "IndexingPipeline":
+        """Start the indexer threads."""
+
+        logger.info(
+            f"Starting indexing pipeline with {self.workers} worker(s), queue bounded to "
+            f"{self.queue.max_docs} documents and {self.queue.max_bytes} bytes"
+        )
+        for num in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"snafu-indexer-{num}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def put(self, document: Dict[str, Any]) -> None:
+        """Queue the given document for indexing, blocking if the queue is full."""
+
+        try:
+            self.queue.put(document, action_size(document))
+        except PipelineError:
+            raise PipelineError(f"Indexing pipeline failed: {self._errors[0]}") from self._errors[0]
+
+    def close(self) -> BulkStats:
+        """
+        Drain the queue, wait for the indexer threads to finish and return the combined bulk statistics.
+
+        Returns
+        -------
+        tuple
+            Same layout as :py:func:`~snafu.utils.py_es_bulk.streaming_bulk`: the start and end times,
+            the number of successfully indexed, duplicate and failed documents and the number of retries.
+        """
+
+        if not self._closed:
+            self._closed = True
+            logger.info(f"Draining indexing pipeline with {len(self.queue)} queued documents")
+            for _ in self._threads:
+                self.queue.put_sentinel()
+            for thread in self._threads:
+                thread.join()
+            logger.info(f"Producer spent {self.queue.blocked_seconds:.3f}s blocked on a full queue")
+
+        if self._errors:
+            raise PipelineError(f"Indexing pipeline failed: {self._errors[0]}") from self._errors[0]
+
+        return combine_bulk_stats(self._results)
+
+    def run(self, documents: Iterable[Dict[str, Any]]) -> BulkStats:
+        """Start the pipeline, queue every document from the given iterable, then drain the pipeline."""
+
+        self.start()
+        try:
+            for document in documents:
+                self.put(document)
+        except BaseException:
+            # drain what was queued, but keep the producer's exception rather than the pipeline's
+            try:
+                self.close()
+            except PipelineError as e:
+                logger.error(f"Indexing pipeline also failed while the producer was failing: {e}")
+            raise
+        return self.close()
+
+
+def combine_bulk_stats(results: Iterable[BulkStats]) -> BulkStats:
+    """
+    Combine multiple :py:func:`~snafu.utils.py_es_bulk.streaming_bulk` result tuples into one.
+
+    Examples
+    --------
+    >>> combine_bulk_stats([(1.0, 5.0, 10, 1, 0, 2), (2.0, 7.0, 5, 0, 1, 0)])
+    (1.0, 7.0, 15, 1, 1, 2)
+    """
+
+    results = list(results)
+    if not results:
+        now = time.time()
+        return now, now, 0, 0, 0, 0
+    return (
+        min(r[0] for r in results),
+        max(r[1] for r in results),
+        sum(r[2] for r in results),
+        sum(r[3] for r in results),
+        sum(r[4] for r in results),
+        sum(r[5] for r in results),
+    )
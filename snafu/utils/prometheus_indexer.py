@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Collect and index Prometheus data in the background while the benchmark moves on.
+
+Benchmarks request Prometheus data with a ``get_prometheus_trigger`` document at the end of each job or
+sample. Querying Prometheus and indexing its metrics can take a while, so triggers are handed to a
+single background worker which feeds the resulting documents into one indexing pipeline for the whole
+run. The pipeline is only drained when the indexer is closed at shutdown.
+
+In summary mode, triggers are processed right away instead, since the summaries of each sample are attached
+to the benchmark results of the sample before these are indexed.
+"""
+import concurrent.futures
+import logging
+from typing import Any, Callable, Dict, List
+
+from snafu.utils.get_prometheus_data import get_prometheus_data
+from snafu.utils.indexing_pipeline import BulkStats, IndexingPipeline
+
+logger = logging.getLogger("snafu")
+
+
+class PrometheusIndexer:
+    """
+    Index the Prometheus data of every trigger of a run through the given pipeline.
+
+    Parameters
+    ----------
+    pipeline : IndexingPipeline
+        Pipeline indexing into the Prometheus Elasticsearch server, started right away.
+    finalize : callable
+        Turns a Prometheus metric document into an Elasticsearch friendly document.
+    fetch : callable, optional
+        Takes a trigger and returns an object whose ``get_all_metrics`` method yields the metric documents,
+        defaults to :py:class:`~snafu.utils.get_prometheus_data.get_prometheus_data`.
+    """
+
+    def __init__(
+        self,
+        pipeline: IndexingPipeline,
+        finalize: Callable[[Dict[str, Any]], Dict[str, Any]],
+        fetch: Callable[[Dict[str, Any]], Any] = get_prometheus_data,
+    ):
+        self.pipeline = pipeline.start()
+        self._finalize = finalize
+        self._fetch = fetch
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="snafu-prometheus"
+        )
+        self._futures: List[concurrent.futures.Future] = []
+
+    def _index(self, trigger: Dict[str, Any]) -> None:
+        for metric in self._fetch(trigger).get_all_metrics():
+            self.pipeline.put(self._finalize(metric))
+
+    def submit(self, trigger: Dict[str, Any]) -> None:
+        """Collect and index the Prometheus data of the given trigger in the background."""
+        self._futures.append(self._executor.submit(self._index, trigger))
+
+    def summarize(self, trigger: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Collect the Prometheus summaries of the given trigger right away.
+
+        The per-series summary documents are indexed through the pipeline, the per-metric summaries are
+        returned so they can be attached to the benchmark results of the sample.
+        """
+
+        series_docs, metrics = self._fetch(trigger).get_summaries()
+        for summary in series_docs:
+            self.pipeline.put(self._finalize(summary))
+        return metrics
+
+    def close(self) -> BulkStats:
+        """Wait for every trigger to be processed, then flush the pipeline and return its statistics."""
+
+        logger.info(f"Waiting for the Prometheus data of {len(self._futures)} trigger(s)")
+        self._executor.shutdown(wait=True)
+        for future in self._futures:
+            err = future.exception()
+            if err is not None:
+                logger.error(f"Collecting Prometheus data failed: {err}")
+        return self.pipeline.close()
@@ -4,6 +4,8 @@ such opinions for creating templates (put_template()) and bulk indexing
 (streaming_bulk).
 """
 
+import heapq
+import itertools
 import json
 import logging
 import math
@@ -15,6 +17,8 @@ from elasticsearch import VERSION as es_VERSION
 from elasticsearch import exceptions as es_excs
 from elasticsearch import helpers
 
+from snafu.utils.adaptive_bulk import AdaptiveBulkController, adaptive_parallel_bulk
+
 _es_logger = "elasticsearch"
 
 logger = logging.getLogger("snafu")
@@ -34,6 +38,16 @@ _op_type = "create"
 # can add undue burden to the Elasticsearch cluster.
 
 _request_timeout = 100000 * 60.0
+# Upper bound of the serialized documents held in memory, either as part of
+# bulk requests or waiting to be retried.
+_MAX_INFLIGHT_BYTES = 200 * 1024 * 1024
+# Largest bulk request sent to Elasticsearch.
+_MAX_CHUNK_BYTES = 104857600
+# Settings of the parallel bulk indexer.
+_PARALLEL_THREAD_COUNT = 8
+_PARALLEL_QUEUE_SIZE = 4
+# Maximum number of concurrent requests of the adaptive parallel bulk indexer.
+_PARALLEL_MAX_WORKERS = 16
 
 
 def _tstos(ts=None):
@@ -46,6 +60,20 @@ def _calc_backoff_sleep(backoff):
     return _r.uniform(0, min(b, _MAX_SLEEP_TIME))
 
 
+def action_size(action):
+    """
+    action_size(action)
+    Arguments:
+        action - An Elasticsearch friendly document
+    Returns:
+        The size in bytes of the action's serialized "_source".
+    """
+    source = action.get("_source", action)
+    if isinstance(source, str):
+        return len(source)
+    return len(json.dumps(source, default=str))
+
+
 def quiet_loggers():
     """
     A convenience function to quiet the urllib3 and elasticsearch1 loggers.
@@ -92,16 +120,50 @@ def put_template(es, name, body):
     return beg, end, retry_count
 
 
-def streaming_bulk(es, actions, parallel=False):
+def _chunk_bytes_budget(max_inflight_bytes, parallel):
+    # Half of the in-flight budget goes to chunks being built or sent, the
+    # other half to documents waiting to be retried.
+    budget = max_inflight_bytes // 2
+    if parallel:
+        budget //= _PARALLEL_THREAD_COUNT + _PARALLEL_QUEUE_SIZE
+    return max(1, min(_MAX_CHUNK_BYTES, budget))
+
+
+def streaming_bulk(
+    es,
+    actions,
+    parallel=False,
+    max_attempts=None,
+    retry_deadline=None,
+    dead_letter_file=None,
+    max_inflight_bytes=_MAX_INFLIGHT_BYTES,
+    adaptive=False,
+    seen_ids=None,
+):
     """
     streaming_bulk(es, actions)
     Arguments:
         es - An Elasticsearch client object already constructed
         actions - An iterable for the documents to be indexed
+        parallel - Use the parallel bulk indexer
+        max_attempts - Maximum number of times a document is sent before
+            giving up on it, or None to retry forever
+        retry_deadline - Maximum number of seconds since a document was
+            first sent after which it is no longer retried, or None
+        dead_letter_file - Path of an NDJSON file to which documents that
+            were given up on are appended, one action per line
+        max_inflight_bytes - Approximate upper bound on the serialized size
+            of the documents being sent or waiting to be retried
+        adaptive - With parallel, adjust the bulk chunk size and number of
+            concurrent requests to the latency and rejections of the cluster
+        seen_ids - A set of already acknowledged document ids, such as
+            snafu.utils.dedup_filter.AcknowledgedIds; documents found in it
+            are counted as duplicates without being sent, and documents
+            acknowledged by Elasticsearch are added to it
     Returns:
         A tuple with the start and end times, the # of successfully indexed,
-        duplicate, and failed documents, along with number of times a bulk
-        request was retried.
+        duplicate, and failed documents, along with number of times a
+        document was retried.
     """
 
     # These need to be defined before the closure below. These work because
@@ -111,8 +173,31 @@ def streaming_bulk(es, actions, parallel=False):
     # scope's view of the name.  By using a Counter object, the name to
     # object binding is maintained, but the object contents are changed.
     actions_deque = deque()
-    actions_retry_deque = deque()
+    # Min-heap of (next attempt time, sequence, retry count, first attempt
+    # time, size, action), the sequence number breaks ties between actions.
+    retry_heap = []
     retries_tracker = Counter()
+    retry_bytes_budget = max_inflight_bytes - max_inflight_bytes // 2
+
+    def send(retry_count, first_ts, size, cl_action):
+        actions_deque.append((retry_count, first_ts, size, cl_action))  # Append to the right side ...
+        return cl_action
+
+    def due_retries(block):
+        # Yield the retries whose backoff has expired. When blocking, wait
+        # for the next retry instead of returning early.
+        while len(retry_heap) > 0:
+            next_ts = retry_heap[0][0]
+            now = time.time()
+            if next_ts > now:
+                if not block:
+                    return
+                time.sleep(next_ts - now)
+            _, _, retry_count, first_ts, size, retry_action = heapq.heappop(retry_heap)
+            retries_tracker["retry_bytes"] -= size
+            retries_tracker["retries"] += 1
+            yield send(retry_count, first_ts, size, retry_action)
+            block = block and retries_tracker["retry_bytes"] > retry_bytes_budget
 
     def actions_tracking_closure(cl_actions):
         for cl_action in cl_actions:
@@ -120,99 +205,153 @@ def streaming_bulk(es, actions, parallel=False):
             assert "_index" in cl_action
             assert _op_type == cl_action["_op_type"]
 
-            actions_deque.append((0, cl_action))  # Append to the right side ...
-            yield cl_action
-            # if after yielding an action some actions appear on the retry deque
-            # start yielding those actions until we drain the retry queue.
-            backoff = 1
-            while len(actions_retry_deque) > 0:
-                time.sleep(_calc_backoff_sleep(backoff))
-                retries_tracker["retries"] += 1
-                retry_actions = []
-                # First drain, the retry deque entirely so that we know when we
-                # have cycled through the entire list to be retried.
-                while len(actions_retry_deque) > 0:
-                    retry_actions.append(actions_retry_deque.popleft())
-                for retry_count, retry_action in retry_actions:
-                    actions_deque.append((retry_count, retry_action))  # Append to the right side ...
-
-                    yield retry_action
-                # if after yielding all the actions to be retried, some show up
-                # on the retry deque again, we extend our sleep backoff to avoid
-                # pounding on the ES instance.
-                backoff += 1
+            if seen_ids is not None and cl_action["_id"] in seen_ids:
+                # Elasticsearch would reject it with a 409 anyway.
+                retries_tracker["known_duplicates"] += 1
+                continue
+
+            # Retries are sent as soon as their backoff expires, fresh
+            # documents keep flowing in the meantime unless the retries
+            # waiting in memory exceed their share of the byte budget.
+            yield from due_retries(retries_tracker["retry_bytes"] > retry_bytes_budget)
+            yield send(0, time.time(), action_size(cl_action), cl_action)
+        # Once the source is exhausted there is nothing else to send, so wait
+        # for the remaining retries.
+        yield from due_retries(True)
+
+    def give_up(retry_count, action, status):
+        failures_tracker["failures"] += 1
+        logger.error(
+            "Giving up on document %s after %d attempts, last status %s"
+            % (action["_id"], retry_count + 1, status)
+        )
+        if dead_letter_file:
+            with open(dead_letter_file, "a") as dead_letter_fp:
+                dead_letter_fp.write(json.dumps(action, default=str) + "\n")
+
+    def schedule_retry(retry_count, first_ts, size, action, status):
+        now = time.time()
+        attempts = retry_count + 1
+        if (max_attempts is not None and attempts >= max_attempts) or (
+            retry_deadline is not None and now - first_ts >= retry_deadline
+        ):
+            give_up(retry_count, action, status)
+            return
+        retries_tracker["retry_bytes"] += size
+        next_ts = now + _calc_backoff_sleep(attempts)
+        heapq.heappush(retry_heap, (next_ts, next(sequence), attempts, first_ts, size, action))
 
     beg, end = time.time(), None
     successes = 0
     duplicates = 0
-    failures = 0
+    failures_tracker = Counter()
+    sequence = itertools.count()
+    chunk_bytes = _chunk_bytes_budget(max_inflight_bytes, parallel)
 
-    # Create the generator that closes over the external generator, "actions"
-    generator = actions_tracking_closure(actions)
-
-    if parallel:
-        logger.info("Using parallel bulk indexer")
-        streaming_bulk_generator = helpers.parallel_bulk(
-            es,
-            generator,
-            chunk_size=10000000,
-            max_chunk_bytes=104857600,
-            thread_count=8,
-            queue_size=4,
-            raise_on_error=False,
-            raise_on_exception=False,
-            request_timeout=_request_timeout,
+    if parallel and adaptive:
+        logger.info("Using adaptive parallel bulk indexer")
+        # Stay within the in-flight budget even at maximum concurrency.
+        controller = AdaptiveBulkController(
+            chunk_bytes=min(5 * 1024 * 1024, chunk_bytes),
+            max_chunk_bytes=_chunk_bytes_budget(max_inflight_bytes, False) // _PARALLEL_MAX_WORKERS,
+            max_workers=_PARALLEL_MAX_WORKERS,
         )
+    elif parallel:
+        logger.info("Using parallel bulk indexer")
     else:
         logger.info("Using streaming bulk indexer")
-        streaming_bulk_generator = helpers.streaming_bulk(
-            es, generator, raise_on_error=False, raise_on_exception=False, request_timeout=_request_timeout
-        )
 
-    for ok, resp_payload in streaming_bulk_generator:
-        retry_count, action = actions_deque.popleft()
-        try:
-            resp = resp_payload[_op_type]
-            status = resp["status"]
-        except KeyError as e:
-            logger.error(e)
-            assert not ok
-            # resp is not of expected form
-            logger.warn(resp)
-
-            status = 999
-        else:
-            assert action["_id"] == resp["_id"]
-        if ok:
-            successes += 1
+    pending_actions = actions
+    while True:
+        # Create the generator that closes over the external generator, "actions"
+        generator = actions_tracking_closure(pending_actions)
+
+        if parallel and adaptive:
+            streaming_bulk_generator = adaptive_parallel_bulk(
+                es, generator, controller, request_timeout=_request_timeout
+            )
+        elif parallel:
+            streaming_bulk_generator = helpers.parallel_bulk(
+                es,
+                generator,
+                chunk_size=10000000,
+                max_chunk_bytes=chunk_bytes,
+                thread_count=_PARALLEL_THREAD_COUNT,
+                queue_size=_PARALLEL_QUEUE_SIZE,
+                raise_on_error=False,
+                raise_on_exception=False,
+                request_timeout=_request_timeout,
+            )
         else:
-            if status == 409:
-                if retry_count == 0:
-                    # Only count duplicates if the retry count is 0 ...
-                    duplicates += 1
-                else:
-                    # ... otherwise consider it successful.
-                    successes += 1
-            elif status == 400:
-                doc = {
-                    "action": action,
-                    "ok": ok,
-                    "resp": resp,
-                    "retry_count": retry_count,
-                    "timestamp": _tstos(time.time()),
-                }
-                jsonstr = json.dumps(doc, indent=4, sort_keys=True, default=str)
-                print(jsonstr)
-                # errorsfp.flush()
-                failures += 1
+            streaming_bulk_generator = helpers.streaming_bulk(
+                es,
+                generator,
+                max_chunk_bytes=chunk_bytes,
+                raise_on_error=False,
+                raise_on_exception=False,
+                request_timeout=_request_timeout,
+            )
+
+        for ok, resp_payload in streaming_bulk_generator:
+            retry_count, first_ts, size, action = actions_deque.popleft()
+            try:
+                resp = resp_payload[_op_type]
+                status = resp["status"]
+            except KeyError as e:
+                logger.error(e)
+                assert not ok
+                # resp is not of expected form
+                logger.warn(resp)
+
+                status = 999
+            else:
+                assert action["_id"] == resp["_id"]
+            if ok:
+                successes += 1
+                if seen_ids is not None:
+                    seen_ids.add(action["_id"])
             else:
-                # Retry all other errors
-                print(resp)
-                actions_retry_deque.append((retry_count + 1, action))
+                if status == 409:
+                    if seen_ids is not None:
+                        seen_ids.add(action["_id"])
+                    if retry_count == 0:
+                        # Only count duplicates if the retry count is 0 ...
+                        duplicates += 1
+                    else:
+                        # ... otherwise consider it successful.
+                        successes += 1
+                elif status == 400:
+                    doc = {
+                        "action": action,
+                        "ok": ok,
+                        "resp": resp,
+                        "retry_count": retry_count,
+                        "timestamp": _tstos(time.time()),
+                    }
+                    jsonstr = json.dumps(doc, indent=4, sort_keys=True, default=str)
+                    print(jsonstr)
+                    # errorsfp.flush()
+                    failures_tracker["failures"] += 1
+                else:
+                    # Retry all other errors
+                    print(resp)
+                    schedule_retry(retry_count, first_ts, size, action, status)
+
+        # Documents in the last chunk can fail after the generator has been
+        # exhausted, so keep going until nothing is left to retry.
+        if len(retry_heap) == 0:
+            break
+        pending_actions = ()
 
     end = time.time()
 
+    if parallel and adaptive:
+        controller.log_summary()
+
     assert len(actions_deque) == 0
-    assert len(actions_retry_deque) == 0
+    assert len(retry_heap) == 0
 
-    return (beg, end, successes, duplicates, failures, retries_tracker["retries"])
+    if retries_tracker["known_duplicates"] > 0:
+        logger.info("Skipped %d already indexed documents" % retries_tracker["known_duplicates"])
+    duplicates += retries_tracker["known_duplicates"]
+    return (beg, end, successes, duplicates, failures_tracker["failures"], retries_tracker["retries"])
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of query results, bounded in size with least recently used eviction.
+
+Results are stored as gzip compressed JSON files, one per key, under the cache directory. Reading an entry
+refreshes its modification time, which is what eviction goes by once the total size of the entries goes
+past the configured maximum.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Optional
+
+logger = logging.getLogger("snafu")
+
+_SUFFIX = ".json.gz"
+
+
+class QueryCache:
+    """
+    Thread-safe on-disk cache of JSON serializable query results.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the cache entries, created if missing.
+    max_bytes : int, optional
+        Maximum total size of the compressed entries, the least recently used ones are evicted past it.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> cache = QueryCache(tempfile.mkdtemp())
+    >>> key = QueryCache.key("http://prometheus:9090", "up", 0, 60, "30s")
+    >>> cache.get(key) is None
+    True
+    >>> cache.put(key, [{"metric": {}, "values": [[0, "1"]]}])
+    >>> cache.get(key)
+    [{'metric': {}, 'values': [[0, '1']]}]
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.size = sum(entry.stat().st_size for entry in self._entries())
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Return the cache key of the given query parameters."""
+        return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def _entries(self):
+        return (entry for entry in os.scandir(self.directory) if entry.name.endswith(_SUFFIX))
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached result of the given key, or ``None`` if there is none."""
+
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt") as entry:
+                value = json.load(entry)
+            os.utime(path)
+        except (OSError, ValueError):
+            # missing, evicted meanwhile or truncated
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """Store the given result, then evict the least recently used entries if the cache is too big."""
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as entry:
+            entry.write(json.dumps(value).encode())
+        path = self._path(key)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self.size += os.path.getsize(path) - previous
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        evicted = 0
+        # always keep the newest entry, even when it's bigger than the cache on its own
+        for entry in entries[:-1]:
+            if self.size <= self.max_bytes:
+                break
+            self.size -= entry.stat().st_size
+            os.remove(entry.path)
+            evicted += 1
+        logger.debug(f"Evicted {evicted} entries from query cache {self.directory}")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact representation of high frequency time series results.
+
+Instead of one document per point, each carrying the full static context of the run, the context is
+written once as a manifest document and the points are grouped into batch documents holding one array per
+field. Batch documents reference their manifest through its ``manifest_id``.
+"""
+from typing import Any, Dict, Iterable, Iterator, Mapping
+
+from snafu.utils.documents import document_id, serialize_source
+
+
+def manifest_document(context: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Return the manifest document of the given static context, with its ``manifest_id`` added.
+
+    The id is derived from the content of the context, so the same context always gets the same id.
+
+    Examples
+    --------
+    >>> manifest = manifest_document({"uuid": "1234", "sample": 1})
+    >>> manifest["manifest_id"] == manifest_document({"sample": 1, "uuid": "1234"})["manifest_id"]
+    True
+    """
+
+    manifest = dict(context)
+    manifest["manifest_id"] = document_id(serialize_source(manifest))
+    return manifest
+
+
+def compact_series(
+    manifest_id: str,
+    series: Mapping[str, Any],
+    points: Iterable[Mapping[str, Any]],
+    batch_points: int,
+    time_field: str = "timestamp",
+) -> Iterator[Dict[str, Any]]:
+    """
+    Group the points of a time series into documents of up to ``batch_points`` points.
+
+    Parameters
+    ----------
+    manifest_id : str
+        Id of the manifest holding the static context of the series.
+    series : dict
+        Fields identifying the series within the manifest, copied into every batch document.
+    points : iterable of dict
+        Points of the series in time order, all with the same fields.
+    batch_points : int
+        Maximum number of points per document.
+    time_field : str, optional
+        Field of the points holding their time, its first and last values are stored as ``start`` and
+        ``end`` of each batch.
+
+    Examples
+    --------
+    >>> points = [{"timestamp": ts, "iops": ts * 10} for ts in range(5)]
+    >>> batches = list(compact_series("abc", {"host": "h1"}, points, 3))
+    >>> batches[1]["host"], batches[1]["start"], batches[1]["end"], batches[1]["iops"]
+    ('h1', 3, 4, [30, 40])
+    """
+
+    if batch_points < 1:
+        raise ValueError("Compact time series need at least one point per batch")
+
+    def make_batch(num, columns):
+        count = len(columns[time_field])
+        document = {"manifest_id": manifest_id, **series, "batch": num, "count": count}
+        document.update(start=columns[time_field][0], end=columns[time_field][-1])
+        document.update(columns)
+        return document
+
+    columns: Dict[str, list] = {}
+    num = 0
+    for point in points:
+        if not columns:
+            columns = {field: [] for field in point}
+        for field, value in point.items():
+            columns[field].append(value)
+        if len(columns[time_field]) >= batch_points:
+            yield make_batch(num, columns)
+            columns = {}
+            num += 1
+    if columns:
+        yield make_batch(num, columns)
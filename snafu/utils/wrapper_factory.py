@@ -1,56 +1,53 @@
+import importlib
 import logging
 
-from snafu.cyclictest_wrapper.cyclictest_wrapper import cyclictest_wrapper
-from snafu.dns_perf_wrapper.dns_perf_wrapper import dns_perf_wrapper
-from snafu.fio_wrapper.fio_wrapper import fio_wrapper
-from snafu.flent_wrapper.flent_wrapper import flent_wrapper
-from snafu.fs_drift_wrapper.fs_drift_wrapper import fs_drift_wrapper
-from snafu.hammerdb.hammerdb_wrapper import hammerdb_wrapper
-from snafu.image_pull_wrapper.image_pull_wrapper import image_pull_wrapper
-from snafu.log_generator_wrapper.log_generator_wrapper import log_generator_wrapper
-from snafu.oslat_wrapper.oslat_wrapper import oslat_wrapper
-from snafu.pgbench_wrapper.pgbench_wrapper import pgbench_wrapper
+from snafu import benchmarks
 from snafu.registry import TOOLS
-from snafu.scale_openshift_wrapper.scale_openshift_wrapper import scale_openshift_wrapper
-from snafu.smallfile_wrapper.smallfile_wrapper import smallfile_wrapper
-from snafu.stressng_wrapper.stressng_wrapper import stressng_wrapper
-from snafu.sysbench.sysbench_wrapper import sysbench_wrapper
-from snafu.trex_wrapper.trex_wrapper import trex_wrapper
-from snafu.upgrade_openshift_wrapper.upgrade_openshift_wrapper import upgrade_openshift_wrapper
-from snafu.vegeta_wrapper.vegeta_wrapper import vegeta_wrapper
-from snafu.ycsb_wrapper.ycsb_wrapper import ycsb_wrapper
 
 logger = logging.getLogger("snafu")
 
+# legacy wrappers are imported only once selected, as their dependencies (kubernetes, kafka, boto3,
+# redis, ...) are slow to import and not always installed
 wrapper_dict = {
-    "fio": fio_wrapper,
-    "smallfile": smallfile_wrapper,
-    "fs-drift": fs_drift_wrapper,
-    "hammerdb": hammerdb_wrapper,
-    "ycsb": ycsb_wrapper,
-    "pgbench": pgbench_wrapper,
-    "vegeta": vegeta_wrapper,
-    "scale": scale_openshift_wrapper,
-    "stressng": stressng_wrapper,
-    "upgrade": upgrade_openshift_wrapper,
-    "cyclictest": cyclictest_wrapper,
-    "oslat": oslat_wrapper,
-    "trex": trex_wrapper,
-    "flent": flent_wrapper,
-    "log_generator": log_generator_wrapper,
-    "image_pull": image_pull_wrapper,
-    "sysbench": sysbench_wrapper,
-    "dns_perf": dns_perf_wrapper,
+    "fio": "snafu.fio_wrapper.fio_wrapper:fio_wrapper",
+    "smallfile": "snafu.smallfile_wrapper.smallfile_wrapper:smallfile_wrapper",
+    "fs-drift": "snafu.fs_drift_wrapper.fs_drift_wrapper:fs_drift_wrapper",
+    "hammerdb": "snafu.hammerdb.hammerdb_wrapper:hammerdb_wrapper",
+    "ycsb": "snafu.ycsb_wrapper.ycsb_wrapper:ycsb_wrapper",
+    "pgbench": "snafu.pgbench_wrapper.pgbench_wrapper:pgbench_wrapper",
+    "vegeta": "snafu.vegeta_wrapper.vegeta_wrapper:vegeta_wrapper",
+    "scale": "snafu.scale_openshift_wrapper.scale_openshift_wrapper:scale_openshift_wrapper",
+    "stressng": "snafu.stressng_wrapper.stressng_wrapper:stressng_wrapper",
+    "upgrade": "snafu.upgrade_openshift_wrapper.upgrade_openshift_wrapper:upgrade_openshift_wrapper",
+    "cyclictest": "snafu.cyclictest_wrapper.cyclictest_wrapper:cyclictest_wrapper",
+    "oslat": "snafu.oslat_wrapper.oslat_wrapper:oslat_wrapper",
+    "trex": "snafu.trex_wrapper.trex_wrapper:trex_wrapper",
+    "flent": "snafu.flent_wrapper.flent_wrapper:flent_wrapper",
+    "log_generator": "snafu.log_generator_wrapper.log_generator_wrapper:log_generator_wrapper",
+    "image_pull": "snafu.image_pull_wrapper.image_pull_wrapper:image_pull_wrapper",
+    "sysbench": "snafu.sysbench.sysbench_wrapper:sysbench_wrapper",
+    "dns_perf": "snafu.dns_perf_wrapper.dns_perf_wrapper:dns_perf_wrapper",
 }
 
 
+def import_wrapper(tool_name):
+    """Import and return the legacy wrapper class of the given tool, ``None`` if there is none."""
+
+    if tool_name not in wrapper_dict:
+        return None
+    module_name, class_name = wrapper_dict[tool_name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
 def wrapper_factory(tool_name, parser):
     logger.debug("looking for %s" % tool_name)
+    if tool_name in benchmarks.BENCHMARK_MODULES:
+        benchmarks.load_benchmarks([benchmarks.BENCHMARK_MODULES[tool_name]])
     if TOOLS.get(tool_name, None) is not None:
         wrapper = TOOLS[tool_name]
         wrapper_obj = wrapper()
-    elif wrapper_dict.get(tool_name, None) is not None:
-        wrapper = wrapper_dict[tool_name]
+    elif tool_name in wrapper_dict:
+        wrapper = import_wrapper(tool_name)
         wrapper_obj = wrapper(parser)
     else:
         wrapper = None
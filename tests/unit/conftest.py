@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Fixtures shared by the unit tests."""
+import pytest
+
+from snafu import run_snafu
+from snafu.benchmarks.uperf.uperf import Uperf
+
+# arguments uperf requires, tests add their own after them
+UPERF_ARGS = ("--workload", "uperf.xml", "--sample", "1", "--resourcetype", "pod")
+
+
+@pytest.fixture
+def make_benchmark():
+    """
+    Return a factory of benchmarks configured from the given command line arguments.
+
+    The argument parser is a global shared by every test, so it is reset before the benchmark is built and
+    after the test, so that every benchmark gets the defaults of its own arguments.
+    """
+
+    def factory(benchmark_cls, *args):
+        run_snafu.reset_argument_parser()
+        benchmark = benchmark_cls()
+        benchmark.config.parse_args(["--uuid", "1234", "--user", "snafu"] + list(args))
+        return benchmark
+
+    yield factory
+    run_snafu.reset_argument_parser()
+
+
+@pytest.fixture
+def make_uperf(make_benchmark):
+    """Return a factory of uperf benchmarks, given the command line arguments besides the required ones."""
+    return lambda *args: make_benchmark(Uperf, *UPERF_ARGS, *args)
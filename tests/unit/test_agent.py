@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the resident agent running snafu jobs."""
+import json
+import os
+import socket
+import threading
+import time
+
+from snafu import run_snafu
+from snafu.agent import Agent
+from snafu.utils.archive import read_archive_lines
+from snafu.utils.documents import archive_line, finalize_document
+
+
+def sleepy_job(tool, args, env):
+    """Job sleeping for the time given as its first argument, reporting when and where it ran."""
+
+    beg = time.time()
+    time.sleep(float(args[0]))
+    counters = {"pid": os.getpid(), "beg": beg, "end": time.time(), "env": env}
+    return {"rc": 0 if tool == "sleep" else 2, "error": None, "counters": counters}
+
+
+def test_agent_runs_jobs_concurrently_up_to_the_limit():
+    """Test that jobs are queued, run on at most max_jobs reused workers, and report their counters."""
+
+    responses = []
+    agent = Agent(sleepy_job, max_jobs=2)
+    lines = [json.dumps({"id": f"job{num}", "tool": "sleep", "args": ["0.3"]}) for num in range(4)]
+    lines += [
+        "",
+        "not json",
+        json.dumps({"id": "bad", "args": []}),
+        json.dumps({"tool": "fail", "args": ["0"]}),
+    ]
+    lines.append(json.dumps({"tool": "sleep", "args": ["0"], "env": {"es": "http://es:9200"}}))
+    pending = agent.serve(lines, responses.append)
+    agent.close()
+
+    assert len(pending) == 6
+    events = [(response["id"], response["event"]) for response in responses]
+    assert events[:4] == [(f"job{num}", "queued") for num in range(4)]
+    assert (None, "error") in events and ("bad", "error") in events
+    finished = {response["id"]: response for response in responses if response["event"] == "finished"}
+    assert sorted(finished) == ["job-1", "job-2", "job0", "job1", "job2", "job3"]
+    assert finished["job-1"]["rc"] == 2 and finished["job-1"]["tool"] == "fail"
+    assert finished["job-2"]["counters"]["env"] == {"es": "http://es:9200"}
+    sleeps = sorted(
+        (finished[f"job{num}"]["counters"] for num in range(4)), key=lambda counters: counters["beg"]
+    )
+    assert len({counters["pid"] for counters in sleeps}) == 2
+    # the third job had to wait for one of the first two
+    assert sleeps[2]["beg"] >= min(sleeps[0]["end"], sleeps[1]["end"]) - 0.01
+
+
+def test_agent_answers_each_socket_connection(tmpdir):
+    """Test that jobs sent over the Unix socket get their events back on the same connection."""
+
+    path = str(tmpdir.join("agent.sock"))
+    agent = Agent(sleepy_job, max_jobs=1)
+    server = threading.Thread(target=agent.serve_socket, args=(path,))
+    server.start()
+    for _ in range(50):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall(
+            b'{"id": "a", "tool": "sleep", "args": ["0.2"]}\n{"id": "b", "tool": "sleep", "args": ["0"]}\n'
+        )
+        # stop sending, the agent keeps the connection until both jobs are done
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile("r") as reader:
+            responses = [json.loads(line) for line in reader]
+    agent.close()
+    server.join()
+
+    assert [(response["id"], response["event"]) for response in responses] == [
+        ("a", "queued"),
+        ("b", "queued"),
+        ("a", "finished"),
+        ("b", "finished"),
+    ]
+    assert not os.path.exists(path)
+
+
+def test_agent_job_runs_snafu_with_its_own_arguments_and_environment(tmpdir, monkeypatch):
+    """Test that jobs run one after the other in the same process each parse their own arguments."""
+
+    monkeypatch.delenv("es", raising=False)
+    archive = tmpdir.join("results.archive")
+    archive.write(
+        "".join(
+            archive_line(finalize_document({"value": value}, "snafu-test-results", "NA")) + "\n"
+            for value in range(3)
+        )
+    )
+    argv = list(run_snafu.sys.argv)
+    for num in range(2):
+        export_dir = tmpdir.join(f"export{num}")
+        result = run_snafu.run_agent_job(
+            "archive",
+            ["--archive-file", str(archive), "--export", f"ndjson:{export_dir}"],
+            {"snafu_agent_test": str(num)},
+        )
+        assert result["rc"] == 0, result["error"]
+        assert result["counters"]["documents"] == 3
+        assert result["counters"]["indexed"] is False
+        exported = [line for path in export_dir.listdir() for line in read_archive_lines(str(path))]
+        assert len(exported) == 3
+    assert run_snafu.sys.argv == argv
+    assert "snafu_agent_test" not in os.environ
+
+    result = run_snafu.run_agent_job("archive", [], {})
+    assert result["rc"] == 1
+
+
+def suite_job_documents(invocation, run_id):
+    """Documents of a suite invocation, giving the process it ran in."""
+
+    for num in range(2):
+        yield finalize_document({"num": num, "pid": os.getpid()}, f"snafu-{invocation.tool}-results", run_id)
+
+
+def test_agent_runs_suite_jobs_which_start_processes(tmpdir, monkeypatch):
+    """Test that a suite job, whose invocations run in processes of their own, runs on an agent worker."""
+
+    monkeypatch.delenv("es", raising=False)
+    monkeypatch.setattr(run_snafu, "suite_documents", suite_job_documents)
+    suite = tmpdir.join("suite.yml")
+    suite.write("- {tool: first}\n- {tool: second}\n")
+    export_dir = tmpdir.join("export")
+    responses = []
+    agent = Agent(run_snafu.run_agent_job, max_jobs=1)
+    request = {
+        "id": "suite",
+        "tool": "suite",
+        "args": ["--suite", str(suite), "--export", f"ndjson:{export_dir}"],
+    }
+    agent.serve([json.dumps(request)], responses.append)
+    agent.close()
+
+    finished = responses[-1]
+    assert (finished["event"], finished["rc"]) == ("finished", 0), finished["error"]
+    assert finished["counters"]["documents"] == 5
+    exported = [json.loads(line) for path in export_dir.listdir() for line in read_archive_lines(str(path))]
+    assert [document["_index"] for document in exported] == [
+        "snafu-first-results",
+        "snafu-first-results",
+        "snafu-second-results",
+        "snafu-second-results",
+        "snafu-suite-suite-summary",
+    ]
+    pids = {document["_source"]["pid"] for document in exported[:-1]}
+    assert len(pids) == 2 and os.getpid() not in pids
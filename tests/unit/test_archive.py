@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test functionality in the archive module."""
+import gzip
+import json
+
+import pytest
+
+from snafu import run_snafu
+from snafu.utils import archive
+from snafu.utils.documents import finalize_document
+
+
+def _docs(num, index="snafu-test-results"):
+    return [finalize_document({"value": i, "pad": "x" * 50}, index, "NA") for i in range(num)]
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_archive_writer_round_trips_documents(tmpdir, compression):
+    """Test that documents written to an archive read back in order, whatever the compression."""
+
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    path = str(tmpdir.join("run.archive"))
+    docs = _docs(100)
+    with archive.ArchiveWriter(path, compression=compression, buffer_bytes=512) as writer:
+        for doc in docs:
+            writer.write(doc)
+
+    lines = list(archive.read_archive_lines(path))
+    assert [json.loads(line)["_id"] for line in lines] == [doc["_id"] for doc in docs]
+    assert json.loads(lines[0])["_source"] == {"value": 0, "pad": "x" * 50, "run_id": "NA"}
+
+
+def test_archive_writer_rotates_parts_and_writes_footers(tmpdir):
+    """Test that parts are rotated by size and each ends with a footer counting its documents."""
+
+    path = str(tmpdir.join("run.archive"))
+    with archive.ArchiveWriter(path, compression="gzip", rotate_bytes=2000) as writer:
+        for doc in _docs(30) + _docs(10, index="snafu-test-log"):
+            writer.write(doc)
+
+    parts = archive.archive_parts(path + ".gz")
+    assert len(parts) > 1
+    assert parts[1] == str(tmpdir.join("run.archive.1.gz"))
+
+    total = 0
+    indices = {}
+    for part in parts:
+        with gzip.open(part, "rt") as part_file:
+            lines = part_file.read().splitlines()
+        footer = json.loads(lines[-1])[archive.FOOTER_KEY]
+        assert footer["documents"] == len(lines) - 1
+        total += footer["documents"]
+        for index, count in footer["indices"].items():
+            indices[index] = indices.get(index, 0) + count
+    assert total == 40
+    assert indices == {"snafu-test-results": 30, "snafu-test-log": 10}
+    assert len(list(archive.read_archive_lines(path))) == 40
+
+
+def test_read_archive_lines_reads_legacy_archives(tmpdir):
+    """Test that plain archives without footers, as written by older versions, are still readable."""
+
+    legacy = tmpdir.join("legacy.archive")
+    legacy.write("".join(json.dumps({"_id": str(i), "_source": {}}) + "\n" for i in range(3)))
+    assert [json.loads(line)["_id"] for line in archive.read_archive_lines(str(legacy))] == ["0", "1", "2"]
+    with pytest.raises(FileNotFoundError):
+        list(archive.read_archive_lines(str(tmpdir.join("missing.archive"))))
+
+
+def test_failed_run_still_closes_its_archive(tmpdir, monkeypatch):
+    """Test that documents buffered by the archive writer are written out when the benchmark fails."""
+
+    def failing_generator(index_args, parser):
+        for value in range(3):
+            source = {"value": value, "user": "snafu", "clustername": "test", "uuid": "1234"}
+            yield run_snafu.get_valid_es_document(source, "results", index_args)
+        raise RuntimeError("benchmark failed")
+
+    monkeypatch.delenv("es", raising=False)
+    monkeypatch.setattr(run_snafu, "process_generator", failing_generator)
+    path = str(tmpdir.join("run.archive"))
+    result = run_snafu.run_agent_job(
+        "failing", ["--create-archive", "--archive-file", path, "--archive-compression", "gzip"], {}
+    )
+    assert result["rc"] == 1 and "benchmark failed" in result["error"]
+    # the gzip stream is complete, so it reads back without errors
+    with gzip.open(archive.archive_parts(path)[0], "rt") as archive_file:
+        archive_file.read()
+    lines = [json.loads(line) for line in archive.read_archive_lines(path)]
+    assert [line["_source"]["value"] for line in lines] == [0, 1, 2]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test functionality in the archive_replay module."""
+import collections
+import json
+import os
+
+import pytest
+
+from snafu.utils import archive, archive_replay
+from snafu.utils.dedup_filter import AcknowledgedIds
+from snafu.utils.documents import finalize_document
+
+
+def fake_es_factory(record_path):
+    """Stand-in Elasticsearch client: just the path of the file recording indexed ids."""
+    return record_path
+
+
+def recording_bulk(es, actions, parallel=False):  # pylint: disable=W0613
+    """Record the ids of the given actions, failing on document 150 while the fail marker exists."""
+
+    ids = [action["_id"] for action in actions]
+    if os.path.exists(es + ".fail") and "150" in ids:
+        raise RuntimeError("es went away")
+    with open(es, "a") as record:
+        record.write("".join(doc_id + "\n" for doc_id in ids))
+    return 0.0, 1.0, len(ids), 0, 0, 0
+
+
+def dedup_bulk(es, actions, parallel=False, seen_ids=None):  # pylint: disable=W0613
+    """Record the ids of the given actions that aren't known yet, adding them to the known ids."""
+
+    actions = [action for action in actions if action["_id"] not in seen_ids]
+    for action in actions:
+        seen_ids.add(action["_id"])
+    return recording_bulk(es, actions)
+
+
+def _write_archive(path, num, **kwargs):
+    with archive.ArchiveWriter(path, **kwargs) as writer:
+        for i in range(num):
+            doc = finalize_document({"value": i}, "snafu-test", "NA")
+            doc["_id"] = str(i)
+            writer.write(doc)
+
+
+def _recorded(record_path):
+    with open(record_path) as record:
+        return collections.Counter(record.read().split())
+
+
+def test_plan_shards_splits_plain_parts_on_line_boundaries(tmpdir):
+    """Test that shards cover the whole part, start on a new line and compressed parts aren't split."""
+
+    path = str(tmpdir.join("run.archive"))
+    _write_archive(path, 100)
+    shards = archive_replay.plan_shards(path, 4)
+    assert len(shards) == 4
+    assert shards[0].start == 0 and shards[-1].end == os.path.getsize(path)
+    with open(path, "rb") as part:
+        content = part.read()
+    for prev, shard in zip(shards, shards[1:]):
+        assert prev.end == shard.start
+        assert content[shard.start - 1 : shard.start] == b"\n"
+
+    _write_archive(str(tmpdir.join("gz.archive")), 10, compression="gzip")
+    assert len(archive_replay.plan_shards(str(tmpdir.join("gz.archive.gz")), 4)) == 1
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_replay_archive_resumes_from_checkpoint(tmpdir, compression):
+    """Test that an interrupted replay resumes without indexing acknowledged documents again."""
+
+    path = str(tmpdir.join("run.archive"))
+    _write_archive(path, 300, compression=compression, rotate_bytes=20000)
+    checkpoint = str(tmpdir.join("replay.checkpoint"))
+    record = str(tmpdir.join("record"))
+    kwargs = {"es_args": (record,), "batch_docs": 20, "es_factory": fake_es_factory, "bulk": recording_bulk}
+
+    open(record + ".fail", "w").close()
+    with pytest.raises(RuntimeError, match="es went away"):
+        archive_replay.replay_archive(path, checkpoint, workers=3, **kwargs)
+    with open(checkpoint) as checkpoint_file:
+        assert not all(shard["done"] for shard in json.load(checkpoint_file)["shards"].values())
+
+    indexed_before = sum(_recorded(record).values()) if os.path.exists(record) else 0
+    assert indexed_before < 300
+
+    os.remove(record + ".fail")
+    stats, document_bytes = archive_replay.replay_archive(path, checkpoint, workers=2, **kwargs)
+    recorded = _recorded(record)
+    assert sorted(recorded, key=int) == [str(i) for i in range(300)]
+    assert set(recorded.values()) == {1}
+    assert stats[2] == 300 - indexed_before
+    assert document_bytes > 0
+
+    # a finished replay doesn't index anything again
+    stats, _ = archive_replay.replay_archive(path, checkpoint, workers=3, **kwargs)
+    assert stats[2] == 0
+    assert sum(_recorded(record).values()) == 300
+
+
+def test_replay_archive_skips_known_ids_in_workers(tmpdir):
+    """Test that shard workers skip known documents and that the ids they indexed are added to the set."""
+
+    path = str(tmpdir.join("run.archive"))
+    _write_archive(path, 100)
+    record = str(tmpdir.join("record"))
+    ids = AcknowledgedIds(str(tmpdir.join("ids")), capacity=1000)
+    for i in range(50):
+        ids.add(str(i))
+
+    archive_replay.replay_archive(
+        path,
+        str(tmpdir.join("replay.checkpoint")),
+        workers=2,
+        es_args=(record,),
+        batch_docs=20,
+        es_factory=fake_es_factory,
+        bulk=dedup_bulk,
+        seen_ids=ids,
+    )
+    recorded = _recorded(record)
+    assert sorted(recorded, key=int) == [str(i) for i in range(50, 100)]
+    assert set(recorded.values()) == {1}
+    assert all(str(i) in ids for i in range(100))
+    # the set is writable again once the replay is done
+    ids.add("100")
+    assert "100" in ids
+    ids.close()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the results created by benchmarks."""
+import argparse
+
+import numpy as np
+import pytest
+
+from snafu import run_snafu
+from snafu.benchmarks import BenchmarkResultBatch
+
+
+@pytest.fixture
+def uperf(make_uperf):
+    """Uperf benchmark with metadata and labels set."""
+
+    return make_uperf("--labels", "team=perf")
+
+
+def test_batch_expands_to_the_docs_of_single_results(uperf):
+    """Test that a batch gives the same docs as creating one result per point, and a compact doc."""
+
+    config = {"protocol": "tcp", "message_size": 64}
+    columns = {"norm_ops": np.arange(1000), "uperf_ts": [f"ts{num}" for num in range(1000)]}
+    batch = uperf.create_new_batch(columns=columns, config=config, tag="results")
+    assert len(batch) == 1000
+
+    singles = [
+        uperf.create_new_result({"norm_ops": num, "uperf_ts": f"ts{num}"}, config, "results").to_jsonable()
+        for num in range(1000)
+    ]
+    expanded = list(batch.to_jsonables())
+    assert expanded == singles
+    assert [list(doc) for doc in expanded[:1]] == [list(doc) for doc in singles[:1]]
+    assert type(expanded[5]["norm_ops"]) is int
+
+    compact = batch.to_jsonable()
+    assert compact["count"] == 1000
+    assert compact["norm_ops"] == list(range(1000))
+    assert (compact["uuid"], compact["team"], compact["workload"]) == ("1234", "perf", "uperf")
+
+    with pytest.raises(ValueError):
+        BenchmarkResultBatch("uperf", {}, {}, {"a": [1], "b": [1, 2]}, {}, "results")
+
+
+def test_batches_feed_the_stopping_rule(uperf):
+    """Test that the values of the adaptive metric in a batch are used to decide on the next sample."""
+
+    params = uperf.config.params
+    params.adaptive_metric = "norm_ops"
+    params.adaptive_min_samples, params.adaptive_max_samples = 2, 3
+    params.adaptive_target_cv, params.adaptive_target_ci, params.adaptive_confidence = 0.05, None, 0.95
+    for _ in uperf.sample_process("true", shell=True, num_samples=1):
+        uperf.create_new_batch({"norm_ops": np.array([90, 110]), "host": ["a", "b"]}, {}, "results")
+    assert uperf.stopping_summary["values"] == [100.0, 100.0]
+    assert uperf.stopping_summary["reason"] == "cv"
+
+
+def test_run_snafu_indexes_batches_expanded_or_compact(uperf):
+    """Test that batches become one action per result, or a single action with --compact-batches."""
+
+    results = [
+        uperf.create_new_batch({"norm_ops": [1, 2, 3]}, {}, "results"),
+        uperf.create_new_batch({"norm_ops": []}, {}, "results"),
+        uperf.create_new_result({"average": 2}, {}, "summary"),
+    ]
+    expanded = list(run_snafu.benchmark_actions(argparse.Namespace(compact_batches=False), results))
+    assert [(action["norm_ops"], tag) for action, tag in expanded[:3]] == [
+        (1, "results"),
+        (2, "results"),
+        (3, "results"),
+    ]
+    assert expanded[3] == (results[2].to_jsonable(), "summary")
+
+    compact = list(run_snafu.benchmark_actions(argparse.Namespace(compact_batches=True), results))
+    assert [(action.get("count"), tag) for action, tag in compact] == [
+        (3, "results-batch"),
+        (None, "summary"),
+    ]
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test functionality in the dedup_filter module."""
+import os
+
+from snafu.utils.dedup_filter import AcknowledgedIds, BloomFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """Test that every added item is found and that few others are."""
+
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f"in-{i}")
+    assert all(f"in-{i}" in bloom for i in range(1000))
+    assert sum(f"out-{i}" in bloom for i in range(10000)) < 300
+
+
+def test_acknowledged_ids_persist_across_runs(tmpdir):
+    """Test that ids survive closing the set, with the saved Bloom filter or after a crash."""
+
+    seen_ids = AcknowledgedIds(str(tmpdir), capacity=100)
+    seen_ids.add("a")
+    seen_ids.add("a")
+    assert "a" in seen_ids and "b" not in seen_ids
+    seen_ids.close()
+
+    seen_ids = AcknowledgedIds(str(tmpdir), capacity=100)
+    assert "a" in seen_ids and len(seen_ids) == 1
+    seen_ids.add("b")
+    # simulate a crash: the Bloom filter isn't saved again and must be rebuilt from the exact set
+    seen_ids._db.close()  # pylint: disable=W0212
+
+    seen_ids = AcknowledgedIds(str(tmpdir), capacity=100)
+    assert "a" in seen_ids and "b" in seen_ids
+    seen_ids.close()
+
+
+def test_acknowledged_ids_are_kept_per_target(tmpdir):
+    """Test that different hosts and index prefixes get different sets."""
+
+    first = AcknowledgedIds.for_target(str(tmpdir), "http://es:9200", "snafu-fio")
+    second = AcknowledgedIds.for_target(str(tmpdir), "http://es:9200", "snafu-uperf")
+    first.add("a")
+    assert "a" not in second
+    assert first.directory != second.directory
+    assert os.path.dirname(first.directory) == str(tmpdir)
+    first.close()
+    second.close()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the canonical serialization of documents finalized for ES."""
+import datetime
+import json
+import uuid
+
+import numpy as np
+
+from snafu.utils.documents import archive_line, document_id, finalize_document, serialize_source
+
+
+def test_finalized_documents_have_a_pinned_canonical_source_and_id():
+    """Test that the serialization and _id of a document don't change, whatever the key order."""
+
+    source = {
+        "value": np.float64(1.5),
+        "count": np.int64(3),
+        "points": np.arange(3),
+        "date": datetime.datetime(2021, 1, 2, 3, 4, 5),
+        "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        "nested": {"b": None, "a": True},
+        "name": "café",
+    }
+    reordered = dict(reversed(list(source.items())))
+
+    document = finalize_document(source, "snafu-test-results", "run")
+    assert document["_source"] == (
+        '{"count":3,"date":"2021-01-02T03:04:05","name":"caf\\u00e9","nested":{"a":true,"b":null},'
+        '"points":[0,1,2],"run_id":"run","uuid":"12345678-1234-5678-1234-567812345678","value":1.5}'
+    )
+    assert document["_id"] == "73e3d6b8457ad91ace2e85a5de13886de270d1920a6b9e02fffc78bc14b22dc3"
+    assert document["_id"] == document_id(document["_source"])
+    assert finalize_document(reordered, "snafu-test-results", "run") == document
+    assert (document["_index"], document["_op_type"], document["run_id"]) == (
+        "snafu-test-results",
+        "create",
+        "run",
+    )
+    # ASCII only, so the length of the source is its size on the wire
+    assert len(document["_source"]) == len(document["_source"].encode())
+
+    line = json.loads(archive_line(document))
+    assert line["_source"] == json.loads(document["_source"])
+    assert serialize_source(line["_source"]) == document["_source"]
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test functionality in the exporters module."""
+import pytest
+
+from snafu.utils import exporters
+from snafu.utils.archive import read_archive_lines
+from snafu.utils.documents import finalize_document
+from snafu.utils.indexing_pipeline import IndexingPipeline
+
+pyarrow = pytest.importorskip("pyarrow")
+pytest.importorskip("pyarrow.parquet")
+
+
+def _documents():
+    yield finalize_document({"value": "mixed", "extra": {}}, "snafu-test-results", "NA")
+    for i in range(5):
+        yield finalize_document({"value": i, "config": {"size": "4k"}}, "snafu-test-results", "NA")
+    yield finalize_document({"latency": [1.5, 2.5]}, "snafu-test-summary", "NA")
+
+
+def test_ndjson_exporter_writes_batched_archive_files(tmpdir):
+    """Test that NDJSON exports are split into batches which can be read back as archives."""
+
+    exporter = exporters.NDJSONExporter(str(tmpdir), batch_docs=3)
+    (files,) = exporters.export_documents(_documents(), [exporter])
+    assert len(files) == 3
+    lines = [line for path in files for line in read_archive_lines(path)]
+    assert len(lines) == 7
+
+
+def test_parquet_exporter_partitions_by_index(tmpdir):
+    """Test that Parquet exports get one directory per index and keep every field."""
+
+    exporter = exporters.ParquetExporter(str(tmpdir), batch_docs=4)
+    (files,) = exporters.export_documents(_documents(), [exporter])
+    # later batches of an index are appended to the file of the first one
+    assert len(files) == 2
+    results = pyarrow.parquet.read_table(str(tmpdir.join("index=snafu-test-results"))).to_pylist()
+    assert len(results) == 6
+    # mixed types and empty objects fall back to JSON strings
+    assert sorted(row["value"] for row in results) == ['"mixed"', "0", "1", "2", "3", "4"]
+    assert results[-1]["config"] == {"size": "4k"}
+    summary = pyarrow.parquet.read_table(str(tmpdir.join("index=snafu-test-summary"))).to_pylist()
+    assert summary[0]["latency"] == [1.5, 2.5] and len(summary[0]["_id"]) == 64
+
+
+def test_export_documents_fans_out_to_every_sink(tmpdir):
+    """Test that Elasticsearch and file sinks all receive every document."""
+
+    def fake_bulk(es, actions, parallel=False):  # pylint: disable=W0613
+        return 0.0, 1.0, len(list(actions)), 0, 0, 0
+
+    sinks = [
+        exporters.ElasticsearchExporter(IndexingPipeline(None, bulk=fake_bulk)),
+        exporters.NDJSONExporter(str(tmpdir.join("ndjson"))),
+    ]
+    stats, files = exporters.export_documents(_documents(), sinks)
+    assert stats == (0.0, 1.0, 7, 0, 0, 0)
+    assert len(files) == 1
+
+
+def test_create_file_exporter_requires_a_directory():
+    """Test that export specifications without an output directory are rejected."""
+
+    with pytest.raises(ValueError):
+        exporters.create_file_exporter("ndjson")
+
+
+def test_parquet_exporter_starts_new_file_on_schema_change(tmpdir):
+    """Test that batches which don't fit the schema of the current file go to a new one."""
+
+    documents = [
+        finalize_document({"value": 1}, "snafu-test", "NA"),
+        finalize_document({"value": 1.5}, "snafu-test", "NA"),
+    ]
+    exporter = exporters.ParquetExporter(str(tmpdir), batch_docs=1)
+    (files,) = exporters.export_documents(documents, [exporter])
+    assert [pyarrow.parquet.read_table(path).column("value").to_pylist() for path in files] == [[1], [1.5]]
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test functionality in the get_prometheus_data module."""
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from snafu.utils import get_prometheus_data as prom
+
+LABELS_FILE = os.path.join(os.path.dirname(prom.__file__), "prometheus_labels", "included_labels.json")
+
+
+class FakePrometheusConnect:
+    """Answer range queries with one series of two points, slower for queries listed first."""
+
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+    stuck = ""
+
+    def __init__(self, *args, **kwargs):  # pylint: disable=W0613
+        self.queries = []
+
+    def custom_query_range(self, query, start, end, step, params=None, timeout=None):  # pylint: disable=W0613
+        """Return a fake series for the query, timing out on the stuck query."""
+
+        with self.lock:
+            type(self).active += 1
+            type(self).max_active = max(self.max_active, self.active)
+            position = len(self.queries)
+            self.queries.append(query)
+        try:
+            if query == self.stuck:
+                time.sleep(min(2, timeout))
+                raise prom.requests.Timeout("read timed out")
+            time.sleep(0.05 / (position + 1))
+            return [{"metric": {"__name__": query}, "values": [[1000, "1"], [1030, "NaN"]]}]
+        finally:
+            with self.lock:
+                type(self).active -= 1
+
+
+@pytest.fixture
+def prometheus(monkeypatch):
+    """Point get_prometheus_data at the fake Prometheus."""
+
+    monkeypatch.setenv("prom_token", "token")
+    monkeypatch.setenv("prom_url", "http://prometheus:9090")
+    monkeypatch.setenv("prom_query_workers", "4")
+    monkeypatch.setattr(prom, "PrometheusConnect", FakePrometheusConnect)
+    monkeypatch.setattr(prom, "_clients", {})
+    FakePrometheusConnect.max_active = 0
+    with open(LABELS_FILE) as labels_file:
+        return [item["query"] for item in json.load(labels_file)["data"].values()]
+
+
+def _trigger():
+    return {
+        "uuid": "uuid",
+        "user": "user",
+        "cluster_name": "cluster",
+        "starttime": "1000",
+        "endtime": "1060",
+        "tool": "unknown",
+        "test_config": {},
+    }
+
+
+def test_get_all_metrics_runs_queries_concurrently_in_stable_order(prometheus):
+    """Test that queries overlap while documents come out in include file order."""
+
+    docs = list(prom.get_prometheus_data(_trigger()).get_all_metrics())
+    assert [doc["metric"]["name"] for doc in docs[::2]] == prometheus
+    assert [doc["value"] for doc in docs[:2]] == [1.0, 0]
+    assert 1 < FakePrometheusConnect.max_active <= 4
+
+
+def test_get_all_metrics_skips_queries_which_time_out(prometheus, monkeypatch):
+    """Test that a hanging query is given up on after the query timeout, counted from its request."""
+
+    monkeypatch.setenv("prom_query_timeout", "0.3")
+    # every query waits behind the stuck one for a worker, none of them is given up on
+    monkeypatch.setenv("prom_query_workers", "1")
+    monkeypatch.setattr(FakePrometheusConnect, "stuck", prometheus[0])
+    beg = time.time()
+    docs = list(prom.get_prometheus_data(_trigger()).get_all_metrics())
+    assert time.time() - beg < 1.5
+    assert FakePrometheusConnect.active == 0
+    assert [doc["metric"]["name"] for doc in docs[::2]] == prometheus[1:]
+
+
+def test_get_all_metrics_splits_long_windows(prometheus, monkeypatch):
+    """Test that windows over the point limit are queried in chunks, whose documents come window by window."""
+
+    requested = []
+
+    def query_range(self, query, start, end, step, params=None, timeout=None):  # pylint: disable=W0613
+        step = int(step[:-1])
+        start, end = round(start.timestamp()), round(end.timestamp())
+        requested.append((end - start) // step + 1)
+        if query != prometheus[0]:
+            return []
+        return [
+            {
+                "metric": {"__name__": query, "instance": instance},
+                "values": [[ts, "1"] for ts in range(start, end + 1, step)],
+            }
+            for instance in ("a", "b")
+        ]
+
+    monkeypatch.setenv("prom_step", "2")
+    monkeypatch.setattr(FakePrometheusConnect, "custom_query_range", query_range)
+    trigger = _trigger()
+    trigger["endtime"] = str(1000 + 2 * 12000)
+    docs = [
+        doc
+        for doc in prom.get_prometheus_data(trigger).get_all_metrics()
+        if doc["metric_name"] == "Average_Disk_IOPS_Read"
+    ]
+    assert max(requested) <= prom._MAX_POINTS_PER_SERIES  # pylint: disable=W0212
+    assert sum(requested) == 12001 * len(prometheus)
+    first_series = [doc["Date"] for doc in docs if doc["metric"]["instance"] == "a"]
+    assert len(first_series) == 12001 and first_series == sorted(set(first_series))
+    assert [doc["metric"]["instance"] for doc in docs] == ["a"] * 11000 + ["b"] * 11000 + ["a"] * 1001 + [
+        "b"
+    ] * 1001
+
+
+def test_get_all_metrics_reuses_cached_results_offline(prometheus, monkeypatch, tmpdir):
+    """Test that cached windows give the same documents without querying Prometheus again."""
+
+    monkeypatch.setenv("prom_cache_dir", str(tmpdir))
+    first = list(prom.get_prometheus_data(_trigger()).get_all_metrics())
+
+    def offline(*args, **kwargs):
+        raise AssertionError("Prometheus was queried")
+
+    monkeypatch.setattr(FakePrometheusConnect, "custom_query_range", offline)
+    assert list(prom.get_prometheus_data(_trigger()).get_all_metrics()) == first
+
+
+def test_get_summaries_gives_one_document_per_series(prometheus, monkeypatch):
+    """Test that summary mode computes per-series statistics and per-metric totals over finite points."""
+
+    def query_range(self, query, start, end, step, params=None, timeout=None):  # pylint: disable=W0613
+        return [
+            {
+                "metric": {"__name__": query, "instance": "a"},
+                "values": [[1000, "1"], [1030, "3"], [1060, "NaN"]],
+            },
+            {"metric": {"__name__": query, "instance": "b"}, "values": [[1000, "5"], [1030, "7"]]},
+        ]
+
+    monkeypatch.setattr(FakePrometheusConnect, "custom_query_range", query_range)
+    series_docs, metrics = prom.get_prometheus_data(_trigger()).get_summaries()
+    assert len(series_docs) == 2 * len(prometheus)
+    first = series_docs[0]
+    assert (first["metric"]["name"], first["metric"]["instance"]) == (prometheus[0], "a")
+    assert (first["points"], first["min"], first["max"], first["mean"]) == (2, 1.0, 3.0, 2.0)
+    assert (first["integral"], first["rate"]) == (60.0, 2 / 30)
+    assert first["uuid"] == "uuid" and "value" not in first
+    summary = metrics[first["metric_name"]]
+    assert (summary["series"], summary["points"], summary["mean"], summary["max"]) == (2, 4, 4.0, 7.0)
+    assert summary["integral"] == 60.0 + 180.0
+
+
+def test_streamed_responses_give_the_same_documents(prometheus, monkeypatch):
+    """Test that streamed responses decoded in small chunks give the documents of whole responses."""
+
+    def response_body(query):
+        series = [
+            {
+                "metric": {"__name__": query, "pod": f"pod-é{num}"},
+                "values": [[1000, str(num)], [1030, "+Inf"]],
+            }
+            for num in range(50)
+        ]
+        return json.dumps({"status": "success", "data": {"resultType": "matrix", "result": series}})
+
+    class FakeResponse:
+        """Streamed response sent in chunks of 7 bytes."""
+
+        read = 0
+
+        def __init__(self, query):
+            self.body = response_body(query).encode()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def raise_for_status(self):
+            """Never fail."""
+
+        def iter_content(self, chunk_size):  # pylint: disable=W0613
+            """Yield the body in small chunks, splitting multi-byte characters."""
+            for pos in range(0, len(self.body), 7):
+                type(self).read += 1
+                yield self.body[pos : pos + 7]
+
+        def json(self):
+            """Decode the whole body."""
+            return json.loads(self.body)
+
+    class FakeSession:  # pylint: disable=R0903
+        """Session answering every range query with a streamed response."""
+
+        verify = True
+        timeouts = []
+
+        def get(self, url, params, timeout, **kwargs):  # pylint: disable=W0613
+            """Return the streamed response of the query."""
+            self.timeouts.append(timeout)
+            return FakeResponse(params["query"])
+
+    def query_range(self, query, start, end, step, params=None, timeout=None):  # pylint: disable=W0613
+        return json.loads(response_body(query))["data"]["result"]
+
+    monkeypatch.setattr(FakePrometheusConnect, "custom_query_range", query_range)
+    monkeypatch.setattr(prom.requests, "Session", FakeSession)
+    whole = list(prom.get_prometheus_data(_trigger()).get_all_metrics())
+    monkeypatch.setenv("prom_stream", "true")
+    streamed = list(prom.get_prometheus_data(_trigger()).get_all_metrics())
+    assert streamed == whole
+    # clients are shared by every trigger
+    assert prom.get_prometheus_data(_trigger()).session is prom.get_prometheus_data(_trigger()).session
+    assert prom.get_prometheus_data(_trigger()).pc is prom.get_prometheus_data(_trigger()).pc
+    assert len(streamed) == 100 * len(prometheus)
+    assert streamed[2]["metric"]["pod"] == "pod-é1"
+    assert [doc["value"] for doc in streamed[2:4]] == [1.0, 0]
+
+    # clients without a request timeout are bypassed
+    def old_query_range(self, query, start, end, step, params=None):  # pylint: disable=W0613
+        raise AssertionError("range query sent without a timeout")
+
+    monkeypatch.setenv("prom_stream", "false")
+    monkeypatch.setattr(FakePrometheusConnect, "custom_query_range", old_query_range)
+    assert list(prom.get_prometheus_data(_trigger()).get_all_metrics()) == whole
+    assert set(FakeSession.timeouts) == {120.0}
+
+    # documents come out as series are decoded, with a bounded number of queries sent ahead
+    monkeypatch.setenv("prom_stream", "true")
+    FakeSession.timeouts, FakeResponse.read = [], 0
+    docs = prom.get_prometheus_data(_trigger()).get_all_metrics()
+    assert next(docs)["metric"]["pod"] == "pod-é0"
+    assert FakeResponse.read < len(response_body(prometheus[0]).encode()) / 7 / 10
+    assert len(FakeSession.timeouts) <= 5 < len(prometheus)
+    docs.close()
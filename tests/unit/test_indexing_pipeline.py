@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test functionality in the indexing_pipeline module."""
+import threading
+import time
+
+import pytest
+
+from snafu.utils import indexing_pipeline
+
+
+def _docs(num):
+    return [{"_id": str(i), "_index": "test", "_op_type": "create", "_source": '{"a":1}'} for i in range(num)]
+
+
+def test_bounded_document_queue_blocks_producer_when_full():
+    """Test that put blocks once either the document or byte bound is hit, until a get frees room."""
+
+    queue = indexing_pipeline.BoundedDocumentQueue(max_docs=2, max_bytes=100)
+    queue.put("a", 10)
+    queue.put("b", 10)
+
+    unblocked = threading.Event()
+
+    def producer():
+        queue.put("c", 10)
+        unblocked.set()
+
+    thread = threading.Thread(target=producer)
+    thread.start()
+    assert not unblocked.wait(0.2)
+    assert queue.get() == "a"
+    assert unblocked.wait(1)
+    thread.join()
+    assert queue.blocked_seconds > 0
+
+    queue = indexing_pipeline.BoundedDocumentQueue(max_docs=10, max_bytes=15)
+    # oversized documents are accepted on an empty queue
+    queue.put("big", 50)
+    assert queue.num_bytes == 50
+    assert queue.get() == "big"
+    assert queue.num_bytes == 0
+
+
+def test_indexing_pipeline_indexes_everything_and_combines_stats():
+    """Test that every document reaches a worker exactly once and the worker stats are combined."""
+
+    seen = []
+    lock = threading.Lock()
+
+    def fake_bulk(es, actions, parallel=False):
+        count = 0
+        for action in actions:
+            time.sleep(0.001)
+            with lock:
+                seen.append(action["_id"])
+            count += 1
+        return time.time(), time.time(), count, 0, 0, 1
+
+    pipeline = indexing_pipeline.IndexingPipeline(None, workers=3, max_docs=5, bulk=fake_bulk)
+    beg, end, successes, duplicates, failures, retries = pipeline.run(_docs(100))
+    assert sorted(seen, key=int) == [str(i) for i in range(100)]
+    assert (successes, duplicates, failures, retries) == (100, 0, 0, 3)
+    assert beg <= end
+
+
+def test_indexing_pipeline_surfaces_worker_failures():
+    """Test that a failing worker unblocks the producer and the error is raised to the caller."""
+
+    def failing_bulk(es, actions, parallel=False):
+        next(iter(actions))
+        raise RuntimeError("es is down")
+
+    pipeline = indexing_pipeline.IndexingPipeline(None, workers=1, max_docs=1, bulk=failing_bulk)
+    with pytest.raises(indexing_pipeline.PipelineError, match="es is down"):
+        pipeline.run(_docs(50))
+
+
+def test_indexing_pipeline_keeps_the_producer_exception():
+    """Test that a failing producer's exception is raised even when the indexer threads failed too."""
+
+    def failing_bulk(es, actions, parallel=False):
+        next(iter(actions))
+        raise RuntimeError("es is down")
+
+    def failing_producer():
+        yield from _docs(1)
+        # let the indexer fail before the producer does
+        time.sleep(0.2)
+        raise ValueError("benchmark failed")
+
+    pipeline = indexing_pipeline.IndexingPipeline(None, workers=1, max_docs=10, bulk=failing_bulk)
+    with pytest.raises(ValueError, match="benchmark failed"):
+        pipeline.run(failing_producer())
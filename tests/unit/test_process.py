@@ -2,8 +2,10 @@
 # -*- coding: utf-8 -*-
 """Test functionality in the process module."""
 import logging
+import os
 import shlex
 import subprocess
+import time
 
 import pytest
 
@@ -169,3 +171,187 @@ def test_sample_process_yields_appropriate_number_of_samples(tmpdir):
             assert sample.timeout == 10
             assert len(sample.failed) == 1
             assert sample.failed[0].rc == 1
+
+
+def test_live_process_yields_lines_while_running():
+    """Test that LiveProcess gives each line as soon as it is written, before the process exits."""
+
+    cmd = "echo 'first'; echo 'oops' >&2; sleep 0.5; echo 'second'"
+    with snafu.process.LiveProcess(cmd, shell=True, keep_output=True) as proc:
+        received = []
+        for stream, line in proc:
+            received.append((stream, line, proc.process.poll()))
+    assert sorted(received[:2]) == [("stderr", "oops\n", None), ("stdout", "first\n", None)]
+    assert received[2][:2] == ("stdout", "second\n")
+    assert proc.attempt.rc == 0
+    assert proc.attempt.hit_timeout is False
+    assert 0.5 < proc.attempt.time_seconds < 1
+    assert (proc.attempt.stdout, proc.attempt.stderr) == ("first\nsecond\n", "oops\n")
+
+
+def test_live_process_kills_process_after_timeout():
+    """Test that LiveProcess kills a process running past its timeout, keeping the output read so far."""
+
+    proc = snafu.process.LiveProcess(
+        shlex.split("python3 -u -c 'import time; print(1); time.sleep(5)'"), timeout=0.5
+    )
+    assert list(proc) == [("stdout", "1\n")]
+    assert proc.attempt.hit_timeout is True
+    assert proc.attempt.rc is None
+    assert proc.attempt.time_seconds == 0.5
+    assert proc.attempt.stdout is None
+
+
+def test_live_process_sample_retries_like_get_process_sample(tmpdir):
+    """Test that LiveProcessSample reruns a failed process, with the same sample as get_process_sample."""
+
+    test_file_path = tmpdir.join("testfile.txt").realpath()
+    cmd = f'echo -n "a" >> {test_file_path} ; grep "aaa" {test_file_path}'
+
+    live = snafu.process.LiveProcessSample(cmd, LOGGER, shell=True, retries=2, keep_output=True)
+    outputs = [(list(proc), proc.attempt.rc) for proc in live]
+    assert outputs == [([], 1), ([], 1), ([("stdout", "aaa\n")], 0)]
+    assert live.sample.success is True
+    assert live.sample.attempts == 3
+    assert len(live.sample.failed) == 2
+    assert live.sample.successful.stdout == "aaa\n"
+
+    live = snafu.process.LiveProcessSample(shlex.split("test 1 == 0"), LOGGER, retries=1)
+    assert [proc.attempt.rc for proc in live] == [None, None]
+    assert live.sample.success is False
+    assert live.sample.attempts == 2
+    assert [failed.rc for failed in live.sample.failed] == [1, 1]
+
+
+def test_process_runs_record_resource_usage():
+    """Test that both get_process_sample and LiveProcess record the resource usage of each run."""
+
+    cmd = shlex.split("python3 -c 'data = bytearray(200 * 1024 * 1024); sum(range(3 * 10 ** 6))'")
+    attempt = snafu.process.get_process_sample(cmd, LOGGER).successful
+    with snafu.process.LiveProcess(cmd) as proc:
+        pass
+
+    for run in (attempt, proc.attempt):
+        usage = run.usage()
+        assert set(usage) == {
+            "user_cpu_seconds",
+            "system_cpu_seconds",
+            "max_rss_kb",
+            "voluntary_context_switches",
+            "involuntary_context_switches",
+            "major_faults",
+            "minor_faults",
+            "block_input_ops",
+            "block_output_ops",
+        }
+        assert 0 < usage["user_cpu_seconds"] + usage["system_cpu_seconds"] <= run.time_seconds + 0.1
+        assert usage["minor_faults"] > 200 * 1024 / 4 * 0.9
+        # runs are reaped with wait4, so each one gets its own peak, not the peak of every child so far
+        assert run.max_rss_kb > 200 * 1024
+
+    small = shlex.split("python3 -c 'data = bytearray(20 * 1024 * 1024)'")
+    for _ in range(2):
+        assert 20 * 1024 < snafu.process.get_process_sample(small, LOGGER).successful.max_rss_kb < 200 * 1024
+        with snafu.process.LiveProcess(small) as proc:
+            pass
+        assert 20 * 1024 < proc.attempt.max_rss_kb < 200 * 1024
+    timed_out = snafu.process.get_process_sample("echo start; sleep 5", LOGGER, shell=True, timeout=0.2)
+    assert timed_out.failed[0].hit_timeout and timed_out.failed[0].stdout == "start\n"
+    assert timed_out.failed[0].max_rss_kb is not None
+
+
+def test_live_process_usage_when_its_process_was_polled():
+    """Test that processes polled before being reaped keep their own usage, unless poll reaped them."""
+
+    # a child peaking higher than the next ones, so the children usage has no peak for them
+    snafu.process.get_process_sample(shlex.split("python3 -c 'bytearray(200 * 1024 * 1024)'"), LOGGER)
+    small = shlex.split("python3 -c 'data = bytearray(20 * 1024 * 1024)'")
+
+    # leaving on an error kills the process without reaping it
+    with pytest.raises(RuntimeError):
+        with snafu.process.LiveProcess(small) as proc:
+            # wait for the process to exit, without reaping it
+            os.waitid(os.P_PID, proc.process.pid, os.WEXITED | os.WNOWAIT)
+            raise RuntimeError("parsing failed")
+    assert proc.attempt.rc == 0
+    assert 20 * 1024 < proc.attempt.max_rss_kb < 200 * 1024
+
+    # once poll reaped the process, its return code is kept and usage falls back to the children usage
+    with snafu.process.LiveProcess(small) as proc:
+        while proc.process.poll() is None:
+            time.sleep(0.01)
+    assert proc.attempt.rc == 0
+    assert proc.attempt.max_rss_kb is None
+    assert proc.attempt.minor_faults > 20 * 1024 / 4 * 0.9
+
+
+def test_benchmark_results_carry_the_usage_of_their_sample(make_uperf):
+    """Test that results created while processing a sample of Benchmark.sample_process carry its usage."""
+
+    uperf = make_uperf()
+    results = []
+    for sample in uperf.sample_process("exit 1", shell=True, num_samples=2):
+        results.append(uperf.create_new_result({"value": sample.success}, {}, "results").to_jsonable())
+    assert [result["value"] for result in results] == [False, False]
+    assert all(result["process_minor_faults"] > 0 for result in results)
+    assert "process_minor_faults" not in uperf.create_new_result({}, {}, "results").to_jsonable()
+
+
+def test_benchmark_samples_give_their_output_while_running(make_uperf):
+    """Test that Benchmark.sample_process hands out lines as they are read, keeping the output if asked."""
+
+    uperf = make_uperf()
+    received = []
+    cmd = "echo first; sleep 0.5; echo second >&2"
+    for sample in uperf.sample_process(
+        cmd, shell=True, on_output=lambda stream, line: received.append((stream, line, time.monotonic()))
+    ):
+        assert sample.successful.stdout == "first\n"
+    assert [(stream, line) for stream, line, _ in received] == [("stdout", "first\n"), ("stderr", "second\n")]
+    # the first line was read before the process was done
+    assert received[1][2] - received[0][2] > 0.4
+
+    samples = list(uperf.sample_process(cmd, shell=True, keep_output=False, num_samples=2))
+    assert [sample.successful.stdout for sample in samples] == [None, None]
+
+
+def test_placement_pins_process_and_moves_it_into_cgroup(tmpdir):
+    """Test that a placed process runs on the given CPUs, in the given cgroup, and records its placement."""
+
+    cpu = min(os.sched_getaffinity(0))
+    placement = snafu.process.Placement.new(cpus=str(cpu), cgroup="snafu", cgroup_root=str(tmpdir))
+    assert placement.metadata() == {"placement_cpus": [cpu], "placement_cgroup": str(tmpdir.join("snafu"))}
+    cmd = "python3 -c 'import os; print(sorted(os.sched_getaffinity(0)))'"
+    sample = snafu.process.get_process_sample(cmd, LOGGER, shell=True, placement=placement)
+    assert sample.successful.stdout == str([cpu]) + "\n"
+    # writing 0 into cgroup.procs moves the writing process, no pid is formatted in the child
+    assert tmpdir.join("snafu", "cgroup.procs").read() == "0"
+
+    assert snafu.process.Placement.new() is None
+    with pytest.raises(ValueError):
+        snafu.process.Placement.new(numa_node=4096)
+
+
+@pytest.mark.skipif(not os.path.isdir("/sys/devices/system/node/node0"), reason="requires NUMA support")
+def test_placement_binds_memory_to_numa_node():
+    """Test that a process placed on a NUMA node gets its CPUs and a memory policy bound to it."""
+
+    placement = snafu.process.Placement.new(numa_node=0)
+    with open("/sys/devices/system/node/node0/cpulist") as cpu_list:
+        assert placement.cpus == snafu.process.parse_cpu_list(cpu_list.read())
+    with snafu.process.LiveProcess(
+        shlex.split("head -n 1 /proc/self/numa_maps"), placement=placement
+    ) as proc:
+        lines = [line for _, line in proc]
+    assert " bind:0 " in lines[0]
+
+
+def test_benchmark_results_carry_their_placement(make_uperf, tmpdir):
+    """Test that Benchmark.sample_process places processes as configured and records it in results."""
+
+    uperf = make_uperf("--cpus", str(min(os.sched_getaffinity(0))), "--cgroup", str(tmpdir.join("snafu")))
+    for _ in uperf.sample_process("true", shell=True):
+        result = uperf.create_new_result({}, {}, "results").to_jsonable()
+    assert result["placement_cpus"] == [min(os.sched_getaffinity(0))]
+    assert result["placement_cgroup"] == str(tmpdir.join("snafu"))
+    assert tmpdir.join("snafu", "cgroup.procs").check()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the background Prometheus indexer and the shared Elasticsearch clients."""
+import threading
+
+from snafu.utils import es_client
+from snafu.utils.indexing_pipeline import IndexingPipeline
+from snafu.utils.prometheus_indexer import PrometheusIndexer
+
+
+class FakeMetrics:  # pylint: disable=R0903
+    """Stand-in for get_prometheus_data, blocking until released."""
+
+    release = threading.Event()
+
+    def __init__(self, trigger):
+        self.trigger = trigger
+
+    def get_all_metrics(self):
+        """Yield one metric per query of the trigger."""
+        self.release.wait()
+        if self.trigger["sample"] == "broken":
+            raise RuntimeError("prometheus unavailable")
+        for query in range(3):
+            yield {"sample": self.trigger["sample"], "query": query}
+
+
+def test_prometheus_indexer_flushes_every_trigger_at_close():
+    """Test that triggers return immediately and every metric is indexed once the indexer is closed."""
+
+    indexed = []
+
+    def fake_bulk(es, actions, parallel=False):  # pylint: disable=W0613
+        indexed.extend(actions)
+        return 0.0, 1.0, len(indexed), 0, 0, 0
+
+    finalize = lambda doc: {"_id": f"{doc['sample']}-{doc['query']}", "_source": "{}"}  # noqa: E731
+    indexer = PrometheusIndexer(IndexingPipeline(None, bulk=fake_bulk), finalize, fetch=FakeMetrics)
+    for sample in (1, "broken", 2):
+        indexer.submit({"sample": sample})
+    assert indexed == []
+    FakeMetrics.release.set()
+    stats = indexer.close()
+    assert stats[2] == 6
+    assert [doc["_id"] for doc in indexed] == ["1-0", "1-1", "1-2", "2-0", "2-1", "2-2"]
+
+
+def test_es_clients_are_shared_per_server_and_settings(monkeypatch):
+    """Test that clients are created once per server and TLS settings and closed together."""
+
+    created = []
+
+    class FakeClient:  # pylint: disable=R0903
+        """Client recording whether its connections were closed."""
+
+        def __init__(self):
+            self.closed = False
+            self.transport = self
+
+        def info(self):
+            """Answer the connection check."""
+            return {"cluster_name": "test"}
+
+        def close(self):
+            """Close the fake connections."""
+            self.closed = True
+
+    def fake_create(server, verify_cert=True, use_ssl=False):  # pylint: disable=W0613
+        created.append(FakeClient())
+        return created[-1]
+
+    monkeypatch.setattr(es_client, "create_es_client", fake_create)
+    first = es_client.get_es_client("http://es:9200")
+    assert es_client.get_es_client("http://es:9200") is first
+    assert es_client.get_es_client("http://es:9200", verify_cert=False) is not first
+    assert len(created) == 2
+    es_client.close_es_clients()
+    assert all(client.closed for client in created)
+    assert es_client.get_es_client("http://es:9200") is not first
+    es_client.close_es_clients()
+
+
+def test_prometheus_indexer_summarizes_right_away():
+    """Test that summaries are returned to the caller while their series documents are indexed."""
+
+    class FakeSummaries:  # pylint: disable=R0903
+        """Stand-in for get_prometheus_data in summary mode."""
+
+        def __init__(self, trigger):
+            self.trigger = trigger
+
+        def get_summaries(self):
+            """Return one series document and the summary of its metric."""
+            return [{"sample": self.trigger["sample"], "query": 0}], {"cpu": {"mean": 1.0}}
+
+    indexed = []
+
+    def fake_bulk(es, actions, parallel=False):  # pylint: disable=W0613
+        indexed.extend(actions)
+        return 0.0, 1.0, len(indexed), 0, 0, 0
+
+    finalize = lambda doc: {"_id": f"{doc['sample']}-{doc['query']}", "_source": "{}"}  # noqa: E731
+    indexer = PrometheusIndexer(IndexingPipeline(None, bulk=fake_bulk), finalize, fetch=FakeSummaries)
+    assert indexer.summarize({"sample": 1}) == {"cpu": {"mean": 1.0}}
+    indexer.close()
+    assert [doc["_id"] for doc in indexed] == ["1-0"]
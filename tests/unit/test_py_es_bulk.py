@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test functionality in the py_es_bulk module."""
+import json
+from collections import Counter
+
+import pytest
+from elasticsearch.serializer import JSONSerializer
+
+from snafu.utils import adaptive_bulk, py_es_bulk
+from snafu.utils.dedup_filter import AcknowledgedIds
+
+
+class FakeTransport:  # pylint: disable=R0903
+    """Minimal stand-in for the transport of an Elasticsearch client."""
+
+    serializer = JSONSerializer()
+
+
+class FakeES:
+    """
+    Fake Elasticsearch client answering bulk requests.
+
+    ``statuses`` maps document ids to a list of statuses which are returned in order on each attempt,
+    ids which run out of statuses (or are missing) are created successfully.
+    """
+
+    transport = FakeTransport()
+
+    def __init__(self, statuses=None):
+        self.statuses = {key: list(val) for key, val in (statuses or {}).items()}
+        self.attempts = Counter()
+        self.requests = 0
+
+    def bulk(self, body, *args, **kwargs):  # pylint: disable=W0613
+        """Answer every create action in the given NDJSON bulk body."""
+
+        self.requests += 1
+        lines = body.strip().split("\n")
+        items = []
+        for action_line in lines[::2]:
+            doc_id = json.loads(action_line)["create"]["_id"]
+            self.attempts[doc_id] += 1
+            pending = self.statuses.get(doc_id, [])
+            status = pending.pop(0) if pending else 201
+            items.append({"create": {"_id": doc_id, "status": status}})
+        return {"items": items, "errors": any(i["create"]["status"] >= 300 for i in items)}
+
+
+def _actions(num):
+    for i in range(num):
+        yield {"_id": str(i), "_index": "test", "_op_type": "create", "_source": {"value": i}}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """Don't actually sleep between retries."""
+    monkeypatch.setattr(py_es_bulk, "_calc_backoff_sleep", lambda backoff: 0)
+
+
+def test_streaming_bulk_counts_successes_duplicates_and_failures():
+    """Test the result counters for created, duplicate and rejected documents."""
+
+    es = FakeES({"1": [409], "2": [400]})
+    _, _, successes, duplicates, failures, retries = py_es_bulk.streaming_bulk(es, _actions(5))
+    assert (successes, duplicates, failures, retries) == (3, 1, 1, 0)
+
+
+def test_streaming_bulk_retries_documents_until_they_succeed():
+    """Test that retried documents are eventually indexed, including those in the last chunk."""
+
+    es = FakeES({"3": [503, 429], "499": [503]})
+    _, _, successes, duplicates, failures, retries = py_es_bulk.streaming_bulk(es, _actions(500))
+    assert (successes, duplicates, failures, retries) == (500, 0, 0, 3)
+    assert es.attempts["3"] == 3
+    assert es.attempts["499"] == 2
+
+
+def test_streaming_bulk_dead_letters_documents_after_max_attempts(tmpdir):
+    """Test that documents exceeding max_attempts are written to the dead-letter file."""
+
+    dead_letter = tmpdir.join("dead.ndjson")
+    es = FakeES({"0": [503] * 10, "1": [503]})
+    _, _, successes, _, failures, retries = py_es_bulk.streaming_bulk(
+        es, _actions(3), max_attempts=3, dead_letter_file=str(dead_letter)
+    )
+    assert (successes, failures, retries) == (2, 1, 3)
+    assert es.attempts["0"] == 3
+    lines = dead_letter.readlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["_id"] == "0"
+
+
+def test_streaming_bulk_gives_up_after_retry_deadline():
+    """Test that documents are no longer retried once the retry deadline has passed."""
+
+    es = FakeES({"0": [503] * 10})
+    _, _, successes, _, failures, _ = py_es_bulk.streaming_bulk(es, _actions(2), retry_deadline=0)
+    assert (successes, failures) == (1, 1)
+    assert es.attempts["0"] == 1
+
+
+def test_streaming_bulk_bounds_chunks_by_inflight_bytes():
+    """Test that the in-flight byte budget limits the size of bulk requests."""
+
+    es = FakeES()
+    _, _, successes, _, _, _ = py_es_bulk.streaming_bulk(es, _actions(100), max_inflight_bytes=400)
+    assert successes == 100
+    assert es.requests > 10
+
+
+def test_adaptive_parallel_bulk_indexes_in_order_and_backs_off_on_rejections():
+    """Test that the adaptive indexer keeps results in order, retries rejections and shrinks on them."""
+
+    es = FakeES({"10": [429], "20": [503, 503]})
+    _, _, successes, duplicates, failures, retries = py_es_bulk.streaming_bulk(
+        es, _actions(300), parallel=True, adaptive=True
+    )
+    assert (successes, duplicates, failures, retries) == (300, 0, 0, 3)
+
+
+def test_adaptive_bulk_controller_respects_bounds():
+    """Test that the AIMD controller never leaves its configured bounds."""
+
+    controller = adaptive_bulk.AdaptiveBulkController(
+        chunk_bytes=10, workers=1, min_chunk_bytes=5, max_chunk_bytes=20, max_workers=3, increase_bytes=4
+    )
+    for _ in range(20):
+        controller.record(latency=0.01, rejected=0)
+    assert (controller.chunk_bytes, controller.workers) == (20, 3)
+    for _ in range(20):
+        controller.record(latency=100, rejected=0)
+    assert (controller.chunk_bytes, controller.workers) == (5, 1)
+    assert controller.converged() == {"chunk_bytes": 5, "workers": 1}
+
+
+def test_streaming_bulk_skips_acknowledged_documents(tmpdir):
+    """Test that documents acknowledged by a previous run are counted as duplicates without being sent."""
+
+    seen_ids = AcknowledgedIds(str(tmpdir))
+    es = FakeES({"1": [409], "2": [400]})
+    _, _, successes, duplicates, failures, _ = py_es_bulk.streaming_bulk(es, _actions(5), seen_ids=seen_ids)
+    assert (successes, duplicates, failures) == (3, 1, 1)
+    assert len(seen_ids) == 4
+
+    es = FakeES()
+    _, _, successes, duplicates, failures, _ = py_es_bulk.streaming_bulk(es, _actions(6), seen_ids=seen_ids)
+    assert (successes, duplicates, failures) == (2, 4, 0)
+    assert set(es.attempts) == {"2", "5"}
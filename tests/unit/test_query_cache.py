@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test functionality in the query_cache module."""
+import os
+import time
+
+from snafu.utils.query_cache import QueryCache
+
+
+def test_query_cache_evicts_least_recently_used_entries(tmpdir):
+    """Test that entries read recently survive eviction while the oldest ones go."""
+
+    cache = QueryCache(str(tmpdir))
+    values = {key: [os.urandom(512).hex()] for key in ("a", "b", "c")}
+    for key, value in values.items():
+        cache.put(key, value)
+        time.sleep(0.01)
+    total = cache.size
+    cache.get("a")
+
+    # room for a bit more than the three entries, but not a fourth one
+    cache = QueryCache(str(tmpdir), max_bytes=total + 100)
+    assert cache.size == total
+    cache.put("d", values["a"])
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in ("a", "c")] == [values["a"], values["c"]]
+    assert cache.size <= cache.max_bytes
+    assert (cache.hits, cache.misses) == (2, 1)
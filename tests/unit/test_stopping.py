@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the adaptive sample count of benchmarks."""
+import pytest
+
+from snafu.benchmarks._stopping import StoppingRule
+from snafu.benchmarks.uperf.uperf import UperfConfig
+
+
+def test_stopping_rule_respects_sample_bounds():
+    """Test that the rule never stops before the minimum and always stops at the maximum."""
+
+    rule = StoppingRule("ops", min_samples=3, max_samples=5, target_cv=0.01)
+    decisions = []
+    for value in (100, 100, 100, 200, 50):
+        rule.add(value)
+        decisions.append(rule.decide())
+    assert [decision.stop for decision in decisions] == [False, False, True, False, True]
+    assert [decision.reason for decision in decisions] == [None, None, "cv", None, "max_samples"]
+    assert decisions[1].cv == 0.0
+    assert decisions[-1].cv > 0.01
+
+    with pytest.raises(ValueError):
+        StoppingRule("ops")
+    with pytest.raises(ValueError):
+        StoppingRule("ops", min_samples=4, max_samples=3, target_cv=0.1)
+
+
+def test_stopping_rule_confidence_interval_narrows_with_more_samples():
+    """Test that the bootstrap interval holds the mean and gets narrower as consistent samples come in."""
+
+    rule = StoppingRule("ops", min_samples=2, max_samples=50, target_ci_width=0.01, confidence=0.9)
+    widths = []
+    rule.add(99)
+    assert rule.decide().ci_width is None
+    for value in [101, 99] * 20:
+        rule.add(value)
+        decision = rule.decide()
+        assert decision.ci_low <= decision.mean <= decision.ci_high
+        widths.append(decision.ci_width)
+        if decision.stop:
+            break
+    assert decision.reason == "ci"
+    assert decision.samples < 40
+    assert widths[-1] <= 0.01 < widths[0]
+    assert rule.decide() == decision
+
+
+def test_benchmark_takes_samples_until_the_metric_is_stable(make_uperf):
+    """Test that Benchmark.sample_process stops once the per-sample means of the metric are stable."""
+
+    uperf = make_uperf(
+        "--adaptive-metric",
+        "norm_ops",
+        "--adaptive-min-samples",
+        "3",
+        "--adaptive-max-samples",
+        "4",
+        "--adaptive-target-cv",
+        "0.05",
+    )
+
+    def take_samples(per_sample):
+        samples = uperf.sample_process("true", shell=True, num_samples=1)
+        for sample_num, _ in enumerate(samples):
+            for value in per_sample[sample_num]:
+                uperf.create_new_result({"norm_ops": value, "norm_byte": 1}, {}, "results")
+        return uperf.stopping_summary
+
+    summary = take_samples([[50, 150], [104], [96, 100], [100]])
+    assert summary["values"] == [100.0, 104.0, 98.0]
+    assert (summary["stop"], summary["reason"], summary["samples"]) == (True, "cv", 3)
+    assert summary["ci_low"] <= summary["mean"] <= summary["ci_high"]
+
+    summary = take_samples([[100], [150], [100], [150]])
+    assert (summary["reason"], summary["samples"], summary["cv"] > 0.05) == ("max_samples", 4, True)
+    assert uperf.stopping_rule is None
+
+
+def test_compact_results_feed_the_stopping_rule(make_uperf):
+    """Test that the metric values held as arrays by compact results are used to decide on the next sample."""
+
+    uperf = make_uperf(
+        "--compact-points",
+        "2",
+        "--adaptive-metric",
+        "norm_ops",
+        "--adaptive-min-samples",
+        "2",
+        "--adaptive-max-samples",
+        "5",
+        "--adaptive-target-cv",
+        "0.05",
+    )
+    stdout = uperf.parse_stdout(
+        "running profile:stream-tcp-64-64-1 ...\n"
+        + "\n".join(
+            f"timestamp_ms:{1000 * num}.0 name:Txn2 nr_bytes:{64 * num} nr_ops:{num}" for num in range(1, 6)
+        )
+    )
+    stats = uperf.get_results_from_stdout(stdout)
+    for sample_num, _ in enumerate(uperf.sample_process("true", shell=True, num_samples=1)):
+        list(uperf.compact_results(stats, UperfConfig.new(stdout, uperf.config), sample_num))
+    expected = sum(stat.norm_ops for stat in stats) / len(stats)
+    assert uperf.stopping_summary["values"] == [expected, expected]
+    assert (uperf.stopping_summary["reason"], uperf.stopping_summary["samples"]) == ("cv", 2)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ("--adaptive-metric", "norm_ops"),
+        ("--adaptive-metric", "norm_ops", "--adaptive-target-cv", "0.05", "--adaptive-min-samples", "1"),
+    ],
+)
+def test_benchmark_refuses_to_run_with_invalid_adaptive_options(make_uperf, monkeypatch, caplog, args):
+    """Test that invalid adaptive options are reported before the benchmark is set up."""
+
+    uperf = make_uperf(*args)
+
+    def setup():
+        raise AssertionError("benchmark set up")
+
+    monkeypatch.setattr(uperf, "setup", setup)
+    assert list(uperf.run()) == []
+    assert "Invalid adaptive sampling options" in caplog.text
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the suite of tool invocations run from one snafu process."""
+import json
+import os
+import time
+
+import pytest
+
+import snafu.suite
+from snafu import run_snafu
+from snafu.suite import Invocation, SuiteRunner, load_suite, schedule
+from snafu.utils.archive import read_archive_lines
+from snafu.utils.documents import finalize_document
+
+
+def test_load_suite_and_schedule_validate_invocations(tmpdir):
+    """Test that invocations are parsed, grouped into stages, and rejected when they can't run together."""
+
+    suite = tmpdir.join("suite.yml")
+    suite.write(
+        "- tool: fio\n"
+        "  args: -H hosts -j '/tmp/fio job'\n"
+        "- {name: net, tool: uperf, args: [-s, 3], env: {uuid: 1234}, independent: true, cpus: 0-1}\n"
+        "- {tool: coremark-pro, independent: true, cpus: '2,3'}\n"
+    )
+    invocations = load_suite(str(suite))
+    assert [invocation.name for invocation in invocations] == ["fio-0", "net", "coremark-pro-2"]
+    assert invocations[0].args == ["-H", "hosts", "-j", "/tmp/fio job"]
+    assert invocations[1].args == ["-s", "3"] and invocations[1].env == {"uuid": "1234"}
+    assert [len(stage) for stage in schedule(invocations)] == [1, 2]
+
+    invocations[2].cpus = "1-2"
+    with pytest.raises(ValueError, match="shares CPUs"):
+        schedule(invocations)
+    invocations[2].cpus = None
+    with pytest.raises(ValueError, match="needs cpus"):
+        schedule(invocations)
+
+    for content in ("tool: fio\n", "- {tool: fio, cpu: 1}\n", "- {tool: fio}\n- {tool: fio, name: fio-0}\n"):
+        suite.write(content)
+        with pytest.raises(ValueError):
+            load_suite(str(suite))
+
+
+def sleepy_documents(invocation):
+    """Documents of an invocation sleeping for the time given as its first argument."""
+
+    beg = time.time()
+    if invocation.tool == "fail":
+        raise RuntimeError("benchmark failed")
+    time.sleep(float(invocation.args[0]))
+    for num in range(3):
+        source = {
+            "num": num,
+            "pid": os.getpid(),
+            "ppid": os.getppid(),
+            "beg": beg,
+            "end": time.time(),
+            "env": os.environ.get("suite_test"),
+            "cpus": sorted(os.sched_getaffinity(0)),
+        }
+        yield finalize_document(source, f"snafu-{invocation.tool}-results", "NA")
+
+
+def test_suite_runner_runs_independent_invocations_concurrently():
+    """Test that stages run in order, their invocations concurrently, and that timings are summarized."""
+
+    cpus = sorted(os.sched_getaffinity(0))
+    first, second = str(cpus[0]), str(cpus[-1]) if len(cpus) > 1 else None
+    stages = [
+        [Invocation("first", "sleep", ["0.1"])],
+        [
+            Invocation("a", "sleep", ["0.5"], {"suite_test": "a"}, True, first),
+            Invocation("b", "sleep", ["0.5"], {"suite_test": "b"}, True, second),
+        ],
+        [Invocation("failing", "fail")],
+    ]
+    runner = SuiteRunner(stages, sleepy_documents)
+    documents = [json.loads(document["_source"]) for document in runner.run()]
+
+    assert len(documents) == 9
+    assert {document["pid"] for document in documents} != {os.getpid()}
+    # invocations are forked by the launcher of the suite
+    assert {document["ppid"] for document in documents} != {os.getpid()}
+    by_env = {document["env"]: document for document in documents if document["num"] == 0}
+    assert by_env["a"]["cpus"] == [int(first)]
+    # the concurrent invocations overlap, and start after the first stage
+    assert by_env["a"]["beg"] < by_env["b"]["end"] and by_env["b"]["beg"] < by_env["a"]["end"]
+    assert min(by_env["a"]["beg"], by_env["b"]["beg"]) >= by_env[None]["end"]
+
+    summary = runner.summary()
+    assert summary["failed"] == ["failing"]
+    assert [stage["invocations"] for stage in summary["stages"]] == [["first"], ["a", "b"], ["failing"]]
+    timings = {timing["name"]: timing for timing in summary["invocations"]}
+    assert timings["a"]["documents"] == 3 and timings["a"]["rc"] == 0
+    assert timings["failing"]["error"] == "RuntimeError: benchmark failed"
+    assert summary["concurrency_saved_seconds"] > 0.3
+    assert summary["wall_seconds"] >= sum(stage["wall_seconds"] for stage in summary["stages"]) - 0.01
+
+
+def many_documents(invocation):
+    """Documents made as fast as the suite takes them, giving when and by which process they were made."""
+
+    for num in range(int(invocation.args[0])):
+        yield {"num": num, "made": time.monotonic(), "ppid": os.getppid()}
+
+
+def test_suite_invocations_are_forked_by_the_launcher_and_wait_for_the_suite():
+    """Test that invocations aren't forked by the suite, and only get a bounded number of documents ahead."""
+
+    ahead = (snafu.suite._QUEUE_BATCHES + 2) * snafu.suite._BATCH_DOCS  # pylint: disable=W0212
+    runner = SuiteRunner([[Invocation("many", "many", [str(2 * ahead)])]], many_documents)
+    documents = runner.run()
+    first = next(documents)
+    time.sleep(0.5)
+    resumed = time.monotonic()
+    rest = list(documents)
+
+    assert first["ppid"] != os.getpid()
+    assert len(rest) == 2 * ahead - 1
+    # the invocation waited for the suite to take documents before making the later ones
+    assert rest[-1]["made"] > resumed
+    batch_docs = snafu.suite._BATCH_DOCS  # pylint: disable=W0212
+    assert all(document["made"] < resumed for document in rest[: batch_docs - 1])
+    assert runner.summary()["invocations"][0]["rc"] == 0
+
+
+def test_run_snafu_indexes_the_documents_of_a_suite_once(tmpdir, monkeypatch):
+    """Test that suite documents go through the pipeline of the suite, followed by its timing summary."""
+
+    monkeypatch.delenv("es", raising=False)
+    monkeypatch.setattr(run_snafu, "suite_documents", lambda invocation, run_id: sleepy_documents(invocation))
+    suite = tmpdir.join("suite.yml")
+    suite.write("- {tool: sleep, args: [0]}\n- {tool: other, args: [0]}\n")
+    export_dir = tmpdir.join("export")
+
+    result = run_snafu.run_agent_job(
+        "suite", ["--suite", str(suite), "--export", f"ndjson:{export_dir}"], {"suite_test": "env"}
+    )
+    assert result["rc"] == 0, result["error"]
+    assert result["counters"]["documents"] == 7
+    exported = [json.loads(line) for path in export_dir.listdir() for line in read_archive_lines(str(path))]
+    assert [document["_index"] for document in exported] == ["snafu-sleep-results"] * 3 + [
+        "snafu-other-results"
+    ] * 3 + ["snafu-suite-suite-summary"]
+    assert exported[0]["_source"]["env"] == "env"
+    summary = exported[-1]["_source"]
+    assert [timing["documents"] for timing in summary["invocations"]] == [3, 3]
+    assert summary["suite"] == str(suite)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the streaming summaries of benchmark metrics."""
+import numpy as np
+
+from snafu.benchmarks import Benchmark
+from snafu.benchmarks._summary import QuantileSketch, RunningStats
+
+
+def test_running_stats_and_sketch_match_numpy_when_merged():
+    """Test that stats and quantiles added one by one, in arrays and merged agree with numpy."""
+
+    rng = np.random.RandomState(0)
+    values = np.concatenate([rng.lognormal(3, 1, 5000), -rng.lognormal(0, 1, 500), np.zeros(100)])
+    rng.shuffle(values)
+
+    halves = []
+    for part in np.array_split(values, 2):
+        stats, sketch = RunningStats(), QuantileSketch(relative_accuracy=0.01)
+        for value in part[:100]:
+            stats.add(value)
+            sketch.add(value)
+        stats.add_many(part[100:])
+        sketch.add_many(np.append(part[100:], [np.nan, np.inf]))
+        halves.append((stats, sketch))
+    (stats, sketch), (other_stats, other_sketch) = halves
+    stats.merge(other_stats)
+    sketch.merge(other_sketch)
+
+    assert stats.count == sketch.count == len(values)
+    assert np.isclose(stats.mean, values.mean())
+    assert np.isclose(stats.stdev, values.std(ddof=1))
+    assert (stats.min, stats.max) == (values.min(), values.max())
+    ordered = np.sort(values)
+    for quantile in (0.01, 0.05, 0.5, 0.9, 0.99):
+        expected = ordered[int(quantile * (len(values) - 1))]
+        assert abs(sketch.quantile(quantile) - expected) <= 0.01 * abs(expected)
+
+
+def test_sketch_memory_is_bounded():
+    """Test that values spread over many orders of magnitude don't grow the sketch past its buckets."""
+
+    sketch = QuantileSketch(relative_accuracy=0.01, max_buckets=100)
+    sketch.add_many(np.logspace(-9, 12, 100000))
+    assert len(sketch.positive) == 100
+    assert sketch.count == 100000
+    # the largest values keep their accuracy
+    assert abs(sketch.quantile(0.99) - np.percentile(np.logspace(-9, 12, 100000), 99)) < 0.01 * 1e12
+
+
+class SummarizedBenchmark(Benchmark):
+    """Benchmark creating latency results, single and batched, for every sample."""
+
+    tool_name = "summarized_test"
+    summary_metrics = ("latency",)
+
+    def setup(self):
+        return True
+
+    def collect(self):
+        for sample_num, _ in enumerate(self.sample_process("true", shell=True, num_samples=2)):
+            yield self.create_new_result({"latency": 100.0 * (sample_num + 1)}, {}, "results")
+            latencies = np.full(999, 100.0 * (sample_num + 1))
+            yield self.create_new_batch({"latency": latencies}, {}, "results")
+
+    def cleanup(self):
+        return True
+
+
+def test_benchmark_run_yields_sample_and_run_summaries(make_benchmark):
+    """Test that summaries of declared metrics are yielded after each sample and at the end of the run."""
+
+    benchmark = make_benchmark(SummarizedBenchmark)
+
+    results = list(benchmark.run())
+    assert [result.tag for result in results] == ["results", "results", "summary"] * 2 + ["summary"]
+    summaries = [result.data for result in results if result.tag == "summary"]
+    assert [(data["scope"], data["sample"]) for data in summaries] == [
+        ("sample", 0),
+        ("sample", 1),
+        ("run", None),
+    ]
+    assert [data["latency_count"] for data in summaries] == [1000, 1000, 2000]
+    assert summaries[1]["latency_mean"] == summaries[1]["latency_p99"] == 200.0
+    assert summaries[2]["latency_mean"] == 150.0
+    assert abs(summaries[2]["latency_p50"] - 100.0) <= 1.0
+    assert summaries[0]["latency_stdev"] == 0.0
+    assert results[2].to_jsonable()["uuid"] == "1234"
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the host telemetry sampler."""
+from snafu.telemetry import METRICS, ProcReader, TelemetrySampler
+
+
+def write_proc(root, busy, idle, available_kb, rx_bytes, read_sectors, io_stall_us):
+    """Write the counters read by ProcReader into a fake procfs."""
+
+    root.join("stat").write(f"cpu  {busy} 0 0 {idle} 0 0 0 0 0 0\ncpu0 1 2 3 4 5 6 7 8 0 0\n")
+    root.join("meminfo").write(
+        f"MemTotal:       1000 kB\nMemFree:       10 kB\nMemAvailable:   {available_kb} kB\n"
+    )
+    root.join("net", "dev").write(
+        "Inter-|   Receive |  Transmit\n face |bytes    packets|bytes    packets\n"
+        f"    lo: 999 1 0 0 0 0 0 0 999 1 0 0 0 0 0 0\n  eth0: {rx_bytes} 1 0 0 0 0 0 0 5 1 0 0 0 0 0 0\n",
+        ensure=True,
+    )
+    root.join("diskstats").write(
+        f"   7       0 loop0 1 0 999 0 0 0 999 0 0 0 0\n 252       0 vda 1 0 {read_sectors} 0 0 0 0 0 0 0 0\n"
+    )
+    root.join("pressure", "io").write(
+        f"some avg10=0.00 avg60=0.00 avg300=0.00 total={io_stall_us}\n"
+        "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n",
+        ensure=True,
+    )
+
+
+def test_proc_reader_sums_whole_devices_and_skips_missing_files(tmpdir):
+    """Test that counters are read from every source, leaving loopback, loop devices and missing files out."""
+
+    write_proc(tmpdir, 30, 70, 250, 4096, 8, 1000)
+    sys_block = tmpdir.mkdir("block")
+    sys_block.mkdir("vda")
+    sys_block.mkdir("loop0")
+    counters = ProcReader(str(tmpdir), str(sys_block)).read()
+    assert counters == {
+        "cpu_total": 100.0,
+        "cpu_idle": 70.0,
+        "mem_total_kb": 1000.0,
+        "mem_available_kb": 250.0,
+        "net_rx_bytes": 4096.0,
+        "net_tx_bytes": 5.0,
+        "disk_read_sectors": 8.0,
+        "disk_write_sectors": 0.0,
+        "pressure_io_us": 1000.0,
+    }
+
+
+def test_sampler_reports_utilisation_per_sample(tmpdir, monkeypatch):
+    """Test that counter deltas are turned into per-sample time series and summaries."""
+
+    write_proc(tmpdir, 0, 0, 1000, 0, 0, 0)
+    clock = iter(range(100, 200, 2))
+    monkeypatch.setattr("snafu.telemetry.time.time", lambda: float(next(clock)))
+    sampler = TelemetrySampler(3600, ProcReader(str(tmpdir), str(tmpdir.join("missing"))))
+    sampler.start()
+    sampler.mark_sample(0)
+    write_proc(tmpdir, 50, 50, 500, 2000, 4, 500000)
+    sampler.tick()
+    write_proc(tmpdir, 150, 50, 250, 4000, 4, 500000)
+    sampler.stop()
+
+    documents = list(sampler.documents())
+    assert [(tag, doc["sample"]) for tag, doc in documents] == [
+        ("telemetry", None),
+        ("telemetry-summary", None),
+        ("telemetry", 0),
+        ("telemetry-summary", 0),
+    ]
+    series, summary = documents[2][1], documents[3][1]
+    assert series["count"] == summary["count"] == 2
+    assert series["cpu_util_percent"] == [50.0, 100.0]
+    assert series["mem_used_percent"] == [50.0, 75.0]
+    assert series["net_rx_bytes_per_sec"] == [1000.0, 1000.0]
+    assert series["disk_read_bytes_per_sec"] == [1024.0, 0.0]
+    assert series["pressure_io_percent"] == [25.0, 0.0]
+    assert series["pressure_cpu_percent"] == [None, None]
+    assert summary["cpu_util_percent_mean"] == 75.0
+    assert summary["mem_used_percent_max"] == 75.0
+    assert summary["pressure_memory_percent_mean"] is None
+    assert set(f"{name}_max" for name in METRICS) < set(summary)
+    assert summary["sampler_ticks"] == 4
+    assert summary["sampler_overhead_seconds"] > 0
+
+
+def test_benchmark_samples_are_marked_in_telemetry(make_uperf):
+    """Test that Benchmark.sample_process attributes the time spent in each sample to its number."""
+
+    uperf = make_uperf()
+    uperf.telemetry = TelemetrySampler(0.05).start()
+    samples = list(uperf.sample_process("sleep 0.2", shell=True, num_samples=2))
+    uperf.telemetry.stop()
+    assert all(sample.success for sample in samples)
+    summaries = [doc for tag, doc in uperf.telemetry.documents() if tag == "telemetry-summary"]
+    assert [doc["sample"] for doc in summaries] == [None, 0, 1]
+    assert all(doc["count"] >= 3 for doc in summaries[1:])
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test the compact time series mode and the benchmarks using it."""
+import pytest
+
+from snafu.benchmarks.uperf.uperf import UperfConfig
+from snafu.fio_wrapper.trigger_fio import _trigger_fio
+from snafu.utils.documents import serialize_source
+from snafu.utils.timeseries import compact_series
+
+
+def test_compact_series_batches_points():
+    """Test that points are split into batches of arrays carrying the series fields."""
+
+    points = [{"ts": ts, "value": ts % 3} for ts in range(10)]
+    batches = list(compact_series("abc", {"host": "h1"}, points, 4, time_field="ts"))
+    assert [batch["count"] for batch in batches] == [4, 4, 2]
+    assert [(batch["start"], batch["end"]) for batch in batches] == [(0, 3), (4, 7), (8, 9)]
+    assert sum((batch["value"] for batch in batches), []) == [point["value"] for point in points]
+    assert all(batch["manifest_id"] == "abc" and batch["host"] == "h1" for batch in batches)
+    with pytest.raises(ValueError):
+        list(compact_series("abc", {}, points, 0))
+
+
+def test_fio_compact_logs_keep_every_point_in_fewer_bytes(tmpdir):
+    """Test that compact fio logs hold the same points as per-line documents in far fewer bytes."""
+
+    with open(tmpdir.join("iops_iops.1.log.h1"), "w") as log_file:
+        for num in range(1000):
+            log_file.write(f"{num * 1000}, {500 + num}, {num % 2}, 4096, {num * 4096}\n")
+    jobs = {"global": {"numjobs": "1", "write_iops_log": "iops", "gtod_reduce": None, "disable_lat": None}}
+    jobs["job"] = {"gtod_reduce": None, "disable_lat": None, "rw": "randrw", "bs": "4k", "size": "1g"}
+    trigger = _trigger_fio(["job"], "cluster", str(tmpdir), jobs, "hosts", "user", "uuid", 1, None)
+    trigger.hosts = ["h1"]
+    trigger.compact_points = 100
+
+    legacy = trigger._log_payload(str(tmpdir), {"h1": 0}, "job", None)  # pylint: disable=W0212
+    compact = trigger._compact_log_payload(str(tmpdir), {"h1": 0}, "job")  # pylint: disable=W0212
+    (manifest, _), *batches = compact
+    assert [index for _, index in compact] == ["log-manifest"] + ["log-series"] * 10
+    assert all(batch["manifest_id"] == manifest["manifest_id"] for batch, _ in batches)
+    assert sum((batch["iops"] for batch, _ in batches), []) == [doc["iops"] for doc in legacy]
+    assert sum((batch["timestamp"] for batch, _ in batches), []) == [doc["timestamp"] for doc in legacy]
+
+    legacy_bytes = sum(len(serialize_source(doc)) for doc in legacy)
+    compact_bytes = sum(len(serialize_source(doc)) for doc, _ in compact)
+    assert compact_bytes * 3 < legacy_bytes
+
+
+def test_uperf_compact_results(make_uperf):
+    """Test that uperf yields a manifest with the config followed by compact results."""
+
+    uperf = make_uperf("--compact-points", "2")
+    stdout = uperf.parse_stdout(
+        "running profile:stream-tcp-64-64-1 ...\n"
+        + "\n".join(
+            f"timestamp_ms:{1000 * num}.0 name:Txn2 nr_bytes:{64 * num * num} nr_ops:{num * num}"
+            for num in range(1, 8)
+        )
+    )
+    stats = uperf.get_results_from_stdout(stdout)
+    manifest, *results = uperf.compact_results(stats, UperfConfig.new(stdout, uperf.config), 0)
+    assert manifest.tag == "manifest"
+    assert (manifest.data["protocol"], manifest.data["kind"]) == ("tcp", "pod")
+    assert [result.tag for result in results] == ["results-compact"] * 3
+    assert sum((result.data["norm_ops"] for result in results), []) == [stat.norm_ops for stat in stats]
+    assert all(result.data["manifest_id"] == manifest.data["manifest_id"] for result in results)
+    assert "protocol" not in results[0].to_jsonable()
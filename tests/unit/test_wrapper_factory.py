@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Test that benchmark wrappers are only imported once selected."""
+import subprocess
+import sys
+
+from snafu.utils import wrapper_factory
+
+# dependencies of legacy wrappers which are slow to import
+HEAVY_MODULES = ("boto3", "kafka", "kubernetes", "openshift", "redis", "scipy", "flent")
+
+
+def imported_modules(statement):
+    """Return the import time in microseconds of every module imported by the given statement."""
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_run_snafu_imports_no_wrapper_at_startup():
+    """Test that importing run_snafu leaves every wrapper and benchmark module, and their dependencies out."""
+
+    modules = imported_modules("import snafu.run_snafu")
+    assert "snafu.run_snafu" in modules
+    wrappers = [module.split(":")[0] for module in wrapper_factory.wrapper_dict.values()]
+    assert not set(wrappers) & set(modules)
+    assert not {"snafu.benchmarks.uperf", "snafu.benchmarks.coremarkpro"} & set(modules)
+    assert not set(HEAVY_MODULES) & set(modules)
+
+
+def test_wrapper_factory_imports_the_selected_tool_only():
+    """Test that selecting a tool imports its wrapper module and nothing of the other wrappers."""
+
+    modules = imported_modules(
+        "from snafu.utils.wrapper_factory import import_wrapper; "
+        "assert import_wrapper('stressng').__name__ == 'stressng_wrapper'; "
+        "assert import_wrapper('nope') is None"
+    )
+    # modules imported through importlib aren't reported by importtime, only what they import
+    assert "snafu.stressng_wrapper.trigger_stressng" in modules
+    assert "snafu.fio_wrapper.trigger_fio" not in modules
+    assert not set(HEAVY_MODULES) & set(modules)
+
+
+def test_wrapper_factory_loads_benchmarks_on_demand():
+    """Test that new-style benchmarks are imported when selected, and unknown tools are rejected."""
+
+    uperf = wrapper_factory.wrapper_factory("uperf", None)
+    assert uperf.tool_name == "uperf"
+    assert wrapper_factory.wrapper_factory("nope", None) == 1